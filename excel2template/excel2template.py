@@ -7,17 +7,79 @@
 # This software is released under the MIT License.
 # -------------------------------------------------
 
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import json
-from collections import defaultdict
+from collections import defaultdict, Counter, namedtuple
+from contextlib import contextmanager, redirect_stdout, nullcontext
 from openpyxl import load_workbook, reader
-from datetime import datetime
+from openpyxl.cell.read_only import EMPTY_CELL
+from openpyxl.utils import range_boundaries, get_column_letter
+from openpyxl.utils.datetime import to_excel
+from openpyxl.formula import Tokenizer
+from openpyxl.formula.tokenizer import Token
+from datetime import datetime, date, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 from dateutil import parser
 import re
+import string
+from re import _parser as sre_parse, _constants as sre_constants
+import sys
+import signal
+import threading
+from time import monotonic
+import functools
+import multiprocessing
+import atexit
 import argparse
+import sqlite3
+import difflib
+import csv
+import weakref
+import zipfile
+import tempfile
+import shutil
+import io
+import keyword
+from urllib.parse import quote, unquote
 
 reader.excel.warnings.simplefilter("ignore")
 
+# 用語シート（key_nameとIDの対応一覧）のシート名と、用語名を格納する列名
+GENERAL_TERM_SHEET = "sample.general_sample_term"
+SPECIFIC_TERM_SHEET = "sample.specific_sample_term"
+TERM_NAME_COLUMNS = {
+    GENERAL_TERM_SHEET: "dict.term.name_ja",
+    SPECIFIC_TERM_SHEET: "bind_class_and_term_ja",
+}
+
+# 出力ファイルごとに、読み込む必要があるシート（出力順）
+OUTPUT_SHEETS = {
+    "metadata-def.json": ("要件定義(metadata-def.json)",),
+    "invoice.schema.json": (
+        "要件定義(invoice.schema.json)",
+        GENERAL_TERM_SHEET,
+        SPECIFIC_TERM_SHEET,
+    ),
+    "invoice.json": (
+        "要件定義(invoice.schema.json)",
+        GENERAL_TERM_SHEET,
+        SPECIFIC_TERM_SHEET,
+    ),
+    "catalog.schema.json": ("要件定義(catalog.schema.json)",),
+    "catalog.json": ("要件定義(catalog.schema.json)",),
+}
+
+# 指定した場合のみ出力するファイルと、読み込む必要があるシート
+OPTIONAL_OUTPUT_SHEETS = {
+    "metadata_mapper.py": ("要件定義(metadata-def.json)",),
+    "invoice_records.py": (
+        "要件定義(invoice.schema.json)",
+        GENERAL_TERM_SHEET,
+        SPECIFIC_TERM_SHEET,
+    ),
+    "catalog_records.py": ("要件定義(catalog.schema.json)",),
+}
+
 
 class ExcelError(Exception):
     pass
@@ -30,6 +92,182 @@ def json_dump(jdata, filepath, indent=4):
         json.dump(jdata, f, indent=indent, ensure_ascii=False)
 
 
+class JsonStreamWriter:
+    """JSONを要素ごとに書き出すクラス（json.dumpと同じ整形で出力する）"""
+
+    def __init__(self, f, indent=4):
+        self.f = f
+        self.indent = indent
+        # 書き出し中のobject/arrayごとに、閉じ括弧と要素を書き出したかどうかを保持する
+        self._stack = []
+
+    def _begin_item(self, key):
+        """要素の区切りとキーを書き出し、書き出した文字列を返す機能"""
+        text = ""
+        if self._stack:
+            top = self._stack[-1]
+            text += ",\n" if top[1] else "\n"
+            top[1] = True
+            text += " " * (self.indent * len(self._stack))
+        if key is not None:
+            text += json.dumps(key, ensure_ascii=False) + ": "
+        self.f.write(text)
+        return text
+
+    def begin_object(self, key=None):
+        """objectの書き出しを始める機能（arrayの要素の場合はkeyを省略する）"""
+        self._begin_item(key)
+        self.f.write("{")
+        self._stack.append(["}", False])
+
+    def begin_array(self, key=None):
+        """arrayの書き出しを始める機能（arrayの要素の場合はkeyを省略する）"""
+        self._begin_item(key)
+        self.f.write("[")
+        self._stack.append(["]", False])
+
+    def end(self):
+        """書き出し中のobject/arrayを閉じる機能"""
+        close, has_items = self._stack.pop()
+        if has_items:
+            self.f.write("\n" + " " * (self.indent * len(self._stack)))
+        self.f.write(close)
+
+    def dumps(self, value):
+        """値を、現在の位置に書き出す場合と同じ整形の文字列にする機能"""
+        text = json.dumps(value, indent=self.indent, ensure_ascii=False)
+        return text.replace("\n", "\n" + " " * (self.indent * len(self._stack)))
+
+    def write(self, key, value):
+        """要素を1つ書き出し、書き出した文字列を返す機能（arrayの要素の場合はkeyをNoneとする）"""
+        prefix = self._begin_item(key)
+        text = self.dumps(value)
+        self.f.write(text)
+        return prefix + text
+
+
+@contextmanager
+def output_file(filepath):
+    """一時ファイルに書き出し、完了後に出力先へ置き換える機能（失敗した場合は出力しない）"""
+    # zipファイル内の出力先の場合は、完了後にzipファイルへ追加する
+    if isinstance(filepath, ArchivePath):
+        with filepath.archive.open_member(filepath.member) as f:
+            yield f
+        print(f" - {filepath.name}を出力します。")
+        return
+
+    tmp = filepath.with_name(filepath.name + ".tmp")
+    try:
+        with open(tmp, "w", encoding="utf_8") as f:
+            yield f
+        tmp.replace(filepath)
+    finally:
+        tmp.unlink(missing_ok=True)
+    print(f" - {filepath.name}を出力します。")
+
+
+@contextmanager
+def json_stream(filepath, indent=4):
+    """JsonStreamWriterで一時ファイルに書き出し、完了後に出力先へ置き換える機能"""
+    with output_file(filepath) as f:
+        yield JsonStreamWriter(f, indent)
+
+
+# zipファイルの入出力で、メモリ上に保持する大きさの上限（超えた分は一時ファイルに書き出す）
+SPOOL_SIZE = 64 * 1024 * 1024
+
+# zipファイルに書き込むメンバーの日時（同じ入力から同じzipファイルを出力するため固定する）
+ARCHIVE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class ArchivePath:
+    """zipファイル内の出力先を、変換処理からPathと同様に扱うためのクラス"""
+
+    def __init__(self, archive, member):
+        self.archive = archive
+        self.member = member
+
+    @property
+    def name(self):
+        return PurePosixPath(self.member).name
+
+    @property
+    def parent(self):
+        return ArchivePath(self.archive, PurePosixPath(self.member).parent.as_posix())
+
+    def joinpath(self, name):
+        return ArchivePath(self.archive, PurePosixPath(self.member, name).as_posix())
+
+    def mkdir(self, parents=False, exist_ok=False):
+        """zipファイル内ではフォルダを作成しない"""
+
+
+def output_size(filepath):
+    """出力したファイルのサイズ（バイト数）を返す機能（zipファイル内の出力先の場合は、圧縮前のサイズを返す）"""
+    if isinstance(filepath, ArchivePath):
+        return filepath.archive.zf.getinfo(filepath.member).file_size
+    return filepath.stat().st_size
+
+
+class ArchiveOutput:
+    """出力するJSONと失敗の一覧を、zipファイル（"-"の場合は標準出力）に書き込むクラス
+
+    メンバーは書き込んだ順に並び、日時は固定する。失敗の一覧は最後にreport_nameとして書き込む。
+    """
+
+    report_name = "conversion-report.json"
+
+    def __init__(self, target):
+        self.to_stdout = str(target) == "-"
+        self._file = sys.stdout.buffer if self.to_stdout else open(target, "wb")
+        self.zf = zipfile.ZipFile(self._file, "w", zipfile.ZIP_DEFLATED)
+        self.report = []
+
+    def path(self, member):
+        """zipファイル内の出力先を返す機能"""
+        return ArchivePath(self, member)
+
+    def start(self, name):
+        """入力ファイル1つ分の記録を始める機能"""
+        self.report.append({"file": name, "outputs": [], "errors": []})
+
+    def add_error(self, output, error):
+        """失敗を記録する機能（outputはファイルを開けない場合はNone）"""
+        self.report[-1]["errors"].append({"output": output, "message": str(error)})
+
+    def _write_member(self, member, src):
+        info = zipfile.ZipInfo(member, date_time=ARCHIVE_DATE_TIME)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        with self.zf.open(info, "w") as dst:
+            shutil.copyfileobj(src, dst)
+
+    @contextmanager
+    def open_member(self, member):
+        """メンバーを一時領域に書き出し、完了した場合のみzipファイルに追加する機能"""
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as tmp:
+            f = io.TextIOWrapper(tmp, encoding="utf_8", newline="")
+            try:
+                yield f
+                f.flush()
+                tmp.seek(0)
+                self._write_member(member, tmp)
+            finally:
+                f.detach()
+        if self.report:
+            self.report[-1]["outputs"].append(member)
+
+    def close(self):
+        """失敗の一覧を書き込み、zipファイルを閉じる機能"""
+        text = json.dumps({"files": self.report}, indent=4, ensure_ascii=False)
+        self._write_member(self.report_name, io.BytesIO(text.encode("utf_8")))
+        self.zf.close()
+        if self.to_stdout:
+            self._file.flush()
+        else:
+            self._file.close()
+
+
 def convert_value(dtype, value):
     """dtypeにあわせて値の型を変換する機能"""
     if dtype == "string":
@@ -56,23 +294,35 @@ def check_value(value, boolean=False):
 
 def get_dup_columns(d, col_name):
     """指定する列（col_name）で重複する値を返す機能"""
-    vals = [x[col_name] for x in d]
-    dup = set([x for x in vals if vals.count(x) > 1])
-    return dup
+    counts = Counter(x[col_name] for x in d)
+    return {k for k, c in counts.items() if c > 1}
 
 
-def check_dup_params(d, category_name, outfile):
+class DupTracker:
+    """1行ずつ渡される値のうち、重複する値を記録するクラス"""
+
+    def __init__(self):
+        self.seen = set()
+        self.dup = set()
+
+    def add(self, value):
+        if value in self.seen:
+            self.dup.add(value)
+        else:
+            self.seen.add(value)
+
+
+def raise_dup_params(dup_params, category_name, outfile):
     """重複するパラメータがあればエラーを出す機能"""
-    dup_params = get_dup_columns(d, "parameter_name")
     if dup_params:
         raise ExcelError(
             f"要件定義（{outfile.name}）シートの{category_name=}について、重複する行が確認されました: {dup_params}"
         )
 
 
-def get_sheet_name(d):
-    """key_nameとIDの対応一覧シートのシート名を取得する機能"""
-    return f"{'.'.join(d[0]['key_name'].split('.')[:2])}_sample_term"
+def check_dup_params(d, category_name, outfile):
+    """重複するパラメータがあればエラーを出す機能"""
+    raise_dup_params(get_dup_columns(d, "parameter_name"), category_name, outfile)
 
 
 def dtype_is_expected(dtype, expected_dtypes):
@@ -83,25 +333,139 @@ def dtype_is_expected(dtype, expected_dtypes):
         return False
 
 
-def get_validated_value(param, d, expected_dtypes, outfile):
+# type列に指定できる型
+DTYPES = ("boolean", "integer", "number", "string")
+
+
+def validate_dtype(dtype, expected_dtypes=DTYPES):
+    """type列の値が、変換できる型（expected_dtypesのいずれか）か確認する機能"""
+    if not dtype_is_expected(dtype, expected_dtypes):
+        raise ExcelError(
+            f"type列の値は、{'/'.join(expected_dtypes)}のいずれかとしてください。"
+            f"type={dtype}"
+        )
+
+
+def is_number(v):
+    """値が（真偽値でない）数値か確認する機能"""
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def dtype_matches(dtype, v):
+    """型を変換した値が、typeに一致するか確認する機能"""
+    if dtype == "boolean":
+        return isinstance(v, bool)
+    if dtype == "integer":
+        return is_number(v) and float(v).is_integer()
+    if dtype == "number":
+        return is_number(v)
+    return isinstance(v, str)
+
+
+def enum_info(values):
+    """enumの値を表示する文字列にする機能（値が多い場合は先頭の10件のみ表示する）"""
+    info = ", ".join(map(str, values[:10]))
+    if len(values) > 10:
+        info += f", ...（全{len(values)}件）"
+    return info
+
+
+def property_value_problems(v, prop, name="JSONに格納される値"):
+    """値がプロパティの固定値・値のリスト・数値の範囲・文字数の範囲・正規表現に合うか調べ、問題を1件ずつ返す機能
+
+    propは、invoice.schema.json・catalog.schema.jsonの1つ分のプロパティ（値はtypeに変換済み）とする。
+    enumには、値の一覧のほか、値の有無を集合で確認できるEnumValuesも指定できる。
+    値がない（None）場合は、固定値と値のリストのみ調べる。
+    """
+    if "const" in prop and v != prop["const"]:
+        yield f"{name}とconstの値が異なります。{name}={v}, const={prop['const']}"
+    enum = prop.get("enum")
+    if enum and v not in enum:
+        yield f"{name}が、enumの値に含まれていません。enum=[{enum_info(enum)}]"
+    if v is None:
+        return
+
+    dtype = prop.get("type")
+    if dtype in ("number", "integer") and is_number(v):
+        bounds = {
+            k: prop[k]
+            for k in ("maximum", "exclusiveMaximum", "minimum", "exclusiveMinimum")
+            if is_number(prop.get(k))
+        }
+        if (
+            ("minimum" in bounds and v < bounds["minimum"])
+            or ("exclusiveMinimum" in bounds and v <= bounds["exclusiveMinimum"])
+            or ("maximum" in bounds and bounds["maximum"] < v)
+            or ("exclusiveMaximum" in bounds and bounds["exclusiveMaximum"] <= v)
+        ):
+            info = ", ".join(f"{k}={b}" for k, b in bounds.items())
+            yield f"{name}が指定された範囲外です。{name}={v}, {info}"
+
+    if dtype == "string" and isinstance(v, str):
+        lengths = {
+            k: prop[k] for k in ("maxLength", "minLength") if is_number(prop.get(k))
+        }
+        if not (
+            lengths.get("minLength", 0) <= len(v) <= lengths.get("maxLength", len(v))
+        ):
+            info = ", ".join(f"{k}={n}" for k, n in lengths.items())
+            yield f"{name}の文字数が指定された範囲外です。文字数={len(v)}, {info}"
+
+        # 正規表現（照合が終わらない場合などはExcelErrorを出す）
+        pattern = prop.get("pattern")
+        if isinstance(pattern, str) and not match_pattern(pattern, v):
+            yield f"{name}が指定された正規表現と一致しません。{name}={v}, 正規表現={pattern}"
+
+
+def _value_rules(d, enums):
+    """1行分の固定値・値のリスト・範囲・文字数・正規表現を、property_value_problemsの規則にする機能
+
+    値のリストは、ワークブックごとにtypeへ変換したEnumValuesをそのまま用いる。
+    """
+    dtype = d["type"]
+    rules = {"type": dtype}
+    if check_value(d["const"]):
+        rules["const"] = convert_value(dtype, d["const"])
+    enum = enums.get(d["enum"])
+    if enum:
+        rules["enum"] = enum.convert(dtype)
+    for key in ("maximum", "exclusiveMaximum", "minimum", "exclusiveMinimum"):
+        if check_value(d[key]):
+            rules[key] = float(d[key])
+    for key in ("maxLength", "minLength"):
+        if check_value(d[key]):
+            rules[key] = int(d[key])
+    if check_value(d["pattern"]):
+        rules["pattern"] = d["pattern"]
+    return rules
+
+
+def _raise_value_problem(v, rules, sheet_info):
+    """値が規則に合わない場合に、最初の問題をExcelErrorとして出す機能"""
+    try:
+        problem = next(property_value_problems(v, rules), None)
+    except ExcelError as e:
+        problem = e
+    if problem:
+        raise ExcelError(f"{problem}, {sheet_info}")
+
+
+def get_validated_value(param, d, expected_dtypes, outfile, enums):
     """JSONに格納すべき値を得る機能"""
     example = d["examples"] if check_value(d["examples"]) else None
     default = d["default"] if check_value(d["default"]) else None
     const = d["const"] if check_value(d["const"]) else None
-    enum = d["enum"].split(",") if check_value(d["enum"]) else None
     required = check_value(d["required"], boolean=True)
     format_v = d["format"]
-    pattern = d["pattern"] if check_value(d["pattern"]) else None
     dtype = d["type"]
     sheet = outfile.name
     sheet_info = f"parameter_name={param}, {example=}, {default=}, {const=}, {sheet=}"
 
     # dtypeが予想される型一覧に含まれる必要あり
-    if not dtype_is_expected(dtype, expected_dtypes):
-        raise ExcelError(
-            f"type列の値は、{'/'.join(expected_dtypes)}のいずれかとしてください。"
-            f"type={dtype}, {sheet_info}"
-        )
+    try:
+        validate_dtype(dtype, expected_dtypes)
+    except ExcelError as e:
+        raise ExcelError(f"{e}, {sheet_info}") from None
 
     # example列に値がない場合は、default列の値を採用する
     v = example if example else default
@@ -113,68 +477,26 @@ def get_validated_value(param, d, expected_dtypes, outfile):
             f"{required=}, {sheet_info}"
         )
 
-    # const列に値がある場合は、JSONに格納される値とconst列の値とが一致している必要あり
-    if const and v != const:
-        raise ExcelError(f"JSONに格納される値とconst列の値が異なります。{sheet_info}")
-    # enumに値がある場合は、vがenumに含まれる必要あり
-    if enum and v not in enum:
-        raise ExcelError(
-            "JSONに格納される値が、enumの値に含まれていません。"
-            f"{enum=}, {sheet_info}"
-        )
-
     # vの型をdtypeに変更する
-    if v:
+    has_value = bool(v)
+    if has_value:
         v = convert_value(dtype, v)
 
-        # dateフォーマットに整形する
-        if format_v == "date":
-            # vをdatetimeオブジェクトにパースする
-            date_obj = parser.parse(v)
-            # datetimeオブジェクトをyyyy-mm-dd形式の文字列に変換する
-            v = date_obj.strftime("%Y-%m-%d")
-
-    # vが数値の場合、vが与えられた範囲内か調べる
-    if v and dtype in ["number", "int"]:
-        nmax = float(d["maximum"]) if check_value(d["maximum"]) else None
-        exmax = (
-            float(d["exclusiveMaximum"]) if check_value(d["exclusiveMaximum"]) else None
-        )
-        nmin = float(d["minimum"]) if check_value(d["minimum"]) else None
-        exmin = (
-            float(d["exclusiveMinimum"]) if check_value(d["exclusiveMinimum"]) else None
-        )
-
-        if (
-            (nmin and v < nmin)
-            or (exmin and v <= exmin)
-            or (nmax and nmax < v)
-            or (exmax and exmax <= v)
-        ):
-            raise ExcelError(
-                "JSONに格納される値が指定された範囲外です。"
-                f"JSONに格納される値={v},  数値上限（以上）={nmax}, 数値上限（未満）={exmax}, "
-                f"数値下限（以上）={nmin}, 数値下限（より下）={exmin}, {sheet_info}"
-            )
+    # JSONに格納される値が、固定値・値のリスト・範囲・文字数・正規表現に合うか調べる
+    # （JSONに格納される値がない場合は、固定値・値のリストのみ調べる）
+    rules = _value_rules(d, enums)
+    # 固定値・値のリストは、dateフォーマットに整形する前の値で調べる
+    fixed = {k: rules.pop(k) for k in ("const", "enum") if k in rules}
+    _raise_value_problem(v if has_value else None, fixed, sheet_info)
 
-    # vが文字列の場合、文字数が与えられた範囲内か調べる
-    if v and dtype == "string":
-        smax = int(d["maxLength"]) if check_value(d["maxLength"]) else None
-        smin = int(d["minLength"]) if check_value(d["minLength"]) else None
-        slen = len(v)
-        if (smin and slen < smin) or (smax and smax < slen):
-            raise ExcelError(
-                "JSONに格納される値が指定された範囲外です。"
-                f"JSONに格納される値={v}, 最大文字数={smax}, 最小文字数={smin}, {sheet_info}"
-            )
+    # dateフォーマットに整形する
+    if has_value and format_v == "date":
+        # vをdatetimeオブジェクトにパースする
+        date_obj = parser.parse(v)
+        # datetimeオブジェクトをyyyy-mm-dd形式の文字列に変換する
+        v = date_obj.strftime("%Y-%m-%d")
 
-        # 正規表現での制限がある時、vが正規表現に一致するかどうかを調べる
-        # pattern = "\d{4}-\d{2}-\d{2}"
-        if pattern and not re.match(pattern, v):
-            raise ExcelError(
-                "JSONに格納される値が指定された正規表現と一致しません。"
-                f"JSONに格納される値={v}, 正規表現={pattern}, {sheet_info}"
-            )
+    _raise_value_problem(v if has_value else None, rules, sheet_info)
 
     # requiredがFalse（上で判定済）で、vに何も格納されていない場合は、"null"を格納する
     v = "null" if not v else v
@@ -182,831 +504,2957 @@ def get_validated_value(param, d, expected_dtypes, outfile):
     return v
 
 
-def read_invoice_catalog_sheet(ws):
-    """invoiceとcatalogのシートからデータを取得する機能"""
-    common_data = defaultdict(str)
-    header = None
-    data = []
-    for row in ws.rows:
-        # ヘッダー部が未取得の場合
-        if header is None:
-            if row[0].value is None:
-                continue
-            elif not row[0].value == "header":
-                common_data[row[0].value] = str(row[1].value)
-        elif row[0].value == "ヘッダー":
+def _iter_invoice_catalog_rows(rows, header):
+    """invoiceとcatalogのシートのデータ部を、行番号とともに1行ずつ返す機能"""
+    category = None
+    for row_no, row in rows:
+        if row[0].value == "ヘッダー":
             continue
-        # ヘッダー部を取得後
-        else:
-            if not row[0].value is None:
-                category = row[0].value
-            data.append({
+        if not row[0].value is None:
+            category = row[0].value
+        yield (
+            row_no,
+            {
                 **{"category": category},
-                **{k.value: str(v.value) for k, v in zip(header, row[1:])},
-            })
+                **{k: str(v.value) for k, v in zip(header, row[1:])},
+            },
+        )
+
 
+def read_invoice_catalog_sheet_numbered(ws):
+    """invoiceとcatalogのシートからデータを取得する機能（データ部は行番号付きのジェネレータで返す）"""
+    common_data = defaultdict(str)
+    header = None
+    rows = enumerate(ws.rows, start=1)
+    # ヘッダー部までの共通部分を取得する
+    for _, row in rows:
+        if row[0].value is None:
+            continue
         # ヘッダー部の取得
-        if row[0].value == "header":
-            header = row[1:]
+        elif row[0].value == "header":
+            header = [c.value for c in row[1:]]
+            break
+        else:
+            common_data[row[0].value] = str(row[1].value)
 
+    data = _iter_invoice_catalog_rows(rows, header) if header else iter(())
     return common_data, header, data
 
 
+def read_invoice_catalog_sheet(ws):
+    """invoiceとcatalogのシートからデータを取得する機能（データ部はジェネレータで返す）"""
+    common_data, header, data = read_invoice_catalog_sheet_numbered(ws)
+    return common_data, header, (d for _, d in data)
+
+
+class SheetRows:
+    """invoiceとcatalogのシートのデータ部を、反復のたびにシートから読み直して返すクラス
+
+    全行をメモリに保持せずに、同じデータ部を複数回走査するために用いる。
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    def __iter__(self):
+        return read_invoice_catalog_sheet(self.ws)[2]
+
+
 def read_simple_sheet(ws, skipheader=0):
-    """metadefのシートからデータを取得する機能"""
-    data = []
+    """metadefのシートからデータを1行ずつ取得する機能"""
+    for _, d in read_simple_sheet_numbered(ws, skipheader):
+        yield d
+
+
+def read_simple_sheet_numbered(ws, skipheader=0):
+    """metadefのシートからデータを行番号とともに1行ずつ取得する機能"""
+    header = None
     for row in ws.rows:
         # 不要な行はスキップする
         if str(row[0]) == "<EmptyCell>":
             continue
         # 1行目をヘッダーとする
         elif row[0].row == 1:
-            header = row
+            header = [c.value for c in row]
         # skipheaderはスキップする
         elif row[0].row == skipheader:
             continue
         # 3行目以降は保存する
         else:
-            data.append({k.value: str(v.value) for k, v in zip(header, row)})
+            yield row[0].row, {k: str(v.value) for k, v in zip(header, row)}
 
-    return data
 
+class CsvCell:
+    """CSV/TSVファイルのセルを、読み取り専用のワークシートのセルと同様に扱うクラス"""
 
-def get_sheet(wb, sheet):
-    """シートを取得する機能"""
+    __slots__ = ("value", "row")
 
-    ws = False
-    if sheet in wb.sheetnames:
-        ws = wb[sheet]
-    else:
-        print(sheet + "のシートが存在しません。")
+    def __init__(self, value, row):
+        self.value = value
+        self.row = row
 
-    return ws
 
+class CsvSheet:
+    """CSV/TSVファイルを、読み取り専用のワークシートと同様に扱うクラス"""
 
-def sheet_check(wb, output_dir, sheet):
-    """対象シートの存在を確認する機能"""
-    # 対象のシート名
-    sheet_name = "要件定義(" + sheet + ")"
+    # Excelから出力した真偽値を、ワークブックから読み込んだ場合と同じ文字列にそろえる
+    bool_values = {"true": "True", "false": "False"}
 
-    # 対象シートがない場合はFalseを返す
-    ws = get_sheet(wb, sheet_name)
+    def __init__(self, path):
+        self.path = path
+        self.title = path.stem
+        self.delimiter = "\t" if path.suffix.lower() == ".tsv" else ","
+        self._max_column = None
 
-    if not ws:
-        return False, False
+    def _reader(self):
+        """ファイルを開いて、CSV/TSVの各行を返す機能"""
+        with open(self.path, newline="", encoding="utf_8_sig") as f:
+            yield from csv.reader(f, delimiter=self.delimiter)
 
-    # 対象シートがある場合はシートと出力ファイルパスを返す
-    outfile = output_dir.joinpath(sheet)
-    return ws, outfile
+    @property
+    def max_column(self):
+        if self._max_column is None:
+            self._max_column = max(
+                (len(values) for values in self._reader()), default=0
+            )
+        return self._max_column
+
+    @property
+    def rows(self):
+        """各行をセルのタプルで返す機能（列数は最大の列数にそろえる）"""
+        for idx, values in enumerate(self._reader(), start=1):
+            values += [""] * (self.max_column - len(values))
+            # 全て空の行は、ワークブックの存在しない行と同様に扱う
+            if not any(values):
+                yield (EMPTY_CELL,) * self.max_column
+                continue
+            yield tuple(
+                CsvCell(self.bool_values.get(v.lower(), v) if v else None, idx)
+                for v in values
+            )
 
 
-def convert_metadata_def(wb, output_dir):
-    """metadata_defを出力する機能"""
+class CsvWorkbook:
+    """シート名のCSV/TSVファイルを格納したフォルダを、ワークブックと同様に扱うクラス"""
+
+    suffixes = (".csv", ".tsv")
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._files = {}
+        for f in sorted(self.path.iterdir()):
+            if f.suffix.lower() in self.suffixes:
+                self._files.setdefault(f.stem, f)
+
+    @property
+    def sheetnames(self):
+        return list(self._files)
+
+    def __getitem__(self, sheet):
+        return CsvSheet(self._files[sheet])
+
+    def close(self):
+        pass
+
+
+class FormulaUnsupported(Exception):
+    """評価できない数式（対応していない関数・構文、循環参照など）を表す例外"""
+
+
+class FormulaErrorValue(Exception):
+    """数式の評価結果がエラー値（#N/Aなど）になることを表す例外"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+# 二項演算子の優先順位（大きいほど先に評価する）
+FORMULA_PRECEDENCE = {
+    "=": 1,
+    "<>": 1,
+    "<": 1,
+    ">": 1,
+    "<=": 1,
+    ">=": 1,
+    "&": 2,
+    "+": 3,
+    "-": 3,
+    "*": 4,
+    "/": 4,
+    "^": 5,
+}
+
+# セル・範囲の参照（シート名!A1、A1:B2、A:B、1:2）
+FORMULA_REF = re.compile(
+    r"(?:(?:'(?P<quoted>(?:[^']|'')+)'|(?P<sheet>[^'!]+))!)?"
+    r"(?P<coord>\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?"
+    r"|\$?[A-Z]{1,3}:\$?[A-Z]{1,3}|\$?\d+:\$?\d+)",
+    re.IGNORECASE,
+)
+
+
+class FormulaRange(namedtuple("FormulaRange", "sheet min_col min_row max_col max_row")):
+    """数式で参照する範囲（行・列の番号は1から始まる）"""
+
+    @property
+    def is_cell(self):
+        return self.min_col == self.max_col and self.min_row == self.max_row
+
+
+def parse_formula(formula):
+    """数式を構文木（タプル）に変換する機能"""
+    tokens = [t for t in Tokenizer(formula).items if t.type != Token.WSPACE]
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def is_close(t):
+        return t is not None and t.type == Token.FUNC and t.subtype == Token.CLOSE
+
+    def take():
+        nonlocal pos
+        if pos >= len(tokens):
+            raise FormulaUnsupported("数式が途中で終わっています。")
+        pos += 1
+        return tokens[pos - 1]
+
+    def expr(min_prec):
+        left = unary()
+        while (t := peek()) is not None and t.type == Token.OP_IN:
+            prec = FORMULA_PRECEDENCE.get(t.value)
+            if prec is None:
+                raise FormulaUnsupported(f"演算子{t.value}には対応していません。")
+            if prec < min_prec:
+                break
+            take()
+            left = ("op", t.value, left, expr(prec + 1))
+        return left
+
+    def unary():
+        t = peek()
+        if t is not None and t.type == Token.OP_PRE:
+            take()
+            operand = unary()
+            return ("neg", operand) if t.value == "-" else operand
+        return postfix(primary())
+
+    def postfix(node):
+        while (t := peek()) is not None and t.type == Token.OP_POST:
+            take()
+            node = ("percent", node)
+        return node
+
+    def primary():
+        t = take()
+        if t.type == Token.OPERAND:
+            if t.subtype == Token.NUMBER:
+                return ("value", float(t.value))
+            if t.subtype == Token.TEXT:
+                return ("value", t.value[1:-1].replace('""', '"'))
+            if t.subtype == Token.LOGICAL:
+                return ("value", t.value.upper() == "TRUE")
+            if t.subtype == Token.ERROR:
+                return ("error", t.value)
+            if t.subtype == Token.RANGE:
+                return ("ref", t.value)
+        elif t.type == Token.FUNC and t.subtype == Token.OPEN:
+            name = t.value[:-1].upper().removeprefix("_XLFN.")
+            args = []
+            if is_close(peek()):
+                take()
+                return ("call", name, args)
+            while True:
+                nxt = peek()
+                if nxt is not None and (nxt.type == Token.SEP or is_close(nxt)):
+                    args.append(("missing",))
+                else:
+                    args.append(expr(0))
+                sep = take()
+                if is_close(sep):
+                    return ("call", name, args)
+                if sep.type != Token.SEP or sep.subtype != Token.ARG:
+                    raise FormulaUnsupported(f"{sep.value}には対応していません。")
+        elif t.type == Token.PAREN and t.subtype == Token.OPEN:
+            node = expr(0)
+            close = take()
+            if close.type != Token.PAREN:
+                raise FormulaUnsupported(f"{close.value}には対応していません。")
+            return node
+        raise FormulaUnsupported(f"{t.value}には対応していません。")
+
+    node = expr(0)
+    if pos != len(tokens):
+        raise FormulaUnsupported(f"{tokens[pos].value}には対応していません。")
+    return node
+
+
+# 数式では、Excelと同じくシリアル値として扱う日付・時刻の型
+FORMULA_DATE_TYPES = (datetime, date, time, timedelta)
+
+
+def _formula_value(v):
+    """セルの値を、数式で扱う型（数値・文字列・真偽値・None）にする機能（日付・時刻はシリアル値とする）"""
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    if isinstance(v, FORMULA_DATE_TYPES):
+        return to_excel(v)
+    raise FormulaUnsupported(f"{type(v).__name__}型の値は数式で扱えません。")
+
+
+def formula_number(v):
+    """数式の値を数値に変換する機能（空のセルは0とする）"""
+    v = _formula_value(v)
+    if isinstance(v, bool):
+        return int(v)
+    if isinstance(v, (int, float)):
+        return v
+    if v is None:
+        return 0
+    try:
+        return float(v)
+    except ValueError:
+        raise FormulaErrorValue("#VALUE!") from None
+
+
+def formula_text(v):
+    """数式の値を文字列に変換する機能（Excelの表示にあわせる）"""
+    v = _formula_value(v)
+    if v is None:
+        return ""
+    if isinstance(v, bool):
+        return "TRUE" if v else "FALSE"
+    if isinstance(v, float):
+        return str(int(v)) if v.is_integer() else f"{v:.15g}"
+    return str(v)
+
+
+def formula_bool(v):
+    """数式の値を真偽値に変換する機能"""
+    v = _formula_value(v)
+    if isinstance(v, bool):
+        return v
+    if isinstance(v, (int, float)):
+        return v != 0
+    if v is None:
+        return False
+    if v.upper() in ("TRUE", "FALSE"):
+        return v.upper() == "TRUE"
+    raise FormulaErrorValue("#VALUE!")
+
+
+def _formula_key(v):
+    """比較・検索に用いるキー（数値＜文字列＜真偽値の順、文字列は大文字小文字を区別しない）"""
+    v = _formula_value(v)
+    if isinstance(v, bool):
+        return (2, v)
+    if isinstance(v, (int, float)):
+        return (0, v)
+    return (1, v.lower())
+
+
+def _formula_compare(op, a, b):
+    """比較演算子を評価する機能（空のセルは相手の型の空の値とする）"""
+    if a is None:
+        a = "" if isinstance(b, str) else False if isinstance(b, bool) else 0
+    if b is None:
+        b = "" if isinstance(a, str) else False if isinstance(a, bool) else 0
+    a, b = _formula_key(a), _formula_key(b)
+    return {
+        "=": a == b,
+        "<>": a != b,
+        "<": a < b,
+        ">": a > b,
+        "<=": a <= b,
+        ">=": a >= b,
+    }[op]
+
+
+class FormulaEvaluator:
+    """キャッシュされた値がない数式を評価し、結果をワークブックごとに保持するクラス
+
+    参照先のシートは必要になった時に一度だけ読み込む。評価できない数式はreportで報告し、値をNoneとする。
+    """
+
+    # 対応している関数
+    functions = (
+        "IF",
+        "IFERROR",
+        "IFNA",
+        "AND",
+        "OR",
+        "NOT",
+        "CONCATENATE",
+        "CONCAT",
+        "VLOOKUP",
+        "INDEX",
+        "MATCH",
+        "SUM",
+        "ROUND",
+        "TRIM",
+        "UPPER",
+        "LOWER",
+        "LEN",
+    )
 
-    # シートのチェック
-    ws, outfile = sheet_check(wb, output_dir, "metadata-def.json")
+    def __init__(self, wb, wb_formulas):
+        self.wb = wb
+        self.wb_formulas = wb_formulas
+        # シートごとの値（キャッシュされた値、または数式以外の値）と、キャッシュされた値がない数式
+        self._sheets = {}
+        self._results = {}
+        self._parsed = {}
+        self._lookup_indexes = {}
+        self._evaluating = set()
+        self.unsupported = []
+        self.report = self.print_unsupported
+
+    @staticmethod
+    def print_unsupported(sheet, row, col, formula, error):
+        print(
+            f" - {sheet}!{get_column_letter(col)}{row}の数式{formula}を評価できません。"
+            f"原因: {error}"
+        )
 
-    # 対象シートがない場合は次の処理に移る
-    if not ws:
-        return None
+    def _sheet(self, title):
+        """シートの値と数式を読み込む機能（一度だけ読み込む）"""
+        if title not in self._sheets:
+            if title not in self.wb.sheetnames:
+                raise FormulaErrorValue("#REF!")
+            values, formulas = {}, {}
+            max_row = max_col = 0
+            rows = zip(self.wb[title].rows, self.wb_formulas[title].rows)
+            for row_no, (cells, formula_cells) in enumerate(rows, start=1):
+                for col_no, (c, f) in enumerate(zip(cells, formula_cells), start=1):
+                    if c.value is not None:
+                        values[row_no, col_no] = c.value
+                    elif is_formula(f.value):
+                        formulas[row_no, col_no] = f.value
+                    else:
+                        continue
+                    max_row = max(max_row, row_no)
+                    max_col = max(max_col, col_no)
+            self._sheets[title] = (values, formulas, max_row, max_col)
+        return self._sheets[title]
+
+    def value(self, sheet, row, col, formula=None):
+        """セルの値を返す機能（キャッシュされた値がない数式は評価し、評価できない場合はNoneを返す）"""
+        try:
+            return self._cell(sheet, row, col, formula)
+        except FormulaErrorValue as e:
+            return e.code
+        except FormulaUnsupported:
+            return None
+
+    def _cell(self, sheet, row, col, formula=None):
+        key = (sheet, row, col)
+        if key in self._results:
+            result = self._results[key]
+        else:
+            if formula is None:
+                values, formulas, _, _ = self._sheet(sheet)
+                formula = formulas.get((row, col))
+                if formula is None:
+                    return values.get((row, col))
+            result = self._evaluate_cell(key, formula)
+        if isinstance(result, FormulaErrorValue):
+            # 参照元の数式でもエラー値として扱う（IFERRORなどで判定できるようにする）
+            raise FormulaErrorValue(result.code)
+        if isinstance(result, FormulaUnsupported):
+            raise result
+        return result
+
+    def _evaluate_cell(self, key, formula):
+        """1つのセルの数式を評価し、結果を保持する機能"""
+        sheet, row, col = key
+        if key in self._evaluating:
+            raise FormulaUnsupported(
+                f"循環参照です。{sheet}!{get_column_letter(col)}{row}"
+            )
+        self._evaluating.add(key)
+        try:
+            if formula not in self._parsed:
+                self._parsed[formula] = parse_formula(formula)
+            result = self._scalar(self._eval(self._parsed[formula], sheet))
+            if isinstance(result, float) and result.is_integer():
+                result = int(result)
+        except FormulaErrorValue as e:
+            result = e
+        except (FormulaUnsupported, RecursionError) as e:
+            self.unsupported.append((sheet, row, col, formula, str(e)))
+            self.report(sheet, row, col, formula, e)
+            # 参照元の数式も評価できないものとする
+            result = FormulaUnsupported(
+                f"参照先の数式を評価できません。{sheet}!{get_column_letter(col)}{row}"
+            )
+        finally:
+            self._evaluating.discard(key)
+        self._results[key] = result
+        return result
+
+    def _ref(self, text, sheet):
+        """参照（または名前付き範囲）をFormulaRangeにする機能"""
+        m = FORMULA_REF.fullmatch(text)
+        if m is None:
+            defined_names = getattr(self.wb, "defined_names", {})
+            if text not in defined_names:
+                raise FormulaUnsupported(f"参照{text}を解釈できません。")
+            destinations = list(defined_names[text].destinations)
+            if len(destinations) != 1:
+                raise FormulaUnsupported(f"名前付き範囲{text}を解釈できません。")
+            sheet, coord = destinations[0]
+        else:
+            if m["quoted"]:
+                sheet = m["quoted"].replace("''", "'")
+            elif m["sheet"]:
+                sheet = m["sheet"]
+            coord = m["coord"]
+        min_col, min_row, max_col, max_row = range_boundaries(coord.replace("$", ""))
+        if min_row is None or min_col is None:
+            _, _, sheet_max_row, sheet_max_col = self._sheet(sheet)
+            min_row, max_row = min_row or 1, max_row or sheet_max_row
+            min_col, max_col = min_col or 1, max_col or sheet_max_col
+        return FormulaRange(sheet, min_col, min_row, max_col, max_row)
+
+    def _scalar(self, v):
+        """範囲を1つのセルの値にする機能"""
+        if isinstance(v, FormulaRange):
+            if not v.is_cell:
+                raise FormulaErrorValue("#VALUE!")
+            return self._cell(v.sheet, v.min_row, v.min_col)
+        return v
+
+    def _eval(self, node, sheet):
+        kind = node[0]
+        if kind == "value":
+            return node[1]
+        if kind == "missing":
+            return None
+        if kind == "error":
+            raise FormulaErrorValue(node[1])
+        if kind == "ref":
+            return self._ref(node[1], sheet)
+        if kind == "neg":
+            return -formula_number(self._scalar(self._eval(node[1], sheet)))
+        if kind == "percent":
+            return formula_number(self._scalar(self._eval(node[1], sheet))) / 100
+        if kind == "op":
+            _, op, left, right = node
+            a = self._scalar(self._eval(left, sheet))
+            b = self._scalar(self._eval(right, sheet))
+            if op == "&":
+                return formula_text(a) + formula_text(b)
+            if op in ("+", "-", "*", "/", "^"):
+                a, b = formula_number(a), formula_number(b)
+                if op == "+":
+                    return a + b
+                if op == "-":
+                    return a - b
+                if op == "*":
+                    return a * b
+                if op == "/":
+                    if b == 0:
+                        raise FormulaErrorValue("#DIV/0!")
+                    return a / b
+                return float(a) ** b
+            return _formula_compare(op, a, b)
+        if kind == "call":
+            _, name, args = node
+            if name not in self.functions:
+                raise FormulaUnsupported(f"関数{name}には対応していません。")
+            return getattr(self, "_fn_" + name.lower())(args, sheet)
+        raise FormulaUnsupported(f"{kind}には対応していません。")
+
+    @staticmethod
+    def _args(args, n_min, n_max):
+        """引数の数を確認する機能"""
+        if not n_min <= len(args) <= n_max:
+            raise FormulaErrorValue("#VALUE!")
+        return args
+
+    def _range_values(self, rng):
+        """範囲内のセルの値を1つずつ返す機能"""
+        for row in range(rng.min_row, rng.max_row + 1):
+            for col in range(rng.min_col, rng.max_col + 1):
+                yield self._cell(rng.sheet, row, col)
+
+    def _values(self, args, sheet):
+        """引数の値を、範囲は展開して1つずつ返す機能"""
+        for arg in args:
+            v = self._eval(arg, sheet)
+            if isinstance(v, FormulaRange):
+                yield from self._range_values(v)
+            else:
+                yield v
+
+    def _fn_if(self, args, sheet):
+        cond, *branches = self._args(args, 2, 3)
+        if formula_bool(self._scalar(self._eval(cond, sheet))):
+            return self._scalar(self._eval(branches[0], sheet))
+        if len(branches) == 1:
+            return False
+        return self._scalar(self._eval(branches[1], sheet))
+
+    def _fn_iferror(self, args, sheet, codes=None):
+        value, fallback = self._args(args, 2, 2)
+        try:
+            return self._scalar(self._eval(value, sheet))
+        except FormulaErrorValue as e:
+            if codes is not None and e.code not in codes:
+                raise
+            return self._scalar(self._eval(fallback, sheet))
+
+    def _fn_ifna(self, args, sheet):
+        return self._fn_iferror(args, sheet, ("#N/A",))
+
+    def _fn_and(self, args, sheet):
+        values = [formula_bool(v) for v in self._values(args, sheet) if v is not None]
+        return all(values)
+
+    def _fn_or(self, args, sheet):
+        values = [formula_bool(v) for v in self._values(args, sheet) if v is not None]
+        return any(values)
+
+    def _fn_not(self, args, sheet):
+        (value,) = self._args(args, 1, 1)
+        return not formula_bool(self._scalar(self._eval(value, sheet)))
+
+    def _fn_concatenate(self, args, sheet):
+        return "".join(
+            formula_text(self._scalar(self._eval(arg, sheet))) for arg in args
+        )
 
-    # Excelからデータを読み込む
-    data = read_simple_sheet(ws, skipheader=2)
+    def _fn_concat(self, args, sheet):
+        return "".join(formula_text(v) for v in self._values(args, sheet))
+
+    def _fn_sum(self, args, sheet):
+        total = 0
+        for arg in args:
+            v = self._eval(arg, sheet)
+            if isinstance(v, FormulaRange):
+                # 範囲内の文字列・真偽値・空のセルは無視する（日付・時刻はシリアル値とする）
+                total += sum(
+                    x
+                    for x in map(_formula_value, self._range_values(v))
+                    if isinstance(x, (int, float)) and not isinstance(x, bool)
+                )
+            else:
+                total += formula_number(v)
+        return total
+
+    def _fn_round(self, args, sheet):
+        value, digits = self._args(args, 2, 2)
+        value = formula_number(self._scalar(self._eval(value, sheet)))
+        digits = int(formula_number(self._scalar(self._eval(digits, sheet))))
+        # Excelと同じく、0.5は0から遠い方に丸める
+        rounded = Decimal(repr(value)).quantize(
+            Decimal(1).scaleb(-digits), ROUND_HALF_UP
+        )
+        return float(rounded)
 
-    # json形式で整理する
-    jdata = defaultdict(dict)
-    order = 0
-    for d in data:
-        if d["output"] == "OFF":
-            continue
+    def _text_fn(self, args, sheet, func):
+        (value,) = self._args(args, 1, 1)
+        return func(formula_text(self._scalar(self._eval(value, sheet))))
 
-        order += 1
-        jdata[d["parameter_name"]]["name"] = defaultdict(dict)
-        jdata[d["parameter_name"]]["schema"] = defaultdict(dict)
-
-        # 項目名(日本語)
-        jdata[d["parameter_name"]]["name"]["ja"] = d["name/ja"]
-        # 項目名(英語)
-        jdata[d["parameter_name"]]["name"]["en"] = d["name/en"]
-        # データ型
-        jdata[d["parameter_name"]]["schema"]["type"] = d["type"]
-        # 表示順序
-        jdata[d["parameter_name"]]["order"] = order
-        # フォーマット
-        if check_value(d["format"]):
-            jdata[d["parameter_name"]]["schema"]["format"] = d["format"]
-        # 単位
-        if check_value(d["unit"]):
-            jdata[d["parameter_name"]]["unit"] = d["unit"]
-        # 説明
-        if check_value(d["description"]):
-            jdata[d["parameter_name"]]["description"] = d["description"]
-        # URI
-        if check_value(d["uri"]):
-            jdata[d["parameter_name"]]["uri"] = d["uri"]
-        # 測定モード
-        if check_value(d["mode"]):
-            jdata[d["parameter_name"]]["mode"] = d["mode"]
-        # Variable
-        if check_value(d["variable"], boolean=True):
-            jdata[d["parameter_name"]]["variable"] = 1
-        # 固定値
-        if check_value(d["default"], boolean=True):
-            jdata[d["parameter_name"]]["default"] = convert_value(
-                d["type"], d["sample"]
-            )
-        # 装置出力
-        if check_value(d["original_name"]):
-            jdata[d["parameter_name"]]["original_name"] = d["original_name"]
+    def _fn_trim(self, args, sheet):
+        return self._text_fn(
+            args, sheet, lambda s: " ".join(filter(None, s.split(" ")))
+        )
 
-    # JSON形式で出力
-    json_dump(jdata, outfile)
+    def _fn_upper(self, args, sheet):
+        return self._text_fn(args, sheet, str.upper)
 
+    def _fn_lower(self, args, sheet):
+        return self._text_fn(args, sheet, str.lower)
 
-def _read_invoice_src_sheets(wb, output_dir, sheet_name):
-    """引数で指定するシートと、2つのID対応表シートを読み込んで内容を返す機能"""
+    def _fn_len(self, args, sheet):
+        return self._text_fn(args, sheet, len)
 
-    # 一般項目の用語シートの取得
-    ws_gt = get_sheet(wb, "sample.general_sample_term")
+    def _range_arg(self, node, sheet):
+        v = self._eval(node, sheet)
+        if not isinstance(v, FormulaRange):
+            raise FormulaErrorValue("#VALUE!")
+        return v
 
-    # 分類別項目の用語シートの取得
-    ws_st = get_sheet(wb, "sample.specific_sample_term")
+    def _int_arg(self, node, sheet):
+        return int(formula_number(self._scalar(self._eval(node, sheet))))
 
-    # 事前準備するシートがない場合は次の処理に移る
-    if (not ws_st) or (not ws_gt):
-        return None
+    def _lookup(self, value, rng, by_row, exact):
+        """1行・1列の範囲から値を探し、範囲内の位置（0から始まる）を返す機能
 
-    # シートのチェック
-    ws, outfile = sheet_check(wb, output_dir, sheet_name)
+        完全一致の場合は、範囲ごとの索引をワークブックごとに一度だけ作成する。
+        近似一致の場合は、昇順に並んだ値のうち、探す値以下で最後の位置を返す。
+        """
+        if by_row:
+            cells = [(rng.min_row, col) for col in range(rng.min_col, rng.max_col + 1)]
+        else:
+            cells = [(row, rng.min_col) for row in range(rng.min_row, rng.max_row + 1)]
+        if value is None:
+            raise FormulaErrorValue("#N/A")
+        key = _formula_key(value)
+        if exact:
+            index_key = (rng.sheet, tuple(cells[:1]), len(cells), by_row)
+            index = self._lookup_indexes.get(index_key)
+            if index is None:
+                index = {}
+                for i, (row, col) in enumerate(cells):
+                    v = self._cell(rng.sheet, row, col)
+                    if v is not None:
+                        index.setdefault(_formula_key(v), i)
+                self._lookup_indexes[index_key] = index
+            if key not in index:
+                raise FormulaErrorValue("#N/A")
+            return index[key]
+        found = None
+        for i, (row, col) in enumerate(cells):
+            v = self._cell(rng.sheet, row, col)
+            if v is None:
+                continue
+            k = _formula_key(v)
+            if k[0] != key[0]:
+                continue
+            if k > key:
+                break
+            found = i
+        if found is None:
+            raise FormulaErrorValue("#N/A")
+        return found
+
+    def _fn_vlookup(self, args, sheet):
+        value, rng, col, *approx = self._args(args, 3, 4)
+        value = self._scalar(self._eval(value, sheet))
+        rng = self._range_arg(rng, sheet)
+        col = self._int_arg(col, sheet)
+        exact = bool(approx) and not formula_bool(
+            self._scalar(self._eval(approx[0], sheet))
+        )
+        if col < 1:
+            raise FormulaErrorValue("#VALUE!")
+        if col > rng.max_col - rng.min_col + 1:
+            raise FormulaErrorValue("#REF!")
+        i = self._lookup(value, rng, False, exact)
+        return self._cell(rng.sheet, rng.min_row + i, rng.min_col + col - 1)
+
+    def _fn_match(self, args, sheet):
+        value, rng, *match_type = self._args(args, 2, 3)
+        value = self._scalar(self._eval(value, sheet))
+        rng = self._range_arg(rng, sheet)
+        match_type = self._int_arg(match_type[0], sheet) if match_type else 1
+        if rng.min_row != rng.max_row and rng.min_col != rng.max_col:
+            raise FormulaErrorValue("#N/A")
+        if match_type not in (0, 1):
+            raise FormulaUnsupported("MATCHの照合の種類は0または1としてください。")
+        by_row = rng.min_row == rng.max_row and rng.min_col != rng.max_col
+        return self._lookup(value, rng, by_row, match_type == 0) + 1
+
+    def _fn_index(self, args, sheet):
+        rng, row, *col = self._args(args, 2, 3)
+        rng = self._range_arg(rng, sheet)
+        row = self._int_arg(row, sheet)
+        n_rows = rng.max_row - rng.min_row + 1
+        n_cols = rng.max_col - rng.min_col + 1
+        if col:
+            col = self._int_arg(col[0], sheet)
+        elif n_rows == 1:
+            row, col = 1, row
+        elif n_cols == 1:
+            col = 1
+        else:
+            raise FormulaUnsupported(
+                "INDEXで行または列の全体を返す形には対応していません。"
+            )
+        if not (1 <= row <= n_rows and 1 <= col <= n_cols):
+            raise FormulaErrorValue("#REF!")
+        return self._cell(rng.sheet, rng.min_row + row - 1, rng.min_col + col - 1)
 
-    # 対象シートがない場合は次の処理に移る
-    if not ws:
-        return None
 
-    # Excelからデータを読み込む
-    common_data, header, data = read_invoice_catalog_sheet(ws)
-    data_gt = read_simple_sheet(ws_gt)
-    data_st = read_simple_sheet(ws_st)
+def is_formula(value):
+    """セルの値が、評価の対象とする数式か確認する機能"""
+    return isinstance(value, str) and value.startswith("=") and len(value) > 1
 
-    # key_nameに重複がないかチェック
-    dup_keys = get_dup_columns(data_gt, "key_name")
-    if dup_keys:
-        sheet_name = get_sheet_name(data_gt)
-        raise ExcelError(f"{sheet_name}に複数の {dup_keys}（key_name）が存在します")
 
-    dup_keys = get_dup_columns(data_st, "key_name")
-    if dup_keys:
-        sheet_name = get_sheet_name(data_st)
+class FormulaCell:
+    """評価した数式の値を、読み取り専用のワークシートのセルと同様に扱うクラス"""
 
-    return common_data, data, data_gt, data_st, outfile
+    __slots__ = ("value", "row")
 
+    def __init__(self, value, row):
+        self.value = value
+        self.row = row
 
-def _read_catalog_src_sheet(wb, output_dir, sheet_name):
-    """引数で指定するシートと、2つのID対応表シートを読み込んで内容を返す機能"""
 
-    # シートのチェック
-    ws, outfile = sheet_check(wb, output_dir, sheet_name)
+class FormulaSheet:
+    """キャッシュされた値がない数式のセルを、評価した値に置き換えて返すワークシート"""
 
-    # 対象シートがない場合は次の処理に移る
-    if not ws:
-        return None
+    def __init__(self, evaluator, title):
+        self.evaluator = evaluator
+        self.title = title
+        self.ws = evaluator.wb[title]
+        self.ws_formulas = evaluator.wb_formulas[title]
+
+    def __getattr__(self, name):
+        return getattr(self.ws, name)
+
+    def iter_rows(
+        self, min_row=None, max_row=None, min_col=None, max_col=None, values_only=False
+    ):
+        rows = zip(
+            self.ws.iter_rows(min_row, max_row, min_col, max_col),
+            self.ws_formulas.iter_rows(min_row, max_row, min_col, max_col),
+        )
+        for row_no, (cells, formula_cells) in enumerate(rows, start=min_row or 1):
+            if any(
+                c.value is None and is_formula(f.value)
+                for c, f in zip(cells, formula_cells)
+            ):
+                cells = tuple(
+                    FormulaCell(
+                        self.evaluator.value(self.title, row_no, col_no, f.value),
+                        row_no,
+                    )
+                    if c.value is None and is_formula(f.value)
+                    else c
+                    for col_no, (c, f) in enumerate(
+                        zip(cells, formula_cells), start=min_col or 1
+                    )
+                )
+            yield tuple(c.value for c in cells) if values_only else cells
+
+    @property
+    def rows(self):
+        return self.iter_rows()
+
+
+class FormulaWorkbook:
+    """キャッシュされた値がない数式を評価して読み込むワークブック（--eval-formulas）
+
+    値（data_only）と数式の2つを読み込み専用で開き、評価した結果はワークブックごとに保持する。
+    """
+
+    def __init__(self, load):
+        self.wb = load(data_only=True)
+        self.wb_formulas = load(data_only=False)
+        self.evaluator = FormulaEvaluator(self.wb, self.wb_formulas)
+        self.sheetnames = self.wb.sheetnames
+        self.defined_names = self.wb.defined_names
+
+    def __getitem__(self, sheet_name):
+        return FormulaSheet(self.evaluator, sheet_name)
+
+    def close(self):
+        self.wb.close()
+        self.wb_formulas.close()
+
+
+def load_xlsx(src, eval_formulas=False):
+    """Excelファイル（パスまたはファイルオブジェクト）を読み込み専用で開く機能
+
+    eval_formulasの場合は、キャッシュされた値がない数式を評価するワークブックとして開く。
+    """
+    if eval_formulas:
+        return FormulaWorkbook(functools.partial(load_workbook, src, read_only=True))
+    return load_workbook(src, read_only=True, data_only=True)
+
+
+def open_workbook(path, eval_formulas=False):
+    """Excelファイル、またはCSV/TSVファイルを格納したフォルダを開く機能"""
+    path = Path(path)
+    if path.is_dir():
+        return CsvWorkbook(path)
+    return load_xlsx(path, eval_formulas)
+
+
+def _spool(src):
+    """ストリームの内容を、シーク可能な一時領域（大きい場合は一時ファイル）に写す機能"""
+    tmp = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    shutil.copyfileobj(src, tmp)
+    tmp.seek(0)
+    return tmp
+
+
+def is_archive(src):
+    """入力がzipファイル（"-"の場合は標準入力のzipファイル）か確認する機能"""
+    return str(src) == "-" or Path(src).suffix.lower() == ".zip"
+
+
+def _inherit_loader(load, bases, base_dir):
+    """ワークブックを開く関数に、継承元と合わせる処理を加える機能"""
+    if bases is None:
+        return load
+    return lambda: bases.inherit(load(), base_dir)
+
+
+def iter_sources(inputs, bases=None, eval_formulas=False):
+    """入力（Excelファイル、CSV/TSVファイルのフォルダ、zipファイル、"-"）から、ワークブックを1つずつ返す機能
+
+    名前、出力先の名前（zipファイル内のパス）、出力フォルダ、ワークブックを開く関数の組を返す。
+    zipファイル内のExcelファイルは、ディスクに展開せずに名前順に読み込む。
+    basesを指定する場合は、継承元を宣言するワークブックを継承元と合わせて開く
+    （継承元のパスは入力ファイル、またはzipファイルがあるフォルダからの相対パスとする）。
+    eval_formulasの場合は、キャッシュされた値がない数式を評価する。
+    """
+    for src in inputs:
+        if not is_archive(src):
+            path = Path(src)
+            # CSV/TSVファイルのフォルダは、フォルダ名をそのまま出力先の名前とする
+            stem = path.name if path.is_dir() else path.stem
+            yield (
+                path.name,
+                stem,
+                path.parent.joinpath(stem),
+                _inherit_loader(
+                    functools.partial(open_workbook, path, eval_formulas),
+                    bases,
+                    path.parent,
+                ),
+            )
+            continue
 
-    # Excelからデータを読み込む
-    common_data, header, data = read_invoice_catalog_sheet(ws)
+        archive = _spool(sys.stdin.buffer) if str(src) == "-" else open(src, "rb")
+        with archive, zipfile.ZipFile(archive) as zf:
+            for member in sorted(zf.namelist()):
+                member_path = PurePosixPath(member)
+                # Excelファイル以外と、作業中の一時ファイルは除く
+                if (
+                    member_path.suffix.lower() != ".xlsx"
+                    or member.startswith("__MACOSX/")
+                    or member_path.name.startswith("~$")
+                ):
+                    continue
+                with zf.open(member) as f, _spool(f) as data:
+                    yield (
+                        member,
+                        member_path.with_suffix("").as_posix(),
+                        None,
+                        _inherit_loader(
+                            functools.partial(load_xlsx, data, eval_formulas),
+                            bases,
+                            Path.cwd() if str(src) == "-" else Path(src).parent,
+                        ),
+                    )
 
-    return common_data, data, outfile
 
+def get_sheet(wb, sheet):
+    """シートを取得する機能"""
 
-def _convert_invoice_schema_impl(rtn_v):
-    """invoice.schema.jsonを出力する機能"""
+    ws = False
+    if sheet in wb.sheetnames:
+        ws = wb[sheet]
+    else:
+        print(sheet + "のシートが存在しません。")
 
-    # 渡されたデータをそれぞれの変数に格納
-    common_data, data, data_gt, data_st, outfile = rtn_v
+    return ws
 
-    # json形式で整理する
-    jdata = defaultdict(dict)
 
-    # ルート部分
-    # $schema
-    jdata["$schema"] = common_data["$schema"]
-    # $id
-    jdata["$id"] = common_data["$id"]
-    # description
-    if (not common_data["description"] is None) and (
-        not len(common_data["description"].strip()) == 0
-    ):
-        jdata["description"] = common_data["description"]
-    # type
-    jdata["type"] = "object"
-    # required
-    jdata["required"] = []
-    # properties
-    jdata["properties"] = defaultdict(dict)
-
-    # customの共通部分
-    if any([d["output"] != "OFF" and d["category"] == "custom" for d in data]):
-        jdata["required"].append("custom")
-
-        # properties/custom
-        jdata["properties"]["custom"] = defaultdict(dict)
-        # properties/custom/type
-        jdata["properties"]["custom"]["type"] = "object"
-        # properties/custom/label/ja
-        jdata["properties"]["custom"]["label"]["ja"] = "固有情報"
-        # properties/custom/label/en
-        jdata["properties"]["custom"]["label"]["en"] = "Custom Information"
-        # properties/custom/requiredにリストを準備
-        jdata["properties"]["custom"]["required"] = []
-        # properties/custom/properties
-        jdata["properties"]["custom"]["properties"] = defaultdict(dict)
-
-    # sampleの共通部分
-    if any([d["output"] != "OFF" and d["category"].startswith("sample") for d in data]):
-        jdata["required"].append("sample")
-
-        # properties/sample
-        jdata["properties"]["sample"] = defaultdict(dict)
-        # properties/sample/type
-        jdata["properties"]["sample"]["type"] = "object"
-        # properties/sample/label/ja
-        jdata["properties"]["sample"]["label"]["ja"] = "試料情報"
-        # properties/sample/label/en
-        jdata["properties"]["sample"]["label"]["en"] = "Sample Information"
-        # properties/sample/properties
-        jdata["properties"]["sample"]["properties"] = defaultdict(dict)
-
-    # sample generalAttributesの部分
-    if any([d["output"] != "OFF" and d["category"] == "sample_general" for d in data]):
-        # properties/sample/properties/generalAttributes
-        jdata["properties"]["sample"]["properties"]["generalAttributes"] = defaultdict(
-            dict
+def _ngrams(word, n=2):
+    """類似語の候補検索に用いるn-gramの集合を得る機能"""
+    word = word.lower()
+    if len(word) <= n:
+        return {word}
+    return {word[i : i + n] for i in range(len(word) - n + 1)}
+
+
+class SheetTermTable:
+    """ワークブックに埋め込まれた用語シートの内容を検索するクラス"""
+
+    def __init__(self, sheet_name, data):
+        self.sheet_name = sheet_name
+        self.name_col = TERM_NAME_COLUMNS[sheet_name]
+        # key_nameと用語名の索引を一度だけ作成する（同じ値が複数ある場合は先頭行を採用する）
+        self._index = {"key_name": {}, self.name_col: {}}
+        self._ids = {}
+        self._dup_keys = DupTracker()
+        for d in data:
+            self._dup_keys.add(d["key_name"])
+            for col, index in self._index.items():
+                index.setdefault(d[col], d)
+            self._ids.setdefault((d.get("sample_class_id"), d["term_id"]), d)
+
+    def find_by_key(self, key_name):
+        """key_nameに一致する行を返す機能"""
+        return self._index["key_name"].get(key_name)
+
+    def find_by_ids(self, term_id, class_id=None):
+        """term_id（分類別項目はsample_class_idとの組）に一致する行を返す機能"""
+        return self._ids.get((class_id, term_id))
+
+    def find_by_name(self, name):
+        """用語名に一致する行を返す機能"""
+        return self._index[self.name_col].get(name)
+
+    def dup_keys(self):
+        """重複するkey_nameを返す機能"""
+        return self._dup_keys.dup
+
+    def suggest(self, col, word, n=3):
+        """指定する列（col）の値から、wordに近い値を返す機能"""
+        return difflib.get_close_matches(word, list(self._index[col]), n=n)
+
+
+class SqliteTermTable:
+    """用語ストア（SQLiteファイル）の1シート分を検索するクラス"""
+
+    # 類似語の候補を絞り込むのに用いるn-gramの数と、候補の件数
+    gram_limit = 8
+    candidate_limit = 200
+
+    def __init__(self, con, sheet_name):
+        self.con = con
+        self.sheet_name = sheet_name
+        self.name_col = TERM_NAME_COLUMNS[sheet_name]
+
+    def _find(self, col, value):
+        """指定する列（col）が値に一致する最初の行を返す機能"""
+        row = self.con.execute(
+            f'SELECT * FROM "{self.sheet_name}" WHERE "{col}" = ? ORDER BY rowid LIMIT 1',
+            (value,),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def find_by_key(self, key_name):
+        """key_nameに一致する行を返す機能"""
+        return self._find("key_name", key_name)
+
+    def find_by_ids(self, term_id, class_id=None):
+        """term_id（分類別項目はsample_class_idとの組）に一致する行を返す機能"""
+        if class_id is None:
+            return self._find("term_id", term_id)
+        row = self.con.execute(
+            f'SELECT * FROM "{self.sheet_name}" '
+            "WHERE term_id = ? AND sample_class_id = ? ORDER BY rowid LIMIT 1",
+            (term_id, class_id),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def find_by_name(self, name):
+        """用語名に一致する行を返す機能"""
+        return self._find(self.name_col, name)
+
+    def dup_keys(self):
+        """重複するkey_nameを返す機能"""
+        rows = self.con.execute(
+            f'SELECT key_name FROM "{self.sheet_name}" GROUP BY key_name HAVING COUNT(*) > 1'
         )
-        # properties/sample/properties/generalAttributes/type
-        jdata["properties"]["sample"]["properties"]["generalAttributes"]["type"] = (
-            "array"
+        return {r[0] for r in rows}
+
+    def suggest(self, col, word, n=3):
+        """指定する列（col）の値から、wordに近い値を返す機能"""
+        # 出現頻度の低いn-gramだけを用いて候補を絞り込み、類似度で並べ替える
+        grams = list(_ngrams(word))
+        rows = self.con.execute(
+            f'SELECT gram FROM "{self.sheet_name}_gram" '
+            f"WHERE col = ? AND gram IN ({','.join('?' * len(grams))}) "
+            "ORDER BY freq LIMIT ?",
+            (col, *grams, self.gram_limit),
         )
-        # properties/sample/properties/generalAttributes/items
-        jdata["properties"]["sample"]["properties"]["generalAttributes"]["items"] = []
-
-    # sample specificAttributesの部分
-    if any([d["output"] != "OFF" and d["category"] == "sample_specific" for d in data]):
-        # properties/sample/properties/specificAttributes
-        jdata["properties"]["sample"]["properties"]["specificAttributes"] = defaultdict(
-            dict
+        grams = [r[0] for r in rows]
+        if not grams:
+            return []
+        rows = self.con.execute(
+            f'SELECT t."{col}" FROM "{self.sheet_name}_ngram" g '
+            f'JOIN "{self.sheet_name}" t ON t.rowid = g.term_rowid '
+            f"WHERE g.col = ? AND g.gram IN ({','.join('?' * len(grams))}) "
+            "GROUP BY g.term_rowid ORDER BY COUNT(*) DESC LIMIT ?",
+            (col, *grams, self.candidate_limit),
         )
-        # properties/sample/properties/specificAttributes/type
-        jdata["properties"]["sample"]["properties"]["specificAttributes"]["type"] = (
-            "array"
-        )
-        # properties/sample/properties/specificAttributes/items
-        jdata["properties"]["sample"]["properties"]["specificAttributes"]["items"] = []
+        return difflib.get_close_matches(word, [r[0] for r in rows], n=n)
 
-    for d in data:
-        if d["output"] == "OFF":
-            continue
 
-        # customの部分
-        if d["category"] == "custom":
-            jdata["properties"]["custom"]["properties"][d["parameter_name"]] = (
-                defaultdict(dict)
-            )
+class TermStore:
+    """用語シートをSQLiteファイルとして保持する用語ストア"""
 
-            # 項目名(日本語)
-            jdata["properties"]["custom"]["properties"][d["parameter_name"]]["label"][
-                "ja"
-            ] = d["label/ja"]
-            # 項目名(英語)
-            jdata["properties"]["custom"]["properties"][d["parameter_name"]]["label"][
-                "en"
-            ] = d["label/en"]
-            # データ型
-            jdata["properties"]["custom"]["properties"][d["parameter_name"]]["type"] = (
-                d["type"]
-            )
-            # 必須項目
-            if check_value(d["required"], boolean=True):
-                jdata["properties"]["custom"]["required"].append(d["parameter_name"])
-            # フォーマット
-            if check_value(d["format"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "format"
-                ] = d["format"]
-            # 説明
-            if check_value(d["description"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "description"
-                ] = d["description"]
-            # 内容サンプル
-            if check_value(d["examples"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "examples"
-                ] = [convert_value(d["type"], d["examples"])]
-            # 初期値
-            if check_value(d["default"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "default"
-                ] = convert_value(d["type"], d["default"])
-            # 固定値
-            if check_value(d["const"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "const"
-                ] = convert_value(d["type"], d["const"])
-            # 値のリスト
-            if check_value(d["enum"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "enum"
-                ] = [convert_value(d["type"], v) for v in d["enum"].split(",")]
-            # テキストエリア
-            if check_value(d["options/widget"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "options"
-                ]["widget"] = d["options/widget"]
-            # 行数
-            if check_value(d["options/rows"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "options"
-                ]["rows"] = int(d["options/rows"])
-            # 単位
-            if check_value(d["options/unit"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "options"
-                ]["unit"] = d["options/unit"]
-            # プレイスホルダ
-            if check_value(d["options/placeholder/ja"]) or check_value(
-                d["options/placeholder/en"]
-            ):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "options"
-                ]["placeholder"] = defaultdict(dict)
-            # プレイスホルダ(日本語)
-            if check_value(d["options/placeholder/ja"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "options"
-                ]["placeholder"]["ja"] = d["options/placeholder/ja"]
-            # プレイスホルダ(英語)
-            if check_value(d["options/placeholder/en"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "options"
-                ]["placeholder"]["en"] = d["options/placeholder/en"]
-            # 数値上限(以下)
-            if check_value(d["maximum"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "maximum"
-                ] = float(d["maximum"])
-            # 数値上限(未満)
-            if check_value(d["exclusiveMaximum"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "exclusiveMaximum"
-                ] = float(d["exclusiveMaximum"])
-            # 数値下限(以上)
-            if check_value(d["minimum"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "minimum"
-                ] = float(d["minimum"])
-            # 数値下限(より上)
-            if check_value(d["exclusiveMinimum"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "exclusiveMinimum"
-                ] = float(d["exclusiveMinimum"])
-            # 最大文字数
-            if check_value(d["maxLength"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "maxLength"
-                ] = int(d["maxLength"])
-            # 最小文字数
-            if check_value(d["minLength"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "minLength"
-                ] = int(d["minLength"])
-            # 正規表現
-            if check_value(d["pattern"]):
-                jdata["properties"]["custom"]["properties"][d["parameter_name"]][
-                    "pattern"
-                ] = d["pattern"]
-
-        # sample_commonの部分
-        if d["category"] == "sample_common":
-            continue
+    def __init__(self, db_path):
+        db_path = Path(db_path)
+        if not db_path.exists():
+            raise ExcelError(f"用語ストアが存在しません: {db_path}")
+        # パスに「?」「#」「%」などを含んでもよいように、URIはエンコードして組み立てる
+        self.con = sqlite3.connect(db_path.resolve().as_uri() + "?mode=ro", uri=True)
+        self.con.row_factory = sqlite3.Row
 
-        # sample_generalの部分
-        if d["category"] == "sample_general":
-            jdata["properties"]["sample"]["properties"]["generalAttributes"][
-                "items"
-            ].append({
-                "type": "object",
-                "required": ["termId"],
-                "properties": {
-                    "termId": {
-                        "const": list(
-                            filter(
-                                lambda x: x["dict.term.name_ja"] == d["term"], data_gt
-                            )
-                        )[0]["term_id"]
-                    }
-                },
-            })
+    def table(self, sheet_name):
+        """指定するシートの用語テーブルを返す機能"""
+        return SqliteTermTable(self.con, sheet_name)
 
-        # sample_specificの部分
-        if d["category"] == "sample_specific":
-            jdata["properties"]["sample"]["properties"]["specificAttributes"][
-                "items"
-            ].append({
-                "type": "object",
-                "required": ["classId", "termId"],
-                "properties": {
-                    "classId": {
-                        "const": list(
-                            filter(
-                                lambda x: x["bind_class_and_term_ja"] == d["term"],
-                                data_st,
-                            )
-                        )[0]["sample_class_id"]
-                    },
-                    "termId": {
-                        "const": list(
-                            filter(
-                                lambda x: x["bind_class_and_term_ja"] == d["term"],
-                                data_st,
-                            )
-                        )[0]["term_id"]
-                    },
-                },
-            })
+    def close(self):
+        self.con.close()
 
-    # JSON形式で出力
-    json_dump(jdata, outfile)
 
+def build_term_store(src_files, db_path):
+    """マスターの用語シートを含むExcelファイルから用語ストアを作成する機能"""
+    db_path = Path(db_path)
+    db_path.unlink(missing_ok=True)
+    con = sqlite3.connect(db_path)
 
-def convert_invoice_schema(wb, output_dir):
-    """シートの内容を読み込み、invoice.schema.jsonを出力する機能"""
+    for sheet_name, name_col in TERM_NAME_COLUMNS.items():
+        header = None
+        for ef in src_files:
+            wb = open_workbook(ef)
+            ws = get_sheet(wb, sheet_name)
+            if not ws:
+                wb.close()
+                continue
 
-    rtn_v = _read_invoice_src_sheets(wb, output_dir, "invoice.schema.json")
-    # 対象シートがない場合は次の処理に移る
-    if not rtn_v:
-        return None
-    _convert_invoice_schema_impl(rtn_v)
+            for d in read_simple_sheet(ws):
+                # 最初に見つかったシートのヘッダーでテーブルを作成する
+                if header is None:
+                    header = list(d)
+                    cols = ", ".join(f'"{k}" TEXT' for k in header)
+                    con.execute(f'CREATE TABLE "{sheet_name}" ({cols})')
+                    con.execute(
+                        f'CREATE TABLE "{sheet_name}_ngram" '
+                        "(col TEXT, gram TEXT, term_rowid INTEGER)"
+                    )
 
+                placeholders = ", ".join("?" * len(header))
+                cur = con.execute(
+                    f'INSERT INTO "{sheet_name}" VALUES ({placeholders})',
+                    [d.get(k, "None") for k in header],
+                )
+                con.executemany(
+                    f'INSERT INTO "{sheet_name}_ngram" VALUES (?, ?, ?)',
+                    [
+                        (col, g, cur.lastrowid)
+                        for col in ("key_name", name_col)
+                        for g in _ngrams(d[col])
+                    ],
+                )
+            wb.close()
 
-def _convert_invoice_example_impl(rtn_v):
-    """invoice.jsonを出力する機能"""
+        if header is None:
+            con.close()
+            raise ExcelError(f"{sheet_name}のシートが見つかりませんでした。")
 
-    expected_dtypes = ["boolean", "integer", "number", "string"]
-    s = "x"
-    default_uuid = f"{s * 8}-{s * 4}-{s * 4}-{s * 4}-{s * 12}"
-    default_string_56 = s * 56
+        # key_name・用語名で検索するための索引を作成する
+        for col in ("key_name", name_col):
+            con.execute(
+                f'CREATE INDEX "{sheet_name}.{col}" ON "{sheet_name}" ("{col}")'
+            )
+        con.execute(
+            f'CREATE INDEX "{sheet_name}_ngram.gram" ON "{sheet_name}_ngram" (col, gram)'
+        )
+        # n-gramごとの出現頻度
+        con.execute(
+            f'CREATE TABLE "{sheet_name}_gram" AS SELECT col, gram, COUNT(*) AS freq '
+            f'FROM "{sheet_name}_ngram" GROUP BY col, gram'
+        )
+        con.execute(
+            f'CREATE UNIQUE INDEX "{sheet_name}_gram.gram" ON "{sheet_name}_gram" (col, gram)'
+        )
 
-    # 渡されたデータをそれぞれの変数に格納
-    _, data, data_gt, data_st, outfile = rtn_v
+    con.commit()
 
-    # データを抽出する
-    data_on = [
-        d for d in data if check_value(d["parameter_name"]) and d["output"] == "ON"
-    ]
+    # key_nameに重複がないかチェック
+    dup_keys = SqliteTermTable(con, GENERAL_TERM_SHEET).dup_keys()
+    con.close()
+    if dup_keys:
+        db_path.unlink()
+        raise ExcelError(
+            f"{GENERAL_TERM_SHEET}に複数の {dup_keys}（key_name）が存在します"
+        )
+    print(f" - 用語ストア{db_path.name}を作成しました。")
 
-    # json形式で整理する
-    jdata = defaultdict(dict)
 
-    # basic部分
-    jdata["datasetId"] = default_uuid
-    jdata["basic"] = {
-        "dateSubmitted": f"{datetime.today().strftime('%Y-%m-%d')}",
-        "dataOwnerId": default_string_56,
-        "dataName": "%%data_name%%",
-        "instrumentId": default_uuid,
-        "experimentId": "%%experiment_id%%",
-        "description": "%%description%%",
-    }
-
-    # custom - 固有情報
-    category_name = "custom"
-    data_custom = [d for d in data_on if d["category"] == category_name]
+# ワークブックごとの用語テーブル（invoice.schema.jsonとinvoice.jsonとで用語シートを一度だけ読み込む）
+_term_tables = weakref.WeakKeyDictionary()
 
-    # 重複するパラメータがあればエラーを出す
-    check_dup_params(data_custom, category_name, outfile)
 
-    for d in data_custom:
-        param = d["parameter_name"]
-        # JSONに格納すべき値を得る
-        v = get_validated_value(param, d, expected_dtypes, outfile)
-        jdata["custom"][param] = v
+def get_term_tables(wb, term_store=None):
+    """一般項目・分類別項目の用語テーブルを取得する機能"""
+    # 用語ストアが指定されている場合は、埋め込みの用語シートは読み込まない
+    if term_store is not None:
+        return (
+            term_store.table(GENERAL_TERM_SHEET),
+            term_store.table(SPECIFIC_TERM_SHEET),
+        )
 
-    # sample - 資料情報
-    # 資料情報全体にoutput==ONである行が１つ以上存在する場合は、sample_commonの全7行を出力する
-    samples = ["sample_common", "sample_general", "sample_specific"]
-    data_samples = [d for d in data_on if d["category"] in samples]
-
-    if data_samples:
-        # sample_common - 資料情報（共通項目）
-        category_name = "sample_common"
-        data_sample_c = [
-            d
-            for d in data
-            if check_value(d["parameter_name"]) and d["category"] == category_name
+    # 継承したワークブックで用語シートを持たない場合は、継承元の用語テーブルを共有する
+    wb = getattr(wb, "term_workbook", wb)
+    if wb not in _term_tables:
+        _term_tables[wb] = _read_term_tables(wb)
+    return _term_tables[wb]
+
+
+def _read_term_tables(wb):
+    """用語シートから一般項目・分類別項目の用語テーブルを作成する機能"""
+    # 一般項目の用語シートの取得
+    ws_gt = get_sheet(wb, GENERAL_TERM_SHEET)
+
+    # 分類別項目の用語シートの取得
+    ws_st = get_sheet(wb, SPECIFIC_TERM_SHEET)
+
+    # 事前準備するシートがない場合は次の処理に移る
+    if (not ws_st) or (not ws_gt):
+        return None
+
+    return (
+        SheetTermTable(GENERAL_TERM_SHEET, read_simple_sheet(ws_gt)),
+        SheetTermTable(SPECIFIC_TERM_SHEET, read_simple_sheet(ws_st)),
+    )
+
+
+def lookup_term(table, col, value, outfile):
+    """用語テーブルから値に一致する行を取得し、ない場合は候補を添えてエラーを出す機能"""
+    if col == "key_name":
+        row = table.find_by_key(value)
+    else:
+        row = table.find_by_name(value)
+    if row is None:
+        msg = (
+            f"{value}は、{table.sheet_name}の{col}に存在しません"
+            f"（要件定義（{outfile.name}）シート）。"
+        )
+        candidates = table.suggest(col, value)
+        if candidates:
+            msg += f"候補: {', '.join(candidates)}"
+        raise ExcelError(msg)
+    return row
+
+
+class EnumValues:
+    """enum列の値の一覧を保持するクラス（valuesは出力順、membersは値の有無の確認に用いる）
+
+    inで値の有無を確認でき、添字・len()は出力順の値の一覧に対して働く。
+    typeに変換した一覧は、typeごとに一度だけ作成して保持する。
+    """
+
+    __slots__ = ("values", "members", "_converted")
+
+    def __init__(self, values):
+        self.values = tuple(values)
+        self.members = frozenset(self.values)
+        self._converted = {}
+
+    def __contains__(self, value):
+        return value in self.members
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def convert(self, dtype):
+        """値をtypeに変換した一覧を返す機能"""
+        if dtype not in self._converted:
+            self._converted[dtype] = EnumValues(
+                convert_value(dtype, v) for v in self.values
+            )
+        return self._converted[dtype]
+
+
+class EnumTable:
+    """enum列の値を、ワークブックごとに一度だけ解析して保持するクラス
+
+    enum列には、カンマ区切りの値（カンマを含む値は"で囲む）のほか、
+    "enum:名前" の形式で名前付き範囲、またはシート（A列の2行目以降）を指定できる。
+    """
+
+    prefix = "enum:"
+
+    def __init__(self, wb):
+        self.wb = wb
+        self._cache = {}
+
+    def get(self, text):
+        """enum列の値から、値の一覧を返す機能（値がない場合はNoneを返す）"""
+        if not check_value(text):
+            return None
+        if text not in self._cache:
+            if text.startswith(self.prefix):
+                values = self._read_ref(text[len(self.prefix) :].strip())
+            else:
+                values = next(csv.reader([text]))
+            self._cache[text] = EnumValues(values)
+        return self._cache[text]
+
+    def _read_ref(self, name):
+        """名前付き範囲、またはシートから値の一覧を読み込む機能"""
+        defined_names = getattr(self.wb, "defined_names", {})
+        if name in defined_names:
+            values = []
+            for title, coord in defined_names[name].destinations:
+                if title not in self.wb.sheetnames:
+                    raise ExcelError(
+                        f"enum列で参照する名前付き範囲{name}のシート{title}が存在しません。"
+                    )
+                min_col, min_row, max_col, max_row = range_boundaries(coord)
+                for row in self.wb[title].iter_rows(
+                    min_row=min_row,
+                    max_row=max_row,
+                    min_col=min_col,
+                    max_col=max_col,
+                    values_only=True,
+                ):
+                    values += [str(v) for v in row if v is not None]
+            return values
+
+        if name in self.wb.sheetnames:
+            values = []
+            for row in self.wb[name].rows:
+                # 1行目はヘッダーとする
+                if str(row[0]) == "<EmptyCell>" or row[0].row == 1:
+                    continue
+                if row[0].value is not None:
+                    values.append(str(row[0].value))
+            return values
+
+        raise ExcelError(
+            f"enum列で参照する{name}（名前付き範囲またはシート）が存在しません。"
+        )
+
+
+# ワークブックごとのEnumTable
+_enum_tables = weakref.WeakKeyDictionary()
+
+
+def get_enum_table(wb):
+    """ワークブックのEnumTableを取得する機能"""
+    if wb not in _enum_tables:
+        _enum_tables[wb] = EnumTable(wb)
+    return _enum_tables[wb]
+
+
+# pattern列の正規表現の照合にかける時間の上限（秒）
+PATTERN_TIMEOUT = 1.0
+
+# RDEの画面（ECMA-262）では解釈できない、Python固有の構文
+PYTHON_ONLY_SYNTAX = [
+    (re.compile(r"\(\?P[<=]"), "(?P<name>...)・(?P=name)"),
+    (re.compile(r"\(\?#"), "(?#...)"),
+    (re.compile(r"\(\?>"), "(?>...)"),
+    (re.compile(r"\(\?[aiLmsux-]+[:)]"), "(?i)などのフラグ"),
+    (re.compile(r"[*+?}]\+"), "*+などの強欲な量指定子"),
+    (re.compile(r"\\[AZ]"), "\\A・\\Z"),
+]
+
+
+def _strip_escapes_and_classes(pattern):
+    """構文の検査のために、エスケープと文字クラスの中身を取り除く機能"""
+    out = []
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            # \A・\Zは構文の検査の対象とするため残す
+            esc = pattern[i : i + 2]
+            out.append(esc if (not in_class and esc in ("\\A", "\\Z")) else "_")
+            i += 2
+            continue
+        if in_class:
+            if c == "]":
+                in_class = False
+                out.append("]")
+        elif c == "[":
+            in_class = True
+            out.append("[")
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+# ECMA-262の名前付き後方参照（\k<name>）
+NAMED_BACKREF = re.compile(r"\\k<(\w+)>")
+
+
+def _ecma_to_python(pattern):
+    """ECMA-262の名前付きグループ（(?<name>...)・\\k<name>）をPythonの構文に置き換える機能
+
+    エスケープした文字と、文字クラスの中身は置き換えない。
+    """
+    out = []
+    i = 0
+    in_class = False
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            m = None if in_class else NAMED_BACKREF.match(pattern, i)
+            if m:
+                out.append(f"(?P={m[1]})")
+                i = m.end()
+            else:
+                out.append(pattern[i : i + 2])
+                i += 2
+            continue
+        if in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+        elif pattern.startswith("(?<", i) and pattern[i + 3 : i + 4] not in "=!":
+            out.append("(?P<")
+            i += 3
+            continue
+        out.append(c)
+        i += 1
+    return "".join(out)
+
+
+# 文字の重なりを調べるために用いる文字
+OVERLAP_SAMPLE_CHARS = string.printable + "\u3000あア亜０"
+
+# 文字クラスのカテゴリーに対応する正規表現
+CATEGORY_PATTERNS = {
+    sre_constants.CATEGORY_DIGIT: re.compile(r"\d"),
+    sre_constants.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+    sre_constants.CATEGORY_SPACE: re.compile(r"\s"),
+    sre_constants.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+    sre_constants.CATEGORY_WORD: re.compile(r"\w"),
+    sre_constants.CATEGORY_NOT_WORD: re.compile(r"\W"),
+}
+
+
+def _min_width(state, item):
+    """正規表現の要素が一致する最小の文字数を返す機能"""
+    return sre_parse.SubPattern(state, [item]).getwidth()[0]
+
+
+def _flatten(items):
+    """正規表現の要素の並びから、グループを展開して要素を返す機能"""
+    for op, av in items:
+        if op is sre_constants.SUBPATTERN:
+            yield from _flatten(av[-1])
+        else:
+            yield op, av
+
+
+def _first_item(items):
+    """正規表現の要素の並びから、最初に一致する要素を返す機能（グループや繰り返しは展開する）"""
+    for op, av in _flatten(items):
+        if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            return _first_item(av[2])
+        return op, av
+    return None
+
+
+def _matches_char(item, ch):
+    """1文字に一致する要素が、文字chに一致するか調べる機能（判定できない場合はTrueを返す）"""
+    op, av = item
+    if op is sre_constants.LITERAL:
+        return ord(ch) == av
+    if op is sre_constants.NOT_LITERAL:
+        return ord(ch) != av
+    if op is sre_constants.ANY:
+        return ch != "\n"
+    if op is sre_constants.IN:
+        negate = False
+        matched = False
+        for cop, cav in av:
+            if cop is sre_constants.NEGATE:
+                negate = True
+            elif cop is sre_constants.LITERAL:
+                matched |= ord(ch) == cav
+            elif cop is sre_constants.RANGE:
+                matched |= cav[0] <= ord(ch) <= cav[1]
+            elif cop is sre_constants.CATEGORY and cav in CATEGORY_PATTERNS:
+                matched |= bool(CATEGORY_PATTERNS[cav].match(ch))
+            else:
+                return True
+        return matched != negate
+    return True
+
+
+def _overlaps(a, b):
+    """2つの要素が、同じ文字に一致し得るか調べる機能"""
+    if a is None or b is None:
+        return False
+    return any(
+        _matches_char(a, ch) and _matches_char(b, ch) for ch in OVERLAP_SAMPLE_CHARS
+    )
+
+
+def _redos_problems(tree):
+    """バックトラックが爆発しやすい形（入れ子の量指定子、重なる選択肢の繰り返し）を探す機能
+
+    sre_parseは選択肢に共通する先頭部分をくくり出す（(a|aa)はa(?:|a)となる）ため、
+    繰り返しの中の選択肢は、くくり出された先頭部分の後にあるものも調べる。
+    選択肢は最初の1文字と、繰り返しの末尾で、ある選択肢が別の選択肢の先頭部分になっているか
+    （(ab|a)*など）のみで判定する。
+    2文字目以降で初めて重なる選択肢や、並んだ繰り返しによる多項式時間の遅さ（\\d+\\d+\\d+$など）は
+    検出できないため、照合時の時間の上限（PATTERN_TIMEOUT）で扱う。
+    """
+    problems = []
+    repeats = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+    def is_unbounded(item):
+        return item[0] in repeats and item[1][1] is sre_constants.MAXREPEAT
+
+    def walk(items):
+        for op, av in items:
+            if op in repeats:
+                sub = av[2]
+                body = list(_flatten(sub))
+                if is_unbounded((op, av)):
+                    # 繰り返しの中に繰り返しがあり、それ以外の必須の要素も内側の繰り返しで一致し得る
+                    # （例: (a+)+、(\\w+\\s?)*、(x+x+)+、(([a-z])+.)+）
+                    for k, item in enumerate(body):
+                        if not is_unbounded(item):
+                            continue
+                        inner = _first_item(item[1][2])
+                        others = [
+                            o
+                            for o in body[:k] + body[k + 1 :]
+                            if _min_width(sub.state, o) > 0
+                        ]
+                        if all(_overlaps(inner, _first_item([o])) for o in others):
+                            problems.append("入れ子の量指定子")
+                            break
+                    # 繰り返しの中身の選択肢が、同じ文字から始まり得る（例: (.|x)+、(\\w|\\d)*）、
+                    # またはくくり出された先頭部分の後で、ある選択肢が別の選択肢の先頭部分になっている
+                    # （例: (a|aa)*、(ab|a)*）
+                    for k, (item_op, item_av) in enumerate(body):
+                        if item_op is not sre_constants.BRANCH:
+                            continue
+                        branches = item_av[1]
+                        # 空の選択肢は、選択肢の後（なければ次の繰り返し）の要素から始まる
+                        after = _first_item(body[k + 1 :]) or (
+                            _first_item(body[:k]) if k else None
+                        )
+                        firsts = [_first_item(b) if b else after for b in branches]
+                        widths = [
+                            sre_parse.SubPattern(sub.state, b).getwidth()[0]
+                            for b in branches
+                        ]
+                        # 選択肢の後に必須の要素がなければ、短い選択肢の後は次の繰り返しと区別できない
+                        prefixed = any(
+                            _min_width(sub.state, o) > 0 for o in body[:k]
+                        ) and not any(
+                            _min_width(sub.state, o) > 0 for o in body[k + 1 :]
+                        )
+                        if any(
+                            _overlaps(a, b)
+                            for i, a in enumerate(firsts)
+                            for b in firsts[i + 1 :]
+                        ) or (prefixed and 0 in widths and any(widths)):
+                            problems.append("重なる選択肢の繰り返し")
+                            break
+                walk(sub)
+            elif op is sre_constants.SUBPATTERN:
+                walk(av[-1])
+            elif op is sre_constants.BRANCH:
+                for b in av[1]:
+                    walk(b)
+            elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+                walk(av[1])
+
+    walk(tree)
+    return problems
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_pattern(pattern):
+    """pattern列の正規表現を検査してコンパイルする機能（結果とエラーの内容を返す）"""
+    # RDEの画面で解釈できない構文
+    stripped = _strip_escapes_and_classes(pattern)
+    unsupported = [name for r, name in PYTHON_ONLY_SYNTAX if r.search(stripped)]
+    if unsupported:
+        return None, (
+            "正規表現に、RDEの画面（ECMA-262）で解釈できない構文が含まれています: "
+            f"{', '.join(unsupported)}。"
+        )
+
+    python_pattern = _ecma_to_python(pattern)
+    try:
+        tree = sre_parse.parse(python_pattern)
+        compiled = re.compile(python_pattern)
+    except re.error as e:
+        return None, f"正規表現として解釈できません（{e}）。"
+
+    # 照合に時間がかかり得る形
+    problems = _redos_problems(tree)
+    if problems:
+        return None, (
+            "正規表現に、照合に非常に時間がかかり得る形が含まれています: "
+            f"{', '.join(dict.fromkeys(problems))}。"
+        )
+    return compiled, None
+
+
+def compile_pattern(pattern):
+    """pattern列の正規表現をコンパイルする機能（同じ正規表現は一度だけ検査・コンパイルする）"""
+    compiled, error = _compile_pattern(pattern)
+    if error:
+        raise ExcelError(f"{error}正規表現={pattern}")
+    return compiled
+
+
+class _PatternTimeout(Exception):
+    pass
+
+
+def _on_pattern_timeout(signum, frame):
+    raise _PatternTimeout()
+
+
+def _match_in_worker(python_pattern, value):
+    """照合用のプロセスで、値が正規表現に一致するか調べる機能"""
+    return re.match(python_pattern, value) is not None
+
+
+class PatternWorker:
+    """タイマーのシグナルを使えない環境（Windows、メインスレッド以外）で、照合に時間の上限を設けるためのプロセス
+
+    照合は1つのプロセスで順に行い、時間の上限を超えたプロセスは終了させて、次の照合では作成し直す。
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def match(self, compiled, value, timeout):
+        with self.lock:
+            if self.pool is None:
+                # プロセスを作成できない環境（デーモンのプロセスなど）では、照合せずにエラーを出す
+                try:
+                    self.pool = multiprocessing.get_context("spawn").Pool(1)
+                except (AssertionError, OSError, RuntimeError) as e:
+                    raise ExcelError(
+                        f"正規表現の照合に時間の上限を設けられません（{e}）。"
+                    ) from None
+            result = self.pool.apply_async(_match_in_worker, (compiled.pattern, value))
+            try:
+                return result.get(timeout)
+            except multiprocessing.TimeoutError:
+                self.close()
+                raise _PatternTimeout() from None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+pattern_worker = PatternWorker()
+
+
+def match_pattern(pattern, value, timeout=PATTERN_TIMEOUT):
+    """値が正規表現に一致するか調べる機能（照合がtimeout秒以内に終わらない場合はエラーを出す）"""
+    compiled = compile_pattern(pattern)
+
+    try:
+        # 時間の上限はタイマーのシグナルで設ける（使えない環境では、照合用のプロセスで照合する）
+        if not (
+            hasattr(signal, "setitimer")
+            and threading.current_thread() is threading.main_thread()
+        ):
+            return pattern_worker.match(compiled, value, timeout)
+
+        previous = signal.signal(signal.SIGALRM, _on_pattern_timeout)
+        previous_timer = signal.setitimer(signal.ITIMER_REAL, timeout)
+        started = monotonic()
+        try:
+            return compiled.match(value) is not None
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+            # 呼び出し元が設定していたタイマーは、照合にかかった時間を差し引いて設定し直す
+            delay, interval = previous_timer
+            if delay:
+                remaining = max(delay - (monotonic() - started), 1e-6)
+                signal.setitimer(signal.ITIMER_REAL, remaining, interval)
+    except _PatternTimeout:
+        raise ExcelError(
+            f"正規表現の照合が{timeout}秒以内に終わりません。正規表現={pattern}"
+        ) from None
+
+
+# 継承元のワークブックと合わせる要件定義シート
+METADATA_SHEET = "要件定義(metadata-def.json)"
+INVOICE_SHEET = "要件定義(invoice.schema.json)"
+CATALOG_SHEET = "要件定義(catalog.schema.json)"
+
+# 継承先のワークブックで、継承元の行を削除することを表すoutput列の値
+REMOVE_MARK = "REMOVE"
+
+
+class ParsedSheet:
+    """要件定義シートを解析した内容（共通部分、ヘッダー、データ部）を保持するクラス"""
+
+    def __init__(self, sheet_name, ws):
+        self.sheet_name = sheet_name
+        if sheet_name == METADATA_SHEET:
+            self.common = {}
+            rows = iter(ws.rows)
+            self.header = [c.value for c in next(rows, ())]
+            self.data = list(read_simple_sheet(ws, skipheader=2))
+        else:
+            common, header, data = read_invoice_catalog_sheet(ws)
+            self.common = {k: v for k, v in common.items() if k != "base"}
+            self.header = header or []
+            self.data = list(data)
+        self.header = [c for c in self.header if c is not None]
+
+    def key(self, d):
+        """行を合わせる際のキー（invoiceはカテゴリーごとのparameter_name）"""
+        if self.sheet_name == INVOICE_SHEET:
+            return d["category"], d["parameter_name"]
+        return d["parameter_name"]
+
+
+class MergedSheet:
+    """継承元と継承先の要件定義シートを、parameter_nameごとに合わせたシートを表すクラス
+
+    継承先の行は、継承元の同じparameter_nameの行を置き換え（上書き）、output列がREMOVEの場合は
+    継承元の行を削除する。継承元にない行は、同じカテゴリーの最後の行の後に追加する。
+    共通部分（$idなど）は、継承先に値がある項目のみ上書きする。
+    """
+
+    def __init__(self, base, variant):
+        self.title = variant.sheet_name
+        self.sheet_name = variant.sheet_name
+        self.header = base.header + [c for c in variant.header if c not in base.header]
+        self.common = dict(base.common)
+        self.common.update({k: v for k, v in variant.common.items() if check_value(v)})
+
+        # 継承元の行の位置（同じキーの行が複数ある場合は最初の行）と、parameter_nameごとのカテゴリー
+        index = {}
+        categories = defaultdict(dict)
+        for i, b in enumerate(base.data):
+            index.setdefault(base.key(b), i)
+            categories[b["parameter_name"]][b.get("category")] = None
+
+        data = list(base.data)
+        removed = set()
+        added = defaultdict(list)
+        seen = set()
+        for d in variant.data:
+            d = self._inherit_category(d, categories)
+            key = variant.key(d)
+            if key in seen:
+                raise ExcelError(
+                    f"{self.sheet_name}シートの継承先に、重複する行が確認されました: {key}"
+                )
+            seen.add(key)
+            idx = index.get(key)
+            if d["output"] == REMOVE_MARK:
+                if idx is None:
+                    raise ExcelError(
+                        f"{self.sheet_name}シートで削除する{key}が、継承元に存在しません。"
+                    )
+                removed.add(idx)
+            elif idx is not None:
+                data[idx] = d
+            else:
+                added[d.get("category")].append(d)
+
+        # 追加する行は、同じカテゴリーの最後の行の後（カテゴリーの行がない場合は末尾）に置く
+        data = [d for i, d in enumerate(data) if i not in removed]
+        last = {d.get("category"): i for i, d in enumerate(data)}
+        merged = []
+        for i, d in enumerate(data):
+            merged.append(d)
+            if last[d.get("category")] == i:
+                merged.extend(added.pop(d.get("category"), ()))
+        for rows in added.values():
+            merged.extend(rows)
+        self.data = merged
+
+    def _inherit_category(self, d, categories):
+        """カテゴリーが空欄の行（シートの最初の行など）に、継承元の同じparameter_nameの行のカテゴリーを補う機能"""
+        if self.sheet_name == METADATA_SHEET or d.get("category") is not None:
+            return d
+        found = list(categories.get(d["parameter_name"], ()))
+        if len(found) != 1:
+            raise ExcelError(
+                f"{self.sheet_name}シートの継承先の{d['parameter_name']}について、"
+                "カテゴリーが空欄で、継承元からも決められません。カテゴリーを記入してください。"
+            )
+        return {**d, "category": found[0]}
+
+    @property
+    def max_column(self):
+        return len(self.header) + 1
+
+    @property
+    def rows(self):
+        """合わせた内容を、読み取り専用のワークシートと同じ形の行で返す機能"""
+
+        def cell(value, row):
+            return CsvCell(None if value in (None, "None") else value, row)
+
+        row_no = 0
+        if self.sheet_name == METADATA_SHEET:
+            header = self.header
+            yield tuple(cell(c, 1) for c in header)
+            yield tuple(cell(None, 2) for _ in header)
+            row_no = 2
+            for d in self.data:
+                row_no += 1
+                yield tuple(cell(d.get(c), row_no) for c in header)
+            return
+
+        for k, v in self.common.items():
+            row_no += 1
+            yield (cell(k, row_no), cell(v, row_no)) + tuple(
+                cell(None, row_no) for _ in self.header[1:]
+            )
+        row_no += 1
+        yield (cell("header", row_no),) + tuple(cell(c, row_no) for c in self.header)
+        for d in self.data:
+            row_no += 1
+            yield (cell(d["category"], row_no),) + tuple(
+                cell(d.get(c), row_no) for c in self.header
+            )
+
+
+def declared_base(wb):
+    """ワークブックが宣言する継承元（invoice/catalogの要件定義シートの共通部分のbase）を返す機能"""
+    bases = set()
+    for sheet_name in (INVOICE_SHEET, CATALOG_SHEET):
+        if sheet_name in wb.sheetnames:
+            common = read_invoice_catalog_sheet(wb[sheet_name])[0]
+            if check_value(common["base"]):
+                bases.add(common["base"].strip())
+    if len(bases) > 1:
+        raise ExcelError(f"継承元は1つとしてください。base={sorted(bases)}")
+    return bases.pop() if bases else None
+
+
+class InheritedWorkbook:
+    """継承先のワークブックに、継承元のワークブックを合わせたワークブックを表すクラス
+
+    両方にある要件定義シートはMergedSheetとして合わせ、継承先にないシート（用語シートなど）は
+    継承元のシートを用いる。
+    """
+
+    def __init__(self, wb, base):
+        self.wb = wb
+        self.base = base
+        self._merged = {}
+        self.sheetnames = wb.sheetnames + [
+            n for n in base.wb.sheetnames if n not in wb.sheetnames
         ]
+        self.defined_names = {
+            **dict(getattr(base.wb, "defined_names", {})),
+            **dict(getattr(wb, "defined_names", {})),
+        }
+        # 用語シートを持たない場合は、継承元の用語テーブルを共有する
+        if GENERAL_TERM_SHEET in wb.sheetnames or SPECIFIC_TERM_SHEET in wb.sheetnames:
+            self.term_workbook = self
+        else:
+            self.term_workbook = getattr(base.wb, "term_workbook", base.wb)
+
+    def __getitem__(self, sheet_name):
+        in_variant = sheet_name in self.wb.sheetnames
+        if sheet_name in (METADATA_SHEET, INVOICE_SHEET, CATALOG_SHEET) and (
+            in_variant and sheet_name in self.base.wb.sheetnames
+        ):
+            if sheet_name not in self._merged:
+                self._merged[sheet_name] = MergedSheet(
+                    self.base.parsed(sheet_name),
+                    ParsedSheet(sheet_name, self.wb[sheet_name]),
+                )
+            return self._merged[sheet_name]
+        return self.wb[sheet_name] if in_variant else self.base.wb[sheet_name]
+
+    def close(self):
+        # 継承元は、BaseWorkbooksで閉じる
+        self.wb.close()
+
+
+class ParsedBase:
+    """継承元のワークブックと、解析済みの要件定義シートを保持するクラス"""
+
+    def __init__(self, wb):
+        self.wb = wb
+        self._parsed = {}
+
+    def parsed(self, sheet_name):
+        """要件定義シートを解析した内容を返す機能（シートごとに一度だけ解析する）"""
+        if sheet_name not in self._parsed:
+            self._parsed[sheet_name] = ParsedSheet(sheet_name, self.wb[sheet_name])
+        return self._parsed[sheet_name]
+
+
+class BaseWorkbooks:
+    """一括処理の中で、継承元のワークブックを一度だけ開いて解析し、共有するクラス"""
+
+    def __init__(self, eval_formulas=False):
+        self._bases = {}
+        self._opening = set()
+        self.eval_formulas = eval_formulas
+
+    def get(self, path):
+        """継承元のワークブックを返す機能（継承元がさらに継承元を持つ場合も合わせる）"""
+        key = Path(path).resolve()
+        if key in self._opening:
+            raise ExcelError(f"継承元が循環しています。base={key}")
+        if key not in self._bases:
+            if not key.exists():
+                raise ExcelError(f"継承元のファイルが存在しません。base={key}")
+            self._opening.add(key)
+            try:
+                wb = self.inherit(open_workbook(key, self.eval_formulas), key.parent)
+            finally:
+                self._opening.discard(key)
+            self._bases[key] = ParsedBase(wb)
+            print(f" - 継承元{key.name}を読み込みました。")
+        return self._bases[key]
+
+    def inherit(self, wb, base_dir):
+        """ワークブックが継承元を宣言している場合は、継承元と合わせたワークブックを返す機能
+
+        継承元のパスは、base_dir（継承先のファイルがあるフォルダ）からの相対パスとして扱う。
+        """
+        name = declared_base(wb)
+        if not name:
+            return wb
+        return InheritedWorkbook(wb, self.get(Path(base_dir, name)))
+
+    def close(self):
+        for base in self._bases.values():
+            base.wb.close()
+        self._bases.clear()
+
+
+def sheet_check(wb, output_dir, sheet):
+    """対象シートの存在を確認する機能"""
+    # 対象のシート名
+    sheet_name = "要件定義(" + sheet + ")"
+
+    # 対象シートがない場合はFalseを返す
+    ws = get_sheet(wb, sheet_name)
+
+    if not ws:
+        return False, False
+
+    # 対象シートがある場合はシートと出力ファイルパスを返す
+    outfile = output_dir.joinpath(sheet)
+    return ws, outfile
+
+
+def iter_metadata_def(ws):
+    """要件定義(metadata-def.json)のシートから、パラメータ名とmetadata-def.jsonの値を1件ずつ返す機能"""
+    order = 0
+    for d in read_simple_sheet(ws, skipheader=2):
+        if d["output"] == "OFF":
+            continue
+
+        order += 1
+        yield d["parameter_name"], _convert_metadata_def_entry(d, order)
+
+
+def _convert_metadata_def_entry(d, order):
+    """metadata-defの1行分の値を作成する機能"""
+    # typeは変換できる型のいずれかである必要あり
+    validate_dtype(d["type"])
+
+    jdata = defaultdict(dict)
+    jdata["name"] = defaultdict(dict)
+    jdata["schema"] = defaultdict(dict)
+
+    # 項目名(日本語)
+    jdata["name"]["ja"] = d["name/ja"]
+    # 項目名(英語)
+    jdata["name"]["en"] = d["name/en"]
+    # データ型
+    jdata["schema"]["type"] = d["type"]
+    # 表示順序
+    jdata["order"] = order
+    # フォーマット
+    if check_value(d["format"]):
+        jdata["schema"]["format"] = d["format"]
+    # 単位
+    if check_value(d["unit"]):
+        jdata["unit"] = d["unit"]
+    # 説明
+    if check_value(d["description"]):
+        jdata["description"] = d["description"]
+    # URI
+    if check_value(d["uri"]):
+        jdata["uri"] = d["uri"]
+    # 測定モード
+    if check_value(d["mode"]):
+        jdata["mode"] = d["mode"]
+    # Variable
+    if check_value(d["variable"], boolean=True):
+        jdata["variable"] = 1
+    # 固定値
+    if check_value(d["default"], boolean=True):
+        jdata["default"] = convert_value(d["type"], d["sample"])
+    # 装置出力
+    if check_value(d["original_name"]):
+        jdata["original_name"] = d["original_name"]
+
+    return jdata
+
+
+def convert_metadata_def(wb, output_dir):
+    """metadata_defを出力する機能"""
+
+    # シートのチェック
+    ws, outfile = sheet_check(wb, output_dir, "metadata-def.json")
+
+    # 対象シートがない場合は次の処理に移る
+    if not ws:
+        return None
+
+    # Excelからデータを1行ずつ読み込み、json形式で整理して出力する
+    dup_params = DupTracker()
+    with json_stream(outfile) as writer:
+        writer.begin_object()
+        for parameter_name, jdata in iter_metadata_def(ws):
+            dup_params.add(parameter_name)
+            writer.write(parameter_name, jdata)
+        writer.end()
+
+        # 重複するパラメータがあればエラーを出す（出力ファイルは作成しない）
+        raise_dup_params(dup_params.dup, "parameter_name", outfile)
+
+
+# 構造化処理で用いる変換モジュールのファイル名
+MAPPER_FILE = "metadata_mapper.py"
+
+# 変換モジュールの先頭部分（{name}は変換モジュール、{source}は定義のファイル名）
+MAPPER_HEADER = """\
+# -------------------------------------------------
+# {name}
+# excel2template.pyが要件定義(metadata-def.json)のシートから生成した、
+# 装置出力の値を{source}のパラメータに変換するモジュールです。編集しないでください。
+# -------------------------------------------------
+
+from array import array
+
+"""
+
+# 変換モジュールの処理部分（データ部分の後に置く）
+MAPPER_RUNTIME = '''
+
+_NAN = float("nan")
+_MISSING = object()
+_TRUE = frozenset(("true", "1", "yes", "on"))
+
+
+def to_string(value):
+    """値をstringに変換する機能"""
+    return value if value.__class__ is str else str(value)
+
+
+def to_integer(value):
+    """値をintegerに変換する機能（"12.0"・12.0のように小数部が0の値も受け付け、小数部がある値はエラーとする）"""
+    if value.__class__ is int:
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            number = float(value)
+    else:
+        number = value
+    if (number.__class__ is float and not number.is_integer()) or int(number) != number:
+        raise ValueError(f"integerに変換できません: {value!r}")
+    return int(number)
+
+
+def to_number(value):
+    """値をnumberに変換する機能"""
+    return value if value.__class__ is float else float(value)
+
+
+def to_boolean(value):
+    """値をbooleanに変換する機能（true/1/yes/onを真とする）"""
+    if value.__class__ is bool:
+        return value
+    return str(value).strip().lower() in _TRUE
+
+
+CONVERTERS = {
+    "string": to_string,
+    "integer": to_integer,
+    "number": to_number,
+    "boolean": to_boolean,
+}
+
+# 配列に格納するデータ型と、arrayの型コード・欠損値がない場合に用いる組み込みの変換関数
+_TYPECODES = {"number": "d", "integer": "q"}
+_BUILTINS = {"d": float, "q": int}
+# 組み込みの変換関数で値が変わらない型（intは小数部を切り捨てるため、integerではint・strに限る）
+_EXACT_TYPES = {"q": frozenset((int, str))}
+
+# パラメータ名ごとの変換関数
+_CONVERTERS = {
+    name: CONVERTERS[param[1]] for name, param in PARAMETERS.items()
+}
+
+# variableでないパラメータの、装置出力の名前・パラメータ名・変換関数の組
+_SCALARS = tuple(
+    (param[0], name, _CONVERTERS[name])
+    for name, param in PARAMETERS.items()
+    if param[0] is not None and not param[3]
+)
+
+# variableのパラメータの、装置出力の名前・パラメータ名・変換関数・型コードの組
+_VARIABLES = tuple(
+    (param[0], name, _CONVERTERS[name], _TYPECODES.get(param[1]))
+    for name, param in PARAMETERS.items()
+    if param[0] is not None and param[3]
+)
+
+
+def convert(name, value):
+    """パラメータ名を指定して、値をデータ型に変換する機能"""
+    return _CONVERTERS[name](value)
+
+
+def map_record(record, defaults=True):
+    """装置出力の1件（名前: 値）を、パラメータ名: 変換した値の辞書にする機能（variableのパラメータを除く）
+
+    値がない（None・空文字列）パラメータは、defaultsの場合は固定値とする。
+    """
+    out = dict(DEFAULTS) if defaults else {}
+    get = record.get
+    for original, name, conv in _SCALARS:
+        value = get(original, _MISSING)
+        if value is _MISSING or value is None or value == "":
+            continue
+        out[name] = conv(value)
+    return out
+
+
+def iter_records(records, defaults=True):
+    """装置出力の複数の件を、1件ずつ変換して返す機能"""
+    for record in records:
+        yield map_record(record, defaults)
+
+
+def _column(values, conv, typecode):
+    """1列分の値を変換して、配列（number・integer）またはリストにする機能
+
+    欠損値（None・空文字列）は、numberではnan、その他ではNoneとする（integerの場合はリストになる）。
+    """
+    exact = _EXACT_TYPES.get(typecode)
+    if typecode is not None and (exact is None or exact.issuperset(map(type, values))):
+        try:
+            return array(typecode, map(_BUILTINS[typecode], values))
+        except (TypeError, ValueError):
+            pass
+    converted = [None if v is None or v == "" else conv(v) for v in values]
+    if typecode == "d":
+        return array("d", [_NAN if v is None else v for v in converted])
+    if typecode == "q" and None not in converted:
+        return array("q", converted)
+    return converted
+
+
+def map_columns(columns):
+    """装置出力の列（名前: 値の並び）を、variableのパラメータ名: 配列の辞書にする機能"""
+    out = {}
+    for original, name, conv, typecode in _VARIABLES:
+        values = columns.get(original)
+        if values is not None:
+            out[name] = _column(values, conv, typecode)
+    return out
+
+
+def map_table(header, rows):
+    """見出し行（装置出力の名前の並び）と行の並びを、variableのパラメータ名: 配列の辞書にする機能"""
+    rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+    index = {original: i for i, original in enumerate(header)}
+    out = {}
+    for original, name, conv, typecode in _VARIABLES:
+        i = index.get(original)
+        if i is not None:
+            out[name] = _column([row[i] for row in rows], conv, typecode)
+    return out
+
+
+def map_rows(rows):
+    """装置出力の行（名前: 値の辞書）の並びを、variableのパラメータ名: 配列の辞書にする機能"""
+    rows = rows if isinstance(rows, (list, tuple)) else list(rows)
+    present = set().union(*rows)
+    out = {}
+    for original, name, conv, typecode in _VARIABLES:
+        if original in present:
+            out[name] = _column([row.get(original) for row in rows], conv, typecode)
+    return out
+'''
+
+
+def render_metadata_mapper(params, source="metadata-def.json"):
+    """パラメータの定義から、構造化処理で用いる変換モジュールのソースを作成する機能
+
+    paramsは、パラメータ名とmetadata-def.jsonの値の組の並びとする。
+    装置出力の名前（original_name）が重複する場合はエラーとする。
+    """
+    parameters = {}
+    original_names = {}
+    defaults = {}
+    for name, jdata in params:
+        original = jdata.get("original_name")
+        dtype = jdata["schema"]["type"]
+        variable = bool(jdata.get("variable"))
+        if dtype not in ("string", "integer", "number", "boolean"):
+            raise ExcelError(
+                f"変換できないデータ型です。parameter_name={name}, type={dtype}"
+            )
+        if original is not None:
+            if original in original_names:
+                raise ExcelError(
+                    "original_nameが重複しています。"
+                    f"original_name={original}, parameter_name={original_names[original]}, {name}"
+                )
+            original_names[original] = name
+        parameters[name] = (
+            original,
+            dtype,
+            jdata.get("unit"),
+            variable,
+            jdata.get("mode"),
+        )
+        if "default" in jdata and not variable:
+            defaults[name] = jdata["default"]
+
+    def literal(comment, name, value):
+        items = "".join(f"    {k!r}: {v!r},\n" for k, v in value.items())
+        return f"# {comment}\n{name} = {{\n{items}}}\n"
+
+    text = (
+        MAPPER_HEADER.format(name=MAPPER_FILE, source=source)
+        + literal(
+            "パラメータ名: (装置出力の名前, データ型, 単位, variable, 測定モード)",
+            "PARAMETERS",
+            parameters,
+        )
+        + "\n"
+        + literal(
+            "装置出力の名前からパラメータ名への索引", "ORIGINAL_NAMES", original_names
+        )
+        + "\n"
+        + literal("値がない場合の固定値", "DEFAULTS", defaults)
+        + MAPPER_RUNTIME
+    )
+    # 生成したソースが構文として正しいことを確認する
+    compile(text, MAPPER_FILE, "exec")
+    return text
+
+
+def convert_metadata_mapper(wb, output_dir):
+    """metadata-def.jsonと同じ定義から、構造化処理で用いる変換モジュールを出力する機能"""
+
+    # シートのチェック
+    ws, outfile = sheet_check(wb, output_dir, "metadata-def.json")
+
+    # 対象シートがない場合は次の処理に移る
+    if not ws:
+        return None
+
+    params = list(iter_metadata_def(ws))
+    dup_params = DupTracker()
+    for name, _ in params:
+        dup_params.add(name)
+    raise_dup_params(dup_params.dup, "parameter_name", outfile)
+
+    text = render_metadata_mapper(params, outfile.name)
+    with output_file(output_dir.joinpath(MAPPER_FILE)) as f:
+        f.write(text)
+
+
+def _read_invoice_src_sheets(wb, output_dir, sheet_name, term_store=None):
+    """引数で指定するシートと、2つのID対応表（用語ストアまたはシート）を読み込んで内容を返す機能"""
+
+    # 用語テーブルの取得
+    term_tables = get_term_tables(wb, term_store)
+
+    # 事前準備するシートがない場合は次の処理に移る
+    if not term_tables:
+        return None
+    data_gt, data_st = term_tables
+
+    # シートのチェック
+    ws, outfile = sheet_check(wb, output_dir, sheet_name)
+
+    # 対象シートがない場合は次の処理に移る
+    if not ws:
+        return None
+
+    # Excelからデータを読み込む（データ部は走査のたびにシートから読み直す）
+    common_data, header, _ = read_invoice_catalog_sheet(ws)
+    data = SheetRows(ws)
+
+    # key_nameに重複がないかチェック
+    dup_keys = data_gt.dup_keys()
+    if dup_keys:
+        raise ExcelError(
+            f"{data_gt.sheet_name}に複数の {dup_keys}（key_name）が存在します"
+        )
+
+    return common_data, data, data_gt, data_st, outfile, get_enum_table(wb)
+
+
+def _read_catalog_src_sheet(wb, output_dir, sheet_name):
+    """引数で指定するシートを読み込んで内容を返す機能"""
+
+    # シートのチェック
+    ws, outfile = sheet_check(wb, output_dir, sheet_name)
+
+    # 対象シートがない場合は次の処理に移る
+    if not ws:
+        return None
+
+    # Excelからデータを読み込む（データ部は走査のたびにシートから読み直す）
+    common_data, header, _ = read_invoice_catalog_sheet(ws)
+    data = SheetRows(ws)
+
+    return common_data, data, outfile, get_enum_table(wb)
+
+
+def _convert_property_schema(d, enums, examples_array=False):
+    """custom/catalogの1行分のプロパティを作成する機能"""
+    # typeは変換できる型のいずれかで、正規表現はRDEの画面とPythonの両方で解釈でき、
+    # 照合に時間がかかり得る形でない必要あり
+    try:
+        validate_dtype(d["type"])
+        if check_value(d["pattern"]):
+            compile_pattern(d["pattern"])
+    except ExcelError as e:
+        raise ExcelError(f"{e}, parameter_name={d['parameter_name']}") from None
+
+    prop = defaultdict(dict)
+
+    # 項目名(日本語)
+    prop["label"]["ja"] = d["label/ja"]
+    # 項目名(英語)
+    prop["label"]["en"] = d["label/en"]
+    # データ型
+    prop["type"] = d["type"]
+    # フォーマット
+    if check_value(d["format"]):
+        prop["format"] = d["format"]
+    # 説明
+    if check_value(d["description"]):
+        prop["description"] = d["description"]
+    # 内容サンプル（invoiceは配列、catalogは値で格納する）
+    if check_value(d["examples"]):
+        example = convert_value(d["type"], d["examples"])
+        prop["examples"] = [example] if examples_array else example
+    # 初期値
+    if check_value(d["default"]):
+        prop["default"] = convert_value(d["type"], d["default"])
+    # 固定値
+    if check_value(d["const"]):
+        prop["const"] = convert_value(d["type"], d["const"])
+    # 値のリスト
+    enum = enums.get(d["enum"])
+    if enum:
+        prop["enum"] = list(enum.convert(d["type"]).values)
+    # テキストエリア
+    if check_value(d["options/widget"]):
+        prop["options"]["widget"] = d["options/widget"]
+    # 行数
+    if check_value(d["options/rows"]):
+        prop["options"]["rows"] = int(d["options/rows"])
+    # 単位
+    if check_value(d["options/unit"]):
+        prop["options"]["unit"] = d["options/unit"]
+    # プレイスホルダ
+    if check_value(d["options/placeholder/ja"]) or check_value(
+        d["options/placeholder/en"]
+    ):
+        prop["options"]["placeholder"] = defaultdict(dict)
+    # プレイスホルダ(日本語)
+    if check_value(d["options/placeholder/ja"]):
+        prop["options"]["placeholder"]["ja"] = d["options/placeholder/ja"]
+    # プレイスホルダ(英語)
+    if check_value(d["options/placeholder/en"]):
+        prop["options"]["placeholder"]["en"] = d["options/placeholder/en"]
+    # 数値上限(以下)
+    if check_value(d["maximum"]):
+        prop["maximum"] = float(d["maximum"])
+    # 数値上限(未満)
+    if check_value(d["exclusiveMaximum"]):
+        prop["exclusiveMaximum"] = float(d["exclusiveMaximum"])
+    # 数値下限(以上)
+    if check_value(d["minimum"]):
+        prop["minimum"] = float(d["minimum"])
+    # 数値下限(より上)
+    if check_value(d["exclusiveMinimum"]):
+        prop["exclusiveMinimum"] = float(d["exclusiveMinimum"])
+    # 最大文字数
+    if check_value(d["maxLength"]):
+        prop["maxLength"] = int(d["maxLength"])
+    # 最小文字数
+    if check_value(d["minLength"]):
+        prop["minLength"] = int(d["minLength"])
+    # 正規表現
+    if check_value(d["pattern"]):
+        prop["pattern"] = d["pattern"]
+
+    return prop
+
+
+DEFS_REF_PREFIX = "#/$defs/"
+
+
+def defs_ref(name):
+    """$defsの名前を、$refに指定するURIの断片（JSON Pointer）にする機能
+
+    JSON Pointerとして「~」「/」をエスケープし、URIの断片として使えない文字はパーセントエンコードする。
+    """
+    token = name.replace("~", "~0").replace("/", "~1")
+    return DEFS_REF_PREFIX + quote(token, safe="~!$&'()*+,;=:@")
+
+
+def defs_ref_name(ref):
+    """$refから、参照する$defsの名前を取り出す機能（$defsを参照しない場合はNone）"""
+    if not isinstance(ref, str) or not ref.startswith(DEFS_REF_PREFIX):
+        return None
+    token = unquote(ref.removeprefix(DEFS_REF_PREFIX))
+    if "/" in token:
+        # $defsの断片の内部を指す参照には対応しない
+        return None
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def resolve_defs_ref(node, jdata):
+    """$refで参照する$defsの断片を展開する機能（jdataは$defsを含むスキーマ全体）"""
+    name = defs_ref_name(node.get("$ref"))
+    if name is None:
+        return node
+    fragment = jdata.get("$defs", {}).get(name, {})
+    return {**fragment, **{k: v for k, v in node.items() if k != "$ref"}}
+
+
+class SharedDefs:
+    """構造が同一のプロパティの断片を、$defsにまとめて$refで参照させるクラス
+
+    1回目の走査でcount()に全プロパティを渡して断片の出現回数を数え、
+    2回目の走査でapply()を通したプロパティを出力し、最後にdefs()を$defsとして出力する。
+    """
+
+    # $defsに切り出すキー（項目ごとに異なるlabel・description・値は切り出さない）
+    shared_keys = (
+        "type",
+        "format",
+        "enum",
+        "options",
+        "maximum",
+        "exclusiveMaximum",
+        "minimum",
+        "exclusiveMinimum",
+        "maxLength",
+        "minLength",
+        "pattern",
+    )
+
+    def __init__(self):
+        self.counts = Counter()
+        self.names = {}
+        self.fragments = {}
+        # $refに置き換えたことで減ったバイト数と、$defsのバイト数
+        self.saved = 0
+        self.defs_size = 0
+
+    def _split(self, prop):
+        """プロパティを、共通化する断片とそれ以外に分ける機能"""
+        fragment = {k: v for k, v in prop.items() if k in self.shared_keys}
+        # type・formatだけの断片は、$refにしても小さくならないため共通化しない
+        if not set(fragment) - {"type", "format"}:
+            return None, None, prop
+        rest = {k: v for k, v in prop.items() if k not in self.shared_keys}
+        return json.dumps(fragment, sort_keys=True), fragment, rest
+
+    def count(self, name, prop):
+        """断片の出現回数を数える機能"""
+        key, fragment, _ = self._split(prop)
+        if key is None:
+            return
+        self.counts[key] += 1
+        self.names.setdefault(key, name)
+        if self.counts[key] == 2:
+            self.fragments[key] = fragment
+
+    def apply(self, prop, writer):
+        """2回以上出現する断片を$refに置き換えたプロパティを返す機能"""
+        key, _, rest = self._split(prop)
+        if key is None or self.counts[key] < 2:
+            return prop
+        rest["$ref"] = defs_ref(self.names[key])
+        self.saved += len(writer.dumps(prop).encode("utf_8")) - len(
+            writer.dumps(rest).encode("utf_8")
+        )
+        return rest
+
+    def defs(self):
+        """$defsに出力する断片を返す機能"""
+        return {self.names[k]: v for k, v in self.fragments.items()}
+
+    def write_defs(self, writer):
+        """$defsを出力する機能"""
+        if self.fragments:
+            self.defs_size = len(writer.write("$defs", self.defs()).encode("utf_8"))
+
+    def print_report(self, outfile):
+        """インライン出力の場合と比べたサイズを表示する機能"""
+        if not self.fragments:
+            print(f" - {outfile.name}: 共通化できるプロパティはありませんでした。")
+            return
+        size = output_size(outfile)
+        inline_size = size - self.defs_size + self.saved
+        print(
+            f" - {outfile.name}: $defs {len(self.fragments)}件, "
+            f"{inline_size} → {size} bytes "
+            f"({(inline_size - size) / inline_size * 100:.1f}%削減)"
+        )
+
+
+def _convert_invoice_schema_impl(rtn_v, factor_defs=False):
+    """invoice.schema.jsonを出力する機能"""
+
+    # 渡されたデータをそれぞれの変数に格納
+    common_data, data, data_gt, data_st, outfile, enums = rtn_v
+
+    # 出力する部分と、customの必須項目（と共通化する断片）を先に調べる
+    has_custom = has_sample = has_general = has_specific = False
+    custom_required = []
+    shared = SharedDefs() if factor_defs else None
+    for d in data:
+        if d["output"] == "OFF":
+            continue
+        if d["category"] == "custom":
+            has_custom = True
+            if check_value(d["required"], boolean=True):
+                custom_required.append(d["parameter_name"])
+            if shared:
+                shared.count(
+                    d["parameter_name"],
+                    _convert_property_schema(d, enums, examples_array=True),
+                )
+        if d["category"].startswith("sample"):
+            has_sample = True
+        if d["category"] == "sample_general":
+            has_general = True
+        if d["category"] == "sample_specific":
+            has_specific = True
+
+    with json_stream(outfile) as writer:
+        # ルート部分
+        writer.begin_object()
+        # $schema
+        writer.write("$schema", common_data["$schema"])
+        # $id
+        writer.write("$id", common_data["$id"])
+        # description
+        if (not common_data["description"] is None) and (
+            not len(common_data["description"].strip()) == 0
+        ):
+            writer.write("description", common_data["description"])
+        # type
+        writer.write("type", "object")
+        # required
+        writer.write(
+            "required",
+            [k for k, v in (("custom", has_custom), ("sample", has_sample)) if v],
+        )
+        # properties
+        writer.begin_object("properties")
+
+        # sample generalAttributes/specificAttributesの要素（用語の数に限られるため保持する）
+        general_items = []
+        specific_items = []
+
+        # customの部分
+        if has_custom:
+            # properties/custom
+            writer.begin_object("custom")
+            # properties/custom/type
+            writer.write("type", "object")
+            # properties/custom/label
+            writer.write("label", {"ja": "固有情報", "en": "Custom Information"})
+            # properties/custom/required
+            writer.write("required", custom_required)
+            # properties/custom/properties
+            writer.begin_object("properties")
+
+        dup_params = DupTracker()
+        for d in data:
+            if d["output"] == "OFF":
+                continue
+
+            # customの部分
+            if d["category"] == "custom":
+                dup_params.add(d["parameter_name"])
+                prop = _convert_property_schema(d, enums, examples_array=True)
+                if shared:
+                    prop = shared.apply(prop, writer)
+                writer.write(d["parameter_name"], prop)
+
+            # sample_commonの部分
+            if d["category"] == "sample_common":
+                continue
+
+            # sample_generalの部分
+            if d["category"] == "sample_general":
+                term = lookup_term(data_gt, data_gt.name_col, d["term"], outfile)
+                general_items.append({
+                    "type": "object",
+                    "required": ["termId"],
+                    "properties": {"termId": {"const": term["term_id"]}},
+                })
+
+            # sample_specificの部分
+            if d["category"] == "sample_specific":
+                term = lookup_term(data_st, data_st.name_col, d["term"], outfile)
+                specific_items.append({
+                    "type": "object",
+                    "required": ["classId", "termId"],
+                    "properties": {
+                        "classId": {"const": term["sample_class_id"]},
+                        "termId": {"const": term["term_id"]},
+                    },
+                })
+
+        if has_custom:
+            writer.end()
+            writer.end()
+
+        # 重複するパラメータがあればエラーを出す（出力ファイルは作成しない）
+        raise_dup_params(dup_params.dup, "custom", outfile)
+
+        # sampleの部分
+        if has_sample:
+            # properties/sample
+            writer.begin_object("sample")
+            # properties/sample/type
+            writer.write("type", "object")
+            # properties/sample/label
+            writer.write("label", {"ja": "試料情報", "en": "Sample Information"})
+            # properties/sample/properties
+            writer.begin_object("properties")
+            # properties/sample/properties/generalAttributes
+            if has_general:
+                writer.write(
+                    "generalAttributes", {"type": "array", "items": general_items}
+                )
+            # properties/sample/properties/specificAttributes
+            if has_specific:
+                writer.write(
+                    "specificAttributes", {"type": "array", "items": specific_items}
+                )
+            writer.end()
+            writer.end()
+
+        writer.end()
+        # $defs
+        if shared:
+            shared.write_defs(writer)
+        writer.end()
+
+    if shared:
+        shared.print_report(outfile)
+
+
+def convert_invoice_schema(wb, output_dir, term_store=None, factor_defs=False):
+    """シートの内容を読み込み、invoice.schema.jsonを出力する機能"""
+
+    rtn_v = _read_invoice_src_sheets(wb, output_dir, "invoice.schema.json", term_store)
+    # 対象シートがない場合は次の処理に移る
+    if not rtn_v:
+        return None
+    _convert_invoice_schema_impl(rtn_v, factor_defs)
+
+
+def _convert_invoice_example_impl(rtn_v):
+    """invoice.jsonを出力する機能"""
+
+    s = "x"
+    default_uuid = f"{s * 8}-{s * 4}-{s * 4}-{s * 4}-{s * 12}"
+    default_string_56 = s * 56
+
+    # 渡されたデータをそれぞれの変数に格納
+    _, data, data_gt, data_st, outfile, enums = rtn_v
+    outfile = outfile.parent.joinpath("invoice.json")
+
+    # sample部分の行（sample_commonの全行と、output==ONの行。用語の数に限られるため保持する）
+    samples = ["sample_common", "sample_general", "sample_specific"]
+    data_samples = defaultdict(list)
+    has_sample_on = False
+
+    dup_custom = DupTracker()
+    with json_stream(outfile, indent=2) as writer:
+        writer.begin_object()
+
+        # basic部分
+        writer.write("datasetId", default_uuid)
+        writer.write(
+            "basic",
+            {
+                "dateSubmitted": f"{datetime.today().strftime('%Y-%m-%d')}",
+                "dataOwnerId": default_string_56,
+                "dataName": "%%data_name%%",
+                "instrumentId": default_uuid,
+                "experimentId": "%%experiment_id%%",
+                "description": "%%description%%",
+            },
+        )
+
+        for d in data:
+            if not check_value(d["parameter_name"]):
+                continue
+
+            # sample_commonの行は、output列によらず保持する
+            if d["category"] == "sample_common":
+                data_samples[d["category"]].append(d)
+            if not d["output"] == "ON":
+                continue
+            if d["category"] in samples:
+                has_sample_on = True
+                if d["category"] != "sample_common":
+                    data_samples[d["category"]].append(d)
+                continue
+
+            # custom - 固有情報
+            if d["category"] == "custom":
+                param = d["parameter_name"]
+                if not dup_custom.seen:
+                    writer.begin_object("custom")
+                dup_custom.add(param)
+                # JSONに格納すべき値を得る
+                v = get_validated_value(param, d, DTYPES, outfile, enums)
+                writer.write(param, v)
+
+        if dup_custom.seen:
+            writer.end()
+
+        # 重複するパラメータがあればエラーを出す（出力ファイルは作成しない）
+        raise_dup_params(dup_custom.dup, "custom", outfile)
+
+        # sample - 資料情報
+        # 資料情報全体にoutput==ONである行が１つ以上存在する場合は、sample_commonの全7行を出力する
+        if has_sample_on:
+            writer.write(
+                "sample",
+                _convert_invoice_example_sample(
+                    data_samples, data_gt, data_st, outfile, default_string_56
+                ),
+            )
 
-        # 重複するパラメータがあればエラーを出す
-        check_dup_params(data_sample_c, category_name, outfile)
-
-        # Excelのパラメータ名とJSONのプロパティ名の対応（要確認）
-        param2prop = {
-            "sample_name_(local_id)": "names",
-            "chemical_formula_etc.": "composition",
-            "administrator_(affiliation)": "ownerId",
-            "reference_url": "referenceUrl",
-            "related_samples": "related_samples",
-            "tags": "tags",
-            "description": "description",
-        }
+        writer.end()
 
-        # sampleId
-        jdata["sample"]["sampleId"] = ""
-        # sample_name_(local_id)のデフォルト値
-        jdata["sample"][param2prop["sample_name_(local_id)"]] = []
-        # administrator_(affiliation)のデフォルト値
-        jdata["sample"][param2prop["administrator_(affiliation)"]] = default_string_56
 
-        for d in data_sample_c:
-            param = d["parameter_name"]
-            example = d["examples"] if check_value(d["examples"]) else "null"
+# sample_commonの、Excelのパラメータ名とJSONのプロパティ名の対応（要確認）
+SAMPLE_COMMON_PROPS = {
+    "sample_name_(local_id)": "names",
+    "chemical_formula_etc.": "composition",
+    "administrator_(affiliation)": "ownerId",
+    "reference_url": "referenceUrl",
+    "related_samples": "related_samples",
+    "tags": "tags",
+    "description": "description",
+}
 
-            # sample_name_(local_id)のみ、arrayとなる
-            if param == "sample_name_(local_id)":
-                jdata["sample"][param2prop["sample_name_(local_id)"]] = example.split(
-                    ","
-                )
-            elif param == "administrator_(affiliation)":
-                pass
-            else:
-                jdata["sample"][param2prop[param]] = convert_value("string", example)
 
-        # sample_general - 資料情報（一般項目）
-        category_name = "sample_general"
-        data_sample_g = [d for d in data_on if d["category"] == category_name]
+def sample_common_prop(param):
+    """sample_commonのパラメータ名から、JSONのプロパティ名を求める機能"""
+    if param not in SAMPLE_COMMON_PROPS:
+        raise ExcelError(
+            "sample_commonのparameter_nameは、"
+            f"{'/'.join(sorted(SAMPLE_COMMON_PROPS))}のいずれかとしてください。"
+            f"parameter_name={param}"
+        )
+    return SAMPLE_COMMON_PROPS[param]
 
-        if data_sample_g:
-            # 重複するパラメータがあればエラーを出す
-            check_dup_params(data_sample_g, category_name, outfile)
 
-            generalAttributes = []
+def _convert_invoice_example_sample(
+    data_samples, data_gt, data_st, outfile, default_string_56
+):
+    """invoice.jsonのsample部分を作成する機能"""
+    jdata = {}
 
-            for d in data_sample_g:
-                param = d["parameter_name"]
-                example = d["examples"] if check_value(d["examples"]) else "null"
-                termIds = [x["term_id"] for x in data_gt if x["key_name"] == param]
-                if termIds:
-                    d = {"termId": termIds[0], "value": example}
-                    generalAttributes.append(d)
-                else:
-                    raise ExcelError(
-                        f"{param}は、要件定義（{outfile.name}）シートに存在しません。"
-                    )
+    # sample_common - 資料情報（共通項目）
+    category_name = "sample_common"
+    data_sample_c = data_samples[category_name]
 
-            jdata["sample"]["generalAttributes"] = generalAttributes
+    # 重複するパラメータがあればエラーを出す
+    check_dup_params(data_sample_c, category_name, outfile)
 
-        # sample_specific - 資料情報（分類別項目）
-        category_name = "sample_specific"
-        data_sample_s = [d for d in data_on if d["category"] == category_name]
+    # sampleId
+    jdata["sampleId"] = ""
+    # sample_name_(local_id)のデフォルト値
+    jdata[SAMPLE_COMMON_PROPS["sample_name_(local_id)"]] = []
+    # administrator_(affiliation)のデフォルト値
+    jdata[SAMPLE_COMMON_PROPS["administrator_(affiliation)"]] = default_string_56
 
-        if data_sample_s:
-            # 重複するパラメータがあればエラーを出す
-            check_dup_params(data_sample_s, category_name, outfile)
+    for d in data_sample_c:
+        param = d["parameter_name"]
+        example = d["examples"] if check_value(d["examples"]) else "null"
 
-            specificAttributes = []
+        prop = sample_common_prop(param)
 
-            for d in data_sample_s:
-                param = d["parameter_name"]
-                example = d["examples"] if check_value(d["examples"]) else "null"
-                classIds = [
-                    x["sample_class_id"] for x in data_st if x["key_name"] == param
-                ]
-                termIds = [x["term_id"] for x in data_st if x["key_name"] == param]
-                if termIds:
-                    d = {"classId": classIds[0], "termId": termIds[0], "value": example}
-                    specificAttributes.append(d)
-                else:
-                    raise ExcelError(
-                        f"{param}は、要件定義（{outfile.name}）シートに存在しません。"
-                    )
+        # sample_name_(local_id)のみ、arrayとなる
+        if param == "sample_name_(local_id)":
+            jdata[prop] = example.split(",")
+        elif param == "administrator_(affiliation)":
+            pass
+        else:
+            jdata[prop] = convert_value("string", example)
 
-            jdata["sample"]["specificAttributes"] = specificAttributes
+    # sample_general - 資料情報（一般項目）
+    category_name = "sample_general"
+    data_sample_g = data_samples[category_name]
 
-    # JSON形式で出力
-    outfile = outfile.parent.joinpath("invoice.json")
-    json_dump(jdata, outfile, indent=2)
+    if data_sample_g:
+        # 重複するパラメータがあればエラーを出す
+        check_dup_params(data_sample_g, category_name, outfile)
+
+        generalAttributes = []
+
+        for d in data_sample_g:
+            param = d["parameter_name"]
+            example = d["examples"] if check_value(d["examples"]) else "null"
+            term = lookup_term(data_gt, "key_name", param, outfile)
+            generalAttributes.append({"termId": term["term_id"], "value": example})
+
+        jdata["generalAttributes"] = generalAttributes
+
+    # sample_specific - 資料情報（分類別項目）
+    category_name = "sample_specific"
+    data_sample_s = data_samples[category_name]
+
+    if data_sample_s:
+        # 重複するパラメータがあればエラーを出す
+        check_dup_params(data_sample_s, category_name, outfile)
+
+        specificAttributes = []
+
+        for d in data_sample_s:
+            param = d["parameter_name"]
+            example = d["examples"] if check_value(d["examples"]) else "null"
+            term = lookup_term(data_st, "key_name", param, outfile)
+            specificAttributes.append({
+                "classId": term["sample_class_id"],
+                "termId": term["term_id"],
+                "value": example,
+            })
+
+        jdata["specificAttributes"] = specificAttributes
+
+    return jdata
 
 
-def convert_invoice_example(wb, output_dir):
+def convert_invoice_example(wb, output_dir, term_store=None):
     """シートの内容を読み込み、invoice.jsonを出力する機能"""
 
-    rtn_v = _read_invoice_src_sheets(wb, output_dir, "invoice.schema.json")
+    rtn_v = _read_invoice_src_sheets(wb, output_dir, "invoice.schema.json", term_store)
     # 対象シートがない場合は次の処理に移る
     if not rtn_v:
         return None
     _convert_invoice_example_impl(rtn_v)
 
 
-def _convert_catalog_schema_impl(rtn_v):
+def _convert_catalog_schema_impl(rtn_v, factor_defs=False):
     """catalog.schema.jsonを出力する機能"""
 
     # 渡されたデータをそれぞれの変数に格納
-    common_data, data, outfile = rtn_v
-
-    # json形式で整理する
-    jdata = defaultdict(dict)
-
-    # ルート部分
-    # $schema
-    jdata["$schema"] = common_data["$schema"]
-    # $id
-    jdata["$id"] = common_data["$id"]
-    # type
-    jdata["type"] = "object"
-    # required
-    jdata["required"] = ["catalog"]
-    # description
-    if (not common_data["description"] is None) and (
-        not len(common_data["description"].strip()) == 0
-    ):
-        jdata["description"] = common_data["description"]
-
-    # catalog部分
-    jdata["properties"]["catalog"] = defaultdict(dict)
-    # properties/catalog/type
-    jdata["properties"]["catalog"]["type"] = "object"
-    # properties/catalog/label/ja
-    jdata["properties"]["catalog"]["label"]["ja"] = common_data["title/ja"]
-    # properties/catalog/label/en
-    jdata["properties"]["catalog"]["label"]["en"] = common_data["title/en"]
-    # properties/catalog/requiredにリストを準備
-    jdata["properties"]["catalog"]["required"] = []
-
-    # properties部分
-    jdata["properties"]["catalog"]["properties"] = defaultdict(dict)
+    common_data, data, outfile, enums = rtn_v
 
+    # 必須項目（と共通化する断片）を先に調べる
+    catalog_required = []
+    shared = SharedDefs() if factor_defs else None
     for d in data:
         if d["output"] == "OFF":
             continue
-
-        jdata["properties"]["catalog"]["properties"][d["parameter_name"]] = defaultdict(
-            dict
-        )
-
-        # 項目名(日本語)
-        jdata["properties"]["catalog"]["properties"][d["parameter_name"]]["label"][
-            "ja"
-        ] = d["label/ja"]
-        # 項目名(英語)
-        jdata["properties"]["catalog"]["properties"][d["parameter_name"]]["label"][
-            "en"
-        ] = d["label/en"]
-        # データ型
-        jdata["properties"]["catalog"]["properties"][d["parameter_name"]]["type"] = d[
-            "type"
-        ]
-        # 必須項目
         if check_value(d["required"], boolean=True):
-            jdata["properties"]["catalog"]["required"].append(d["parameter_name"])
-        # フォーマット
-        if check_value(d["format"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "format"
-            ] = d["format"]
-        # 説明
-        if check_value(d["description"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "description"
-            ] = d["description"]
-        # 内容サンプル
-        if check_value(d["examples"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "examples"
-            ] = convert_value(d["type"], d["examples"])
-        # 初期値
-        if check_value(d["default"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "default"
-            ] = convert_value(d["type"], d["default"])
-        # 固定値
-        if check_value(d["const"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "const"
-            ] = convert_value(d["type"], d["const"])
-        # 値のリスト
-        if check_value(d["enum"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "enum"
-            ] = [convert_value(d["type"], v) for v in d["enum"].split(",")]
-        # テキストエリア
-        if check_value(d["options/widget"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "options"
-            ]["widget"] = d["options/widget"]
-        # 行数
-        if check_value(d["options/rows"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "options"
-            ]["rows"] = int(d["options/rows"])
-        # 単位
-        if check_value(d["options/unit"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "options"
-            ]["unit"] = d["options/unit"]
-        # プレイスホルダ
-        if check_value(d["options/placeholder/ja"]) or check_value(
-            d["options/placeholder/en"]
+            catalog_required.append(d["parameter_name"])
+        if shared:
+            shared.count(d["parameter_name"], _convert_property_schema(d, enums))
+
+    with json_stream(outfile) as writer:
+        # ルート部分
+        writer.begin_object()
+        # $schema
+        writer.write("$schema", common_data["$schema"])
+        # $id
+        writer.write("$id", common_data["$id"])
+        # type
+        writer.write("type", "object")
+        # required
+        writer.write("required", ["catalog"])
+        # description
+        if (not common_data["description"] is None) and (
+            not len(common_data["description"].strip()) == 0
         ):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "options"
-            ]["placeholder"] = defaultdict(dict)
-        # プレイスホルダ(日本語)
-        if check_value(d["options/placeholder/ja"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "options"
-            ]["placeholder"]["ja"] = d["options/placeholder/ja"]
-        # プレイスホルダ(英語)
-        if check_value(d["options/placeholder/en"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "options"
-            ]["placeholder"]["en"] = d["options/placeholder/en"]
-        # 数値上限(以下)
-        if check_value(d["maximum"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "maximum"
-            ] = float(d["maximum"])
-        # 数値上限(未満)
-        if check_value(d["exclusiveMaximum"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "exclusiveMaximum"
-            ] = float(d["exclusiveMaximum"])
-        # 数値下限(以上)
-        if check_value(d["minimum"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "minimum"
-            ] = float(d["minimum"])
-        # 数値下限(より上)
-        if check_value(d["exclusiveMinimum"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "exclusiveMinimum"
-            ] = float(d["exclusiveMinimum"])
-        # 最大文字数
-        if check_value(d["maxLength"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "maxLength"
-            ] = int(d["maxLength"])
-        # 最小文字数
-        if check_value(d["minLength"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "minLength"
-            ] = int(d["minLength"])
-        # 正規表現
-        if check_value(d["pattern"]):
-            jdata["properties"]["catalog"]["properties"][d["parameter_name"]][
-                "pattern"
-            ] = d["pattern"]
+            writer.write("description", common_data["description"])
+
+        # catalog部分
+        writer.begin_object("properties")
+        writer.begin_object("catalog")
+        # properties/catalog/type
+        writer.write("type", "object")
+        # properties/catalog/label
+        writer.write(
+            "label", {"ja": common_data["title/ja"], "en": common_data["title/en"]}
+        )
+        # properties/catalog/required
+        writer.write("required", catalog_required)
+
+        # properties部分
+        writer.begin_object("properties")
+        dup_params = DupTracker()
+        for d in data:
+            if d["output"] == "OFF":
+                continue
+            dup_params.add(d["parameter_name"])
+            prop = _convert_property_schema(d, enums)
+            if shared:
+                prop = shared.apply(prop, writer)
+            writer.write(d["parameter_name"], prop)
+
+        writer.end()
+        writer.end()
+        writer.end()
+        # $defs
+        if shared:
+            shared.write_defs(writer)
+        writer.end()
 
-    # JSON形式で出力
-    json_dump(jdata, outfile)
+        # 重複するパラメータがあればエラーを出す（出力ファイルは作成しない）
+        raise_dup_params(dup_params.dup, "catalog", outfile)
 
+    if shared:
+        shared.print_report(outfile)
 
-def convert_catalog_schema(wb, output_dir):
+
+def convert_catalog_schema(wb, output_dir, factor_defs=False):
     """シートの内容を読み込み、catalog.schema.jsonを出力する機能"""
 
     rtn_v = _read_catalog_src_sheet(wb, output_dir, "catalog.schema.json")
     # 対象シートがない場合は次の処理に移る
     if not rtn_v:
         return None
-    _convert_catalog_schema_impl(rtn_v)
+    _convert_catalog_schema_impl(rtn_v, factor_defs)
 
 
 def _convert_catalog_example_impl(rtn_v):
     """catalog.jsonを出力する機能"""
 
-    expected_dtypes = ["boolean", "integer", "number", "string"]
     # 渡されたデータをそれぞれの変数に格納
-    common_data, data, outfile = rtn_v
-
-    # データを抽出する
-    data_on = [
-        d for d in data if check_value(d["parameter_name"]) and d["output"] == "ON"
-    ]
+    common_data, data, outfile, enums = rtn_v
+    outfile = outfile.parent.joinpath("catalog.json")
 
-    # 重複するパラメータがあればエラーを出す
+    # 重複するパラメータを調べる
     category_name = "parameter_name"
-    check_dup_params(data_on, category_name, outfile)
+    dup_params = DupTracker()
 
-    # json形式で整理する
-    jdata = defaultdict(dict)
-    jdata["$schema"] = common_data["$schema"]
-    jdata["catalog"] = {}
+    with json_stream(outfile, indent=2) as writer:
+        writer.begin_object()
+        writer.write("$schema", common_data["$schema"])
+        writer.begin_object("catalog")
 
-    for d in data_on:
-        param = d["parameter_name"]
-        v = get_validated_value(param, d, expected_dtypes, outfile)
-        jdata["catalog"][param] = v
+        for d in data:
+            if not (check_value(d["parameter_name"]) and d["output"] == "ON"):
+                continue
+            param = d["parameter_name"]
+            dup_params.add(param)
+            v = get_validated_value(param, d, DTYPES, outfile, enums)
+            writer.write(param, v)
 
-    # JSON形式で出力
-    outfile = outfile.parent.joinpath("catalog.json")
-    json_dump(jdata, outfile, indent=2)
+        writer.end()
+        writer.end()
+
+        # 重複するパラメータがあればエラーを出す（出力ファイルは作成しない）
+        raise_dup_params(dup_params.dup, category_name, outfile)
 
 
 def convert_catalog_example(wb, output_dir):
@@ -1019,6 +3467,824 @@ def convert_catalog_example(wb, output_dir):
     _convert_catalog_example_impl(rtn_v)
 
 
+# invoice.json・catalog.jsonを読み込むレコードのモジュールのファイル名
+INVOICE_RECORDS_FILE = "invoice_records.py"
+CATALOG_RECORDS_FILE = "catalog_records.py"
+
+# typeの値と、レコードの属性の型
+RECORD_TYPES = {"string": "str", "integer": "int", "number": "float", "boolean": "bool"}
+
+# レコードのモジュールの先頭部分（{name}はモジュール、{sheet}はシート、{instance}はインスタンスのファイル名）
+RECORDS_HEADER = '''\
+# -------------------------------------------------
+# {name}
+# excel2template.pyが{sheet}のシートから生成した、
+# {instance}のインスタンスを型付きのレコードとして読み込むモジュールです。編集しないでください。
+# -------------------------------------------------
+
+import json
+
+_EMPTY = {{}}
+
+
+class Record:
+    """レコードの共通部分（値がないプロパティはNoneとする）"""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        values = ", ".join(f"{{k}}={{getattr(self, k)!r}}" for k in self.__slots__)
+        return f"{{type(self).__name__}}({{values}})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, k) == getattr(other, k) for k in self.__slots__
+        )
+'''
+
+# インスタンスのファイルを読み込む関数（{func}は辞書から読み込む関数、{record}はレコードのクラス）
+RECORDS_FILE_LOADER = '''
+
+def {func}_file(path):
+    """{instance}のファイルを読み込み、{record}のレコードにする機能"""
+    with open(path, encoding="utf_8") as f:
+        return {func}(json.load(f))
+'''
+
+# invoice_records.pyの処理部分（用語の項目を、用語のIDで属性に割り当てる）
+INVOICE_RECORDS_RUNTIME = '''
+
+# 用語のIDから、属性に値を設定する関数への索引
+_GENERAL_SETTERS = {
+    term_id: getattr(GeneralAttributes, attr).__set__
+    for attr, term_id in GENERAL_TERMS.items()
+}
+_SPECIFIC_SETTERS = {
+    ids: getattr(SpecificAttributes, attr).__set__
+    for attr, ids in SPECIFIC_TERMS.items()
+}
+
+
+def _load_general(items):
+    """generalAttributesの項目を、termIdで属性に割り当てる機能（テンプレートにない項目はunmatchedとする）"""
+    record = GeneralAttributes()
+    unmatched = []
+    for item in items:
+        setter = _GENERAL_SETTERS.get(item.get("termId"))
+        if setter is None:
+            unmatched.append(item)
+        else:
+            setter(record, item.get("value"))
+    record.unmatched = unmatched
+    return record
+
+
+def _load_specific(items):
+    """specificAttributesの項目を、classIdとtermIdの組で属性に割り当てる機能（テンプレートにない項目はunmatchedとする）"""
+    record = SpecificAttributes()
+    unmatched = []
+    for item in items:
+        setter = _SPECIFIC_SETTERS.get((item.get("classId"), item.get("termId")))
+        if setter is None:
+            unmatched.append(item)
+        else:
+            setter(record, item.get("value"))
+    record.unmatched = unmatched
+    return record
+'''
+
+# invoice.jsonの固定の部分（JSONのキー、属性の型、説明）
+INVOICE_BASIC_FIELDS = (
+    ("dateSubmitted", "str", "登録日"),
+    ("dataOwnerId", "str", "データ所有者のID"),
+    ("dataName", "str", "データ名"),
+    ("instrumentId", "str", "装置のID"),
+    ("experimentId", "str", "実験ID"),
+    ("description", "str", "説明"),
+)
+INVOICE_SAMPLE_FIELDS = (
+    ("sampleId", "str", "試料のID"),
+    ("names", "list", "試料名（ローカルID）"),
+    ("ownerId", "str", "試料管理者のID"),
+    ("composition", "str", "化学式・組成式・分子式など"),
+    ("referenceUrl", "str", "参考URL"),
+    ("related_samples", "str", "関連試料"),
+    ("tags", "str", "タグ"),
+    ("description", "str", "試料の説明"),
+)
+
+# 用語の項目の属性のうち、テンプレートにない項目を格納する属性
+UNMATCHED_FIELD = ("unmatched", "list", "テンプレートにない用語の項目")
+
+# レコードの属性名に使えない名前（__init__の引数のself、Recordとそのクラスのメンバー）
+RECORD_RESERVED_NAMES = frozenset((
+    "self",
+    "__slots__",
+    "__init__",
+    "__repr__",
+    "__eq__",
+))
+
+
+def _record_attrs(names, reserved=()):
+    """名前（パラメータ名・key_name）を、重複しない属性名にする機能（英数字と_以外の文字は_にする）
+
+    予約語と、__init__の引数やRecordのメンバーと衝突する名前（selfなど）は末尾に_を付ける。
+    """
+    attrs = []
+    for name in names:
+        attr = re.sub(r"\W", "_", name).strip("_")
+        if not attr or attr[0].isdigit():
+            attr = "p_" + attr
+        # 予約語・レコードのメンバーと同じ名前は、末尾に_を付ける
+        if keyword.iskeyword(attr) or attr in RECORD_RESERVED_NAMES:
+            attr += "_"
+        if attr in attrs or attr in reserved:
+            raise ExcelError(
+                f"レコードの属性名が重複しています。属性名={attr}, 名前={name}"
+            )
+        attrs.append(attr)
+    return attrs
+
+
+def _record_type(name, dtype):
+    """typeの値を、レコードの属性の型にする機能"""
+    if dtype not in RECORD_TYPES:
+        raise ExcelError(
+            f"変換できないデータ型です。parameter_name={name}, type={dtype}"
+        )
+    return RECORD_TYPES[dtype]
+
+
+def _render_record_class(class_name, doc, fields):
+    """__slots__を持つレコードのクラスのソースを作成する機能（fieldsは属性名・型・説明の組の並び）"""
+    slots = "".join(f"        {attr!r},\n" for attr, _, _ in fields)
+    annotations = "".join(
+        f"    {attr}: {pytype}  # {comment}\n" for attr, pytype, comment in fields
+    )
+    args = "".join(f"        {attr}=None,\n" for attr, _, _ in fields)
+    body = "".join(f"        self.{attr} = {attr}\n" for attr, _, _ in fields)
+    return (
+        f"\n\nclass {class_name}(Record):\n"
+        f'    """{doc}"""\n\n'
+        f"    __slots__ = (\n{slots}    )\n\n"
+        + (f"{annotations}\n" if fields else "")
+        + f"    def __init__(\n        self,\n{args}    ):\n"
+        + (body or "        pass\n")
+    )
+
+
+def _render_record_loader(func, class_name, doc, values, source="jdata"):
+    """辞書からレコードを作成する関数のソースを作成する機能（valuesは属性の順の値の式、getはsourceの値を取得する）"""
+    args = "".join(f"        {value},\n" for value in values)
+    return (
+        f"\n\ndef {func}(jdata):\n"
+        f'    """{doc}"""\n'
+        f"    get = {source}.get\n"
+        f"    return {class_name}(\n{args}    )\n"
+    )
+
+
+def _render_constant(comment, name, value):
+    """辞書の定数のソースを、1項目1行で作成する機能"""
+    items = "".join(f"    {k!r}: {v!r},\n" for k, v in value.items())
+    return f"\n\n# {comment}\n{name} = {{\n{items}}}\n"
+
+
+def _render_records(text, name):
+    """生成したソースを確認して返す機能"""
+    # 生成したソースが構文として正しいことを確認する
+    compile(text, name, "exec")
+    return text
+
+
+def render_invoice_records(custom, general, specific):
+    """invoice.schema.jsonの定義から、invoice.jsonを読み込むレコードのモジュールのソースを作成する機能
+
+    customは、パラメータ名・type・項目名の組の並びとする。
+    general・specificは、key_name・用語のID・用語名の組の並びとする
+    （用語のIDは、generalはterm_id、specificはsample_class_idとterm_idの組）。
+    用語の項目は、key_nameの"sample.general."・"sample.specific."を除いた名前を属性名とする。
+    """
+    custom_attrs = _record_attrs([name for name, _, _ in custom])
+    general_attrs, specific_attrs = (
+        _record_attrs(
+            [key.removeprefix(prefix) for key, _, _ in terms],
+            reserved=(UNMATCHED_FIELD[0],),
+        )
+        for terms, prefix in (
+            (general, "sample.general."),
+            (specific, "sample.specific."),
+        )
+    )
+
+    sample_fields = list(INVOICE_SAMPLE_FIELDS) + [
+        ("general", "GeneralAttributes", "一般項目（generalAttributes）"),
+        ("specific", "SpecificAttributes", "分類別項目（specificAttributes）"),
+    ]
+    text = (
+        RECORDS_HEADER.format(
+            name=INVOICE_RECORDS_FILE,
+            sheet="要件定義(invoice.schema.json)",
+            instance="invoice.json",
+        )
+        + _render_constant(
+            "一般項目の属性名: term_id",
+            "GENERAL_TERMS",
+            {attr: ids for attr, (_, ids, _) in zip(general_attrs, general)},
+        )
+        + _render_constant(
+            "分類別項目の属性名: (sample_class_id, term_id)",
+            "SPECIFIC_TERMS",
+            {attr: ids for attr, (_, ids, _) in zip(specific_attrs, specific)},
+        )
+        + _render_record_class("Basic", "basic（基本情報）", INVOICE_BASIC_FIELDS)
+        + _render_record_class(
+            "Custom",
+            "custom（固有情報）",
+            [
+                (attr, _record_type(name, dtype), label)
+                for attr, (name, dtype, label) in zip(custom_attrs, custom)
+            ],
+        )
+        + _render_record_class(
+            "GeneralAttributes",
+            "sampleのgeneralAttributes（一般項目）",
+            [(attr, "str", term) for attr, (_, _, term) in zip(general_attrs, general)]
+            + [UNMATCHED_FIELD],
+        )
+        + _render_record_class(
+            "SpecificAttributes",
+            "sampleのspecificAttributes（分類別項目）",
+            [
+                (attr, "str", term)
+                for attr, (_, _, term) in zip(specific_attrs, specific)
+            ]
+            + [UNMATCHED_FIELD],
+        )
+        + _render_record_class("Sample", "sample（試料情報）", sample_fields)
+        + _render_record_class(
+            "Invoice",
+            "invoice.jsonのインスタンス",
+            [
+                ("datasetId", "str", "データセットのID"),
+                ("basic", "Basic", "基本情報"),
+                ("custom", "Custom", "固有情報"),
+                ("sample", "Sample", "試料情報"),
+            ],
+        )
+        + _render_record_loader(
+            "load_invoice",
+            "Invoice",
+            "invoice.jsonのインスタンス（辞書）を、1回の走査でInvoiceのレコードにする機能",
+            [
+                'get("datasetId")',
+                '_load_basic(get("basic") or _EMPTY)',
+                '_load_custom(get("custom") or _EMPTY)',
+                '_load_sample(get("sample") or _EMPTY)',
+            ],
+        )
+        + _render_record_loader(
+            "_load_basic",
+            "Basic",
+            "basicをBasicのレコードにする機能",
+            [f"get({key!r})" for key, _, _ in INVOICE_BASIC_FIELDS],
+        )
+        + _render_record_loader(
+            "_load_custom",
+            "Custom",
+            "customをCustomのレコードにする機能",
+            [f"get({name!r})" for name, _, _ in custom],
+        )
+        + _render_record_loader(
+            "_load_sample",
+            "Sample",
+            "sampleをSampleのレコードにする機能",
+            [f"get({key!r})" for key, _, _ in INVOICE_SAMPLE_FIELDS]
+            + [
+                '_load_general(get("generalAttributes") or ())',
+                '_load_specific(get("specificAttributes") or ())',
+            ],
+        )
+        + INVOICE_RECORDS_RUNTIME
+        + RECORDS_FILE_LOADER.format(
+            func="load_invoice", instance="invoice.json", record="Invoice"
+        )
+    )
+    return _render_records(text, INVOICE_RECORDS_FILE)
+
+
+def render_catalog_records(params):
+    """catalog.schema.jsonの定義から、catalog.jsonを読み込むレコードのモジュールのソースを作成する機能
+
+    paramsは、パラメータ名・type・項目名の組の並びとする。
+    """
+    attrs = _record_attrs([name for name, _, _ in params])
+    text = (
+        RECORDS_HEADER.format(
+            name=CATALOG_RECORDS_FILE,
+            sheet="要件定義(catalog.schema.json)",
+            instance="catalog.json",
+        )
+        + _render_record_class(
+            "Catalog",
+            "catalog.jsonのcatalog（データカタログ）",
+            [
+                (attr, _record_type(name, dtype), label)
+                for attr, (name, dtype, label) in zip(attrs, params)
+            ],
+        )
+        + _render_record_loader(
+            "load_catalog",
+            "Catalog",
+            "catalog.jsonのインスタンス（辞書）を、1回の走査でCatalogのレコードにする機能",
+            [f"get({name!r})" for name, _, _ in params],
+            source='(jdata.get("catalog") or _EMPTY)',
+        )
+        + RECORDS_FILE_LOADER.format(
+            func="load_catalog", instance="catalog.json", record="Catalog"
+        )
+    )
+    return _render_records(text, CATALOG_RECORDS_FILE)
+
+
+def convert_invoice_records(wb, output_dir, term_store=None):
+    """invoice.schema.jsonと同じ定義から、invoice.jsonを読み込むレコードのモジュールを出力する機能"""
+
+    rtn_v = _read_invoice_src_sheets(wb, output_dir, "invoice.schema.json", term_store)
+    # 対象シートがない場合は次の処理に移る
+    if not rtn_v:
+        return None
+    _, data, data_gt, data_st, outfile, _ = rtn_v
+
+    # invoice.schema.jsonに出力する行（output!=OFF）のみを対象とする
+    custom, general, specific = [], [], []
+    dup_params = DupTracker()
+    for d in data:
+        if d["output"] == "OFF":
+            continue
+        if d["category"] == "custom":
+            dup_params.add(d["parameter_name"])
+            custom.append((d["parameter_name"], d["type"], d["label/ja"]))
+        if d["category"] == "sample_general":
+            term = lookup_term(data_gt, data_gt.name_col, d["term"], outfile)
+            general.append((term["key_name"], term["term_id"], d["term"]))
+        if d["category"] == "sample_specific":
+            term = lookup_term(data_st, data_st.name_col, d["term"], outfile)
+            specific.append((
+                term["key_name"],
+                (term["sample_class_id"], term["term_id"]),
+                d["term"],
+            ))
+    raise_dup_params(dup_params.dup, "custom", outfile)
+
+    text = render_invoice_records(custom, general, specific)
+    with output_file(output_dir.joinpath(INVOICE_RECORDS_FILE)) as f:
+        f.write(text)
+
+
+def convert_catalog_records(wb, output_dir):
+    """catalog.schema.jsonと同じ定義から、catalog.jsonを読み込むレコードのモジュールを出力する機能"""
+
+    rtn_v = _read_catalog_src_sheet(wb, output_dir, "catalog.schema.json")
+    # 対象シートがない場合は次の処理に移る
+    if not rtn_v:
+        return None
+    _, data, outfile, _ = rtn_v
+
+    params = []
+    dup_params = DupTracker()
+    for d in data:
+        if d["output"] == "OFF":
+            continue
+        dup_params.add(d["parameter_name"])
+        params.append((d["parameter_name"], d["type"], d["label/ja"]))
+    raise_dup_params(dup_params.dup, "catalog", outfile)
+
+    text = render_catalog_records(params)
+    with output_file(output_dir.joinpath(CATALOG_RECORDS_FILE)) as f:
+        f.write(text)
+
+
+def select_outputs(only=None):
+    """出力するファイル名の一覧を、出力順で返す機能（onlyはカンマ区切りの文字列またはリスト）"""
+    if not only:
+        return list(OUTPUT_SHEETS)
+    if isinstance(only, str):
+        only = [name.strip() for name in only.split(",") if name.strip()]
+    all_outputs = {**OUTPUT_SHEETS, **OPTIONAL_OUTPUT_SHEETS}
+    unknown = [name for name in only if name not in all_outputs]
+    if unknown:
+        raise ExcelError(
+            f"出力ファイルは、{'/'.join(all_outputs)}のいずれかとしてください。"
+            f"{unknown=}"
+        )
+    return [name for name in all_outputs if name in only]
+
+
+def required_sheets(outputs, term_store=None):
+    """選択した出力ファイルが依存するシートの集合を返す機能（用語ストアを使う場合は用語シートを除く）"""
+    sheets = set()
+    for name in outputs:
+        sheets.update(OUTPUT_SHEETS.get(name) or OPTIONAL_OUTPUT_SHEETS[name])
+    if term_store is not None:
+        sheets -= {GENERAL_TERM_SHEET, SPECIFIC_TERM_SHEET}
+    return sheets
+
+
+def convert_output(name, wb, output_dir, term_store=None, factor_defs=False):
+    """出力ファイル名を指定して、1つのファイルを出力する機能"""
+    if name == "metadata-def.json":
+        convert_metadata_def(wb, output_dir)
+    elif name == "invoice.schema.json":
+        convert_invoice_schema(wb, output_dir, term_store, factor_defs)
+    elif name == "invoice.json":
+        convert_invoice_example(wb, output_dir, term_store)
+    elif name == "catalog.schema.json":
+        convert_catalog_schema(wb, output_dir, factor_defs)
+    elif name == "catalog.json":
+        convert_catalog_example(wb, output_dir)
+    elif name == MAPPER_FILE:
+        convert_metadata_mapper(wb, output_dir)
+    elif name == INVOICE_RECORDS_FILE:
+        convert_invoice_records(wb, output_dir, term_store)
+    elif name == CATALOG_RECORDS_FILE:
+        convert_catalog_records(wb, output_dir)
+
+
+def convert_workbook(wb, output_dir, only=None, term_store=None, factor_defs=False):
+    """選択したファイルのみを出力する機能（onlyを省略した場合は全てのファイルを出力する）
+
+    選択したファイルが依存しないシート（用語シートなど）は読み込まない。
+    """
+    if isinstance(output_dir, str):
+        output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name in select_outputs(only):
+        convert_output(name, wb, output_dir, term_store, factor_defs)
+
+
+class CheckReport:
+    """検査で見つかった問題を、ファイル・シート・行ごとに記録するクラス"""
+
+    def __init__(self, source):
+        self.source = str(source)
+        self.problems = []
+        self.rows = set()
+
+    def add(self, sheet, message, row=None, parameter=None):
+        self.rows.add((sheet, row))
+        self.problems.append({
+            "file": self.source,
+            "sheet": sheet,
+            "row": row,
+            "parameter": parameter,
+            "message": str(message),
+        })
+
+    @contextmanager
+    def collect(self, sheet, row=None, parameter=None):
+        """ブロック内で発生した変換時のエラーを、問題として記録する機能"""
+        try:
+            yield
+        except (ExcelError, ValueError, re.error) as e:
+            self.add(sheet, e, row, parameter)
+
+    def has_problem(self, sheet, row):
+        """行について既に問題が記録されているか確認する機能"""
+        return (sheet, row) in self.rows
+
+    def check_dup(self, sheet, seen, category_name, param, row):
+        """1行ずつ渡されるパラメータの重複を、問題として記録する機能"""
+        if param in seen:
+            self.add(
+                sheet,
+                f"{category_name=}について、重複する行が確認されました"
+                f"（{seen[param]}行目と重複）",
+                row,
+                param,
+            )
+        else:
+            seen[param] = row
+
+
+def check_metadata_def(wb, report):
+    """metadata-def.jsonのシートを、出力せずに検査する機能"""
+    sheet_name = "要件定義(metadata-def.json)"
+    if sheet_name not in wb.sheetnames:
+        return
+
+    seen = {}
+    for row, d in read_simple_sheet_numbered(wb[sheet_name], skipheader=2):
+        if d["output"] == "OFF":
+            continue
+        param = d["parameter_name"]
+        report.check_dup(sheet_name, seen, "parameter_name", param, row)
+        with report.collect(sheet_name, row, param):
+            _convert_metadata_def_entry(d, 0)
+
+
+def check_invoice(wb, report, term_store=None):
+    """invoice.schema.jsonのシートを、invoice.schema.jsonとinvoice.jsonの両方の観点で出力せずに検査する機能"""
+    sheet_name = "要件定義(invoice.schema.json)"
+    if sheet_name not in wb.sheetnames:
+        return
+    # 用語シートがない場合は、変換と同じく対象外とする
+    if term_store is None and not (
+        GENERAL_TERM_SHEET in wb.sheetnames and SPECIFIC_TERM_SHEET in wb.sheetnames
+    ):
+        return
+
+    schema_outfile = Path("invoice.schema.json")
+    outfile = Path("invoice.json")
+    enums = get_enum_table(wb)
+    # 用語テーブルは、sampleの行が現れた時点で初めて読み込む
+    term_tables = []
+
+    def get_tables():
+        if not term_tables:
+            term_tables.extend(get_term_tables(wb, term_store))
+            dup_keys = term_tables[0].dup_keys()
+            if dup_keys:
+                report.add(
+                    term_tables[0].sheet_name,
+                    f"{term_tables[0].sheet_name}に複数の {dup_keys}（key_name）が存在します",
+                )
+        return term_tables
+
+    # schema側はoutput!=OFFの行、example側はoutput==ONの行（sample_commonは全行）で重複を調べる
+    seen_schema = {}
+    seen_example = defaultdict(dict)
+    _, _, data = read_invoice_catalog_sheet_numbered(wb[sheet_name])
+    for row, d in data:
+        category = d["category"]
+        param = d["parameter_name"]
+
+        # invoice.schema.jsonの観点
+        with report.collect(sheet_name, row, param):
+            if d["output"] != "OFF":
+                if category == "custom":
+                    report.check_dup(sheet_name, seen_schema, "custom", param, row)
+                    _convert_property_schema(d, enums, examples_array=True)
+                if category == "sample_general":
+                    data_gt = get_tables()[0]
+                    lookup_term(data_gt, data_gt.name_col, d["term"], schema_outfile)
+                if category == "sample_specific":
+                    data_st = get_tables()[1]
+                    lookup_term(data_st, data_st.name_col, d["term"], schema_outfile)
+
+        # invoice.jsonの観点（invoice.schema.jsonの観点で問題がある行は除く）
+        if not check_value(param) or report.has_problem(sheet_name, row):
+            continue
+        with report.collect(sheet_name, row, param):
+            if category == "sample_common":
+                report.check_dup(
+                    sheet_name, seen_example[category], category, param, row
+                )
+                sample_common_prop(param)
+            elif d["output"] == "ON" and category == "custom":
+                report.check_dup(
+                    sheet_name, seen_example[category], category, param, row
+                )
+                get_validated_value(param, d, DTYPES, outfile, enums)
+            elif d["output"] == "ON" and category == "sample_general":
+                report.check_dup(
+                    sheet_name, seen_example[category], category, param, row
+                )
+                lookup_term(get_tables()[0], "key_name", param, outfile)
+            elif d["output"] == "ON" and category == "sample_specific":
+                report.check_dup(
+                    sheet_name, seen_example[category], category, param, row
+                )
+                lookup_term(get_tables()[1], "key_name", param, outfile)
+
+
+def check_catalog(wb, report):
+    """catalog.schema.jsonのシートを、catalog.schema.jsonとcatalog.jsonの両方の観点で出力せずに検査する機能"""
+    sheet_name = "要件定義(catalog.schema.json)"
+    if sheet_name not in wb.sheetnames:
+        return
+
+    outfile = Path("catalog.json")
+    enums = get_enum_table(wb)
+
+    seen_schema = {}
+    seen_example = {}
+    _, _, data = read_invoice_catalog_sheet_numbered(wb[sheet_name])
+    for row, d in data:
+        param = d["parameter_name"]
+        if d["output"] == "OFF":
+            continue
+
+        # catalog.schema.jsonの観点
+        with report.collect(sheet_name, row, param):
+            report.check_dup(sheet_name, seen_schema, "catalog", param, row)
+            _convert_property_schema(d, enums)
+
+        # catalog.jsonの観点（catalog.schema.jsonの観点で問題がある行は除く）
+        if not (check_value(param) and d["output"] == "ON"):
+            continue
+        if report.has_problem(sheet_name, row):
+            continue
+        with report.collect(sheet_name, row, param):
+            report.check_dup(sheet_name, seen_example, "parameter_name", param, row)
+            get_validated_value(param, d, DTYPES, outfile, enums)
+
+
+def check_workbook(path, term_store=None, only=None, load=None):
+    """ワークブックを出力せずに検査し、見つかった問題の一覧を返す機能（onlyで出力ファイルを選択できる）
+
+    loadを指定する場合は、loadでワークブックを開き、pathは表示する名前としてのみ用いる。
+    """
+    report = CheckReport(path)
+    sheets = required_sheets(select_outputs(only))
+    try:
+        wb = load() if load else open_workbook(Path(path))
+    except Exception as e:
+        report.add(None, f"ファイルを開けません。原因: {e}")
+        return report.problems
+
+    # 評価できない数式は、問題として記録する
+    formula_wb = getattr(wb, "wb", wb) if isinstance(wb, InheritedWorkbook) else wb
+    if isinstance(formula_wb, FormulaWorkbook):
+        formula_wb.evaluator.report = lambda sheet, row, col, formula, e: report.add(
+            sheet,
+            f"{get_column_letter(col)}列の数式{formula}を評価できません。原因: {e}",
+            row,
+        )
+
+    try:
+        if "要件定義(metadata-def.json)" in sheets:
+            check_metadata_def(wb, report)
+        if "要件定義(invoice.schema.json)" in sheets:
+            check_invoice(wb, report, term_store)
+        if "要件定義(catalog.schema.json)" in sheets:
+            check_catalog(wb, report)
+    finally:
+        wb.close()
+    return report.problems
+
+
+def print_problems(problems, output_format="text"):
+    """検査で見つかった問題を出力する機能（jsonの場合は1行に1件のJSONを出力する）"""
+    for p in problems:
+        if output_format == "json":
+            print(json.dumps(p, ensure_ascii=False))
+        else:
+            location = p["file"] + (f":{p['row']}" if p["row"] else "")
+            sheet = f" [{p['sheet']}]" if p["sheet"] else ""
+            param = f" {p['parameter']}:" if p["parameter"] else ""
+            print(f"{location}:{sheet}{param} {p['message']}")
+
+
+# 表示コストを報告する出力ファイル
+REPORT_OUTPUTS = ("invoice.schema.json", "catalog.schema.json")
+
+# 表示コストの予算の既定値（--budget 名前=値 で変更できる）
+# セクションごとのプロパティ数、enumの値の数（最大・合計）、入れ子の深さ、ファイルサイズ（バイト）
+REPORT_BUDGETS = {
+    "custom": 100,
+    "generalAttributes": 50,
+    "specificAttributes": 50,
+    "catalog": 100,
+    "enum": 200,
+    "enum_values": 2000,
+    "depth": 12,
+    "size": 256 * 1024,
+}
+
+
+def parse_budgets(values):
+    """--budgetの値（名前=値）で、表示コストの予算の既定値を置き換える機能"""
+    budgets = dict(REPORT_BUDGETS)
+    for value in values or []:
+        name, sep, limit = value.partition("=")
+        if not sep or name not in budgets:
+            raise ExcelError(
+                f"予算の指定が不正です。{value}（名前は{', '.join(budgets)}のいずれか）"
+            )
+        try:
+            budgets[name] = int(limit)
+        except ValueError:
+            raise ExcelError(f"予算には整数を指定してください。{value}") from None
+    return budgets
+
+
+def _measure_node(node, jdata, metrics, depth=1):
+    """入れ子の深さとenumの値の数を、$refを展開しながら集計する機能"""
+    if isinstance(node, dict):
+        node = resolve_defs_ref(node, jdata)
+        metrics["depth"] = max(metrics["depth"], depth)
+        for key, value in node.items():
+            if key == "$defs":
+                continue
+            if key == "enum" and isinstance(value, list):
+                metrics["enum"] = max(metrics["enum"], len(value))
+                metrics["enum_values"] += len(value)
+            _measure_node(value, jdata, metrics, depth + 1)
+    elif isinstance(node, list):
+        metrics["depth"] = max(metrics["depth"], depth)
+        for value in node:
+            _measure_node(value, jdata, metrics, depth + 1)
+
+
+def measure_schema(path):
+    """出力したスキーマファイルの表示コスト（プロパティ数・enum・深さ・サイズ）を測る機能"""
+    path = Path(path)
+    with open(path, encoding="utf_8") as f:
+        jdata = json.load(f)
+
+    metrics = {}
+    properties = jdata.get("properties", {})
+    if path.name == "invoice.schema.json":
+        metrics["custom"] = len(properties.get("custom", {}).get("properties", {}))
+        sample = properties.get("sample", {}).get("properties", {})
+        for section in ("generalAttributes", "specificAttributes"):
+            metrics[section] = len(sample.get(section, {}).get("items", []))
+    else:
+        metrics["catalog"] = len(properties.get("catalog", {}).get("properties", {}))
+    metrics.update(enum=0, enum_values=0, depth=0)
+    _measure_node(jdata, jdata, metrics)
+    metrics["size"] = path.stat().st_size
+    return metrics
+
+
+def report_workbook(name, load, budgets, term_store=None, only=None, factor_defs=False):
+    """ワークブックのスキーマを一時フォルダに出力し、表示コストを予算と比較する機能"""
+    outputs = [out for out in select_outputs(only) if out in REPORT_OUTPUTS]
+    records = []
+    try:
+        wb = load()
+    except Exception as e:
+        return [
+            {
+                "file": str(name),
+                "output": None,
+                "error": f"ファイルを開けません。原因: {e}",
+            }
+        ]
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            output_dir = Path(tmp)
+            for out in outputs:
+                record = {"file": str(name), "output": out}
+                try:
+                    convert_output(out, wb, output_dir, term_store, factor_defs)
+                    metrics = measure_schema(output_dir / out)
+                except Exception as e:
+                    record["error"] = f"{out}の生成に失敗しました。原因: {e}"
+                else:
+                    record["metrics"] = metrics
+                    record["over_budget"] = [
+                        key for key, value in metrics.items() if value > budgets[key]
+                    ]
+                records.append(record)
+    finally:
+        wb.close()
+    return records
+
+
+def report_failed(record):
+    """予算の超過、または生成の失敗があるか確認する機能"""
+    return bool(record.get("error") or record.get("over_budget"))
+
+
+def print_cost_report(records, budgets, output_format="text"):
+    """表示コストの報告を表（jsonの場合は1行に1件のJSON）で出力する機能
+
+    表では、予算を超えた値に「!」を付ける。
+    """
+    if output_format == "json":
+        for record in records:
+            print(json.dumps(record, ensure_ascii=False))
+        return
+
+    columns = ["file", "output", *budgets, "status"]
+    table = [columns, ["budget", "", *map(str, budgets.values()), ""]]
+    for record in records:
+        metrics = record.get("metrics", {})
+        over = record.get("over_budget", [])
+        cells = [
+            "-" if key not in metrics else f"{metrics[key]}{'!' if key in over else ''}"
+            for key in budgets
+        ]
+        if record.get("error"):
+            status = "ERROR: " + record["error"]
+        else:
+            status = "OVER" if over else "OK"
+        table.append([record["file"], record["output"] or "-", *cells, status])
+
+    # 最後の列（status）以外は幅を揃える
+    widths = [max(len(row[i]) for row in table) for i in range(len(columns) - 1)]
+    for row in table:
+        line = [
+            cell.ljust(w) if i < 2 else cell.rjust(w)
+            for i, (cell, w) in enumerate(zip(row, widths))
+        ]
+        print("  ".join(line + [row[-1]]))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="output some JSON files from the Excel file."
@@ -1027,7 +4293,106 @@ def main():
         "input",
         type=str,
         nargs="*",
-        help="Path to the Excel file that will be the input file.",
+        help=(
+            "Path to the Excel file that will be the input file, "
+            "to a folder of CSV/TSV files named after the sheets, "
+            "or to a zip archive of Excel files ('-' reads the archive from stdin)."
+        ),
+    )
+    parser.add_argument(
+        "--output-zip",
+        type=str,
+        help=(
+            "Write the generated files and the failure report into this zip archive "
+            "('-' for stdout). Defaults to <name>_templates.zip for zip input "
+            "and to stdout for stdin input."
+        ),
+    )
+    parser.add_argument(
+        "--term-db",
+        type=str,
+        help="Path to the term store (SQLite) used instead of the term sheets.",
+    )
+    parser.add_argument(
+        "--factor-defs",
+        action="store_true",
+        help="Emit identical property fragments once under $defs and refer to them with $ref.",
+    )
+    parser.add_argument(
+        "--only",
+        type=str,
+        help=(
+            "Comma-separated output files to generate or check "
+            "(e.g. metadata-def.json,catalog.schema.json); defaults to all."
+        ),
+    )
+    parser.add_argument(
+        "--mapper",
+        action="store_true",
+        help=(
+            f"Also generate {MAPPER_FILE}, a Python module that converts instrument "
+            "records to the metadata-def.json parameters (original_name index, "
+            "typed converters and array conversion of variable columns)."
+        ),
+    )
+    parser.add_argument(
+        "--records",
+        action="store_true",
+        help=(
+            f"Also generate {INVOICE_RECORDS_FILE} and {CATALOG_RECORDS_FILE}, Python modules "
+            "of __slots__ record classes (typed from the type column) with a single-pass "
+            "loader of invoice.json/catalog.json instances that maps sample terms to "
+            "attributes by their termId/classId."
+        ),
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help=(
+            "Only validate the input files without writing any output; "
+            "exit with status 1 if any problem is found."
+        ),
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help=(
+            "Report the render cost of the generated schemas (properties per section, "
+            "enum sizes, nesting depth, file size) without writing any output; "
+            "exit with status 1 if any template is over budget."
+        ),
+    )
+    parser.add_argument(
+        "--budget",
+        action="append",
+        metavar="NAME=VALUE",
+        help=(
+            "Override a --report budget "
+            f"({', '.join(f'{k}={v}' for k, v in REPORT_BUDGETS.items())}); repeatable."
+        ),
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "json"],
+        default="text",
+        help=(
+            "Output format of the problems found by --check and of the --report "
+            "results (text: table, json: one object per line)."
+        ),
+    )
+    parser.add_argument(
+        "--eval-formulas",
+        action="store_true",
+        help=(
+            "Evaluate formula cells that have no cached value (references, "
+            "concatenation, IF, VLOOKUP/INDEX/MATCH, arithmetic) and report "
+            "unsupported formulas."
+        ),
+    )
+    parser.add_argument(
+        "--build-term-db",
+        type=str,
+        help="Build the term store at this path from the term sheets of the input files.",
     )
     args = parser.parse_args()
 
@@ -1035,44 +4400,129 @@ def main():
     excelfiles = args.input
     # 入力ファイルが指定されていない場合は直下のExcelファイルを全て処理する
     if not excelfiles:
-        excelfiles = Path.cwd().glob("*.xlsx")
-
-    for ef in excelfiles:
-        ef_path = Path(ef)
-        print(ef_path.name + "の処理を開始します。")
-
-        # 出力フォルダを定義して作成する
-        output_dir = ef_path.parent.joinpath(ef_path.stem)
-        output_dir.mkdir(parents=True, exist_ok=True)
-
-        # Excelファイルを開く
-        wb = load_workbook(ef_path, read_only=True, data_only=True)
-
-        # metadeta-def.jsonの出力
-        convert_metadata_def(wb, output_dir)
-
-        # invoice.schema.jsonの出力
-        convert_invoice_schema(wb, output_dir)
-
-        # invoice.jsonの出力
-        try:
-            convert_invoice_example(wb, output_dir)
-        except Exception as e:
-            print(f" - invoice.jsonの生成に失敗しました。原因: {e}")
-
-        # catalog.schema.jsonの出力
-        convert_catalog_schema(wb, output_dir)
-
-        # catalog.jsonの出力
-        try:
-            convert_catalog_example(wb, output_dir)
-        except Exception as e:
-            print(f" - catalog.jsonの生成に失敗しました。原因: {e}")
+        excelfiles = sorted(Path.cwd().glob("*.xlsx"))
+
+    # 用語ストアを作成する場合は、入力ファイルをマスターの用語シートとして扱う
+    if args.build_term_db:
+        build_term_store(list(excelfiles), args.build_term_db)
+        return
+
+    # 出力するファイル
+    try:
+        outputs = select_outputs(args.only)
+        if args.mapper and MAPPER_FILE not in outputs:
+            outputs.append(MAPPER_FILE)
+        if args.records:
+            outputs.extend(
+                name
+                for name in (INVOICE_RECORDS_FILE, CATALOG_RECORDS_FILE)
+                if name not in outputs
+            )
+        budgets = parse_budgets(args.budget)
+    except ExcelError as e:
+        parser.error(str(e))
+
+    # 用語ストアを開く
+    term_store = TermStore(args.term_db) if args.term_db else None
+
+    # 継承元のワークブック（一括処理の中で一度だけ読み込む）
+    bases = BaseWorkbooks(args.eval_formulas)
+
+    # 検査のみを行う場合は、何も出力せずに問題の有無を終了コードで返す
+    if args.check:
+        n_problems = 0
+        for name, _, _, load in iter_sources(excelfiles, bases, args.eval_formulas):
+            problems = check_workbook(name, term_store, outputs, load)
+            print_problems(problems, args.format)
+            n_problems += len(problems)
+        bases.close()
+        if term_store is not None:
+            term_store.close()
+        sys.exit(1 if n_problems else 0)
+
+    # 表示コストの報告のみを行う場合は、何も出力せずに予算の超過の有無を終了コードで返す
+    if args.report:
+        # 変換時のメッセージは標準エラー出力に出し、標準出力には報告のみを出す
+        records = []
+        with redirect_stdout(sys.stderr):
+            for name, _, _, load in iter_sources(excelfiles, bases, args.eval_formulas):
+                records.extend(
+                    report_workbook(
+                        name, load, budgets, term_store, outputs, args.factor_defs
+                    )
+                )
+        print_cost_report(records, budgets, args.format)
+        bases.close()
+        if term_store is not None:
+            term_store.close()
+        sys.exit(1 if any(map(report_failed, records)) else 0)
+
+    # zipファイル（"-"の場合は標準出力）に出力する
+    output_zip = args.output_zip
+    archives = [src for src in excelfiles if is_archive(src)]
+    if not output_zip and archives:
+        if str(archives[0]) == "-":
+            output_zip = "-"
+        else:
+            output_zip = Path(archives[0]).with_name(
+                Path(archives[0]).stem + "_templates.zip"
+            )
+    archive = ArchiveOutput(output_zip) if output_zip else None
 
-        # Excelファイルを閉じる
-        wb.close()
-        print(Path(ef).name + "の処理を終了します。")
-    input("Enterを押してください。")
+    # 標準出力にzipファイルを書き込む場合は、メッセージを標準エラー出力に出す
+    with (
+        redirect_stdout(sys.stderr) if archive and archive.to_stdout else nullcontext()
+    ):
+        for name, member, ef_dir, load in iter_sources(
+            excelfiles, bases, args.eval_formulas
+        ):
+            print(name + "の処理を開始します。")
+
+            if archive:
+                # zipファイル内の出力先（ファイルを開けない場合は記録して次に移る）
+                archive.start(name)
+                output_dir = archive.path(member)
+                try:
+                    wb = load()
+                except Exception as e:
+                    print(f" - {name}を開けません。原因: {e}")
+                    archive.add_error(None, e)
+                    continue
+            else:
+                # 出力フォルダを定義して作成する（CSV/TSVファイルのフォルダの場合は、そのフォルダに出力する）
+                output_dir = ef_dir
+                output_dir.mkdir(parents=True, exist_ok=True)
+
+                # Excelファイル（またはCSV/TSVファイルのフォルダ）を開く
+                wb = load()
+
+            # 選択したファイルを出力する
+            # （invoice.json・catalog.json、およびzipファイルへの出力では、失敗しても処理を続ける）
+            for out in outputs:
+                if archive or out in ("invoice.json", "catalog.json"):
+                    try:
+                        convert_output(
+                            out, wb, output_dir, term_store, args.factor_defs
+                        )
+                    except Exception as e:
+                        print(f" - {out}の生成に失敗しました。原因: {e}")
+                        if archive:
+                            archive.add_error(out, e)
+                else:
+                    convert_output(out, wb, output_dir, term_store, args.factor_defs)
+
+            # Excelファイルを閉じる
+            wb.close()
+            print(name + "の処理を終了します。")
+
+    if archive:
+        archive.close()
+    bases.close()
+    if term_store is not None:
+        term_store.close()
+    # zipファイルへの出力（一括処理）では入力を待たない
+    if not archive:
+        input("Enterを押してください。")
 
 
 if __name__ == "__main__":
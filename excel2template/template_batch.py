@@ -0,0 +1,544 @@
+# -------------------------------------------------
+# template_batch.py
+# This program is for regenerating many dataset templates in RDE on several hosts sharing a folder.
+#
+# Copyright (c) 2025, MDPF(Materials Data Platform), NIMS
+#
+# This software is released under the MIT License.
+# -------------------------------------------------
+
+from pathlib import Path
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+
+import excel2template as e2t
+
+# キューのフォルダ内の構成
+# jobs/<ID>.json    変換するワークブック（投入時に作成し、削除しない）
+# claims/<ID>.json  処理中のワーカーの取得ファイル（O_EXCLで作成し、更新日時をリースとする）
+# done/<ID>.json    処理結果（os.linkで作成し、最初に完了したワーカーの結果のみを採用する）
+# results/<ワーカー>/  ワーカーごとの出力と manifest.jsonl
+CONFIG_FILE = "config.json"
+JOBS_DIR = "jobs"
+CLAIMS_DIR = "claims"
+DONE_DIR = "done"
+RESULTS_DIR = "results"
+MANIFEST_FILE = "manifest.jsonl"
+
+# リースの既定の秒数（この間に更新されない取得ファイルは、ワーカーが停止したとみなす）
+DEFAULT_LEASE = 300
+
+
+def write_json_atomic(path, jdata):
+    """一時ファイルに書き込んでから置き換えることで、JSONファイルを不可分に書き込む機能"""
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp, "w", encoding="utf_8") as f:
+        json.dump(jdata, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    """JSONファイルを読み込む機能（存在しない、または書き込み途中の場合はNoneを返す）"""
+    try:
+        with open(path, encoding="utf_8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def job_id(name):
+    """出力先の名前から、ジョブのIDを求める機能"""
+    return hashlib.sha1(name.encode("utf_8")).hexdigest()[:16]
+
+
+def find_workbooks(paths):
+    """指定するパスから、変換するワークブックと出力先の名前の組を探す機能
+
+    フォルダの場合は、CSV/TSVファイルのフォルダでなければExcelファイルを再帰的に探し、
+    フォルダからの相対パス（拡張子を除く）を出力先の名前とする。
+    """
+    for path in map(Path, paths):
+        if path.is_file():
+            yield path, path.stem
+        elif any(f.name.startswith("要件定義(") for f in path.glob("*.[ct]sv")):
+            yield path, path.name
+        else:
+            for f in sorted(path.rglob("*.xlsx")):
+                if not f.name.startswith("~$"):
+                    yield f, f.relative_to(path).with_suffix("").as_posix()
+
+
+def file_digest(path):
+    """ファイルのSHA-256を求める機能"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class WorkQueue:
+    """共有フォルダ上のファイルのみで構成するジョブのキュー
+
+    ジョブの取得は取得ファイルの排他的な作成（O_EXCL）、完了は完了ファイルへのハードリンクの作成、
+    期限切れの取得ファイルの回収はリネームで行う（いずれも1つのワーカーのみが成功する）。
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.jobs_dir = self.root / JOBS_DIR
+        self.claims_dir = self.root / CLAIMS_DIR
+        self.done_dir = self.root / DONE_DIR
+        self.results_dir = self.root / RESULTS_DIR
+
+    def init(self, config):
+        """キューのフォルダを作成し、変換の設定を保存する機能（既存の設定と異なる場合はエラー）"""
+        for d in (self.jobs_dir, self.claims_dir, self.done_dir, self.results_dir):
+            d.mkdir(parents=True, exist_ok=True)
+        current = self.config()
+        if current is not None and current != config:
+            raise e2t.ExcelError(
+                f"キューの変換の設定が異なります。設定={current}, 指定={config}"
+            )
+        if current is None:
+            write_json_atomic(self.root / CONFIG_FILE, config)
+
+    def config(self):
+        return read_json(self.root / CONFIG_FILE)
+
+    def enqueue(self, paths):
+        """ワークブックをジョブとして投入する機能（投入済みのジョブは除く）"""
+        counts = {"added": 0, "skipped": 0}
+        for path, name in find_workbooks(paths):
+            jid = job_id(name)
+            job = {"id": jid, "name": name, "source": str(path.resolve())}
+            existing = read_json(self.jobs_dir / f"{jid}.json")
+            if existing is not None:
+                if existing["source"] != job["source"]:
+                    raise e2t.ExcelError(
+                        f"出力先の名前が重複しています。name={name}, "
+                        f"source={existing['source']}, {job['source']}"
+                    )
+                counts["skipped"] += 1
+                continue
+            write_json_atomic(self.jobs_dir / f"{jid}.json", job)
+            counts["added"] += 1
+        return counts
+
+    def job_ids(self):
+        return sorted(p.stem for p in self.jobs_dir.glob("*.json"))
+
+    def is_done(self, jid):
+        return self.done_dir.joinpath(f"{jid}.json").exists()
+
+    def claim(self, jid, worker):
+        """取得ファイルを排他的に作成してジョブを取得する機能（取得できた場合は取得ファイルの内容を返す）"""
+        token = {"worker": worker, "token": uuid.uuid4().hex, "claimed": time.time()}
+        path = self.claims_dir / f"{jid}.json"
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w", encoding="utf_8") as f:
+            json.dump(token, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # 取得ファイルの作成と完了の間に、他のワーカーが完了していた場合は取得しない
+        if self.is_done(jid):
+            self.release(jid, token)
+            return None
+        return token
+
+    def holds(self, jid, token):
+        """取得ファイルが自身のものか確認する機能"""
+        return read_json(self.claims_dir / f"{jid}.json") == token
+
+    def renew(self, jid, token):
+        """取得ファイルの更新日時を更新してリースを延長する機能"""
+        if not self.holds(jid, token):
+            return False
+        try:
+            os.utime(self.claims_dir / f"{jid}.json")
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, jid, token):
+        """自身の取得ファイルを削除する機能"""
+        if self.holds(jid, token):
+            try:
+                self.claims_dir.joinpath(f"{jid}.json").unlink()
+            except FileNotFoundError:
+                pass
+
+    def requeue_expired(self, lease):
+        """リースが切れた取得ファイル（停止したワーカーのもの）を回収し、ジョブを再び取得できるようにする機能"""
+        requeued = []
+        now = time.time()
+        for path in sorted(self.claims_dir.glob("*.json")):
+            try:
+                expired = now - path.stat().st_mtime > lease
+            except FileNotFoundError:
+                continue
+            if not expired:
+                continue
+            # リネームは1つのワーカーのみが成功する
+            stale = path.with_name(f".{path.name}.{uuid.uuid4().hex}.expired")
+            try:
+                os.rename(path, stale)
+            except FileNotFoundError:
+                continue
+            stale.unlink()
+            if not self.is_done(path.stem):
+                requeued.append(path.stem)
+        return requeued
+
+    def next_job(self, worker):
+        """未完了で、取得されていないジョブを1つ取得する機能"""
+        for jid in self.job_ids():
+            if self.is_done(jid) or self.claims_dir.joinpath(f"{jid}.json").exists():
+                continue
+            token = self.claim(jid, worker)
+            if token is not None:
+                return read_json(self.jobs_dir / f"{jid}.json"), token
+        return None, None
+
+    def complete(self, entry):
+        """処理結果を完了ファイルとして作成する機能（他のワーカーが先に完了していた場合はFalseを返す）"""
+        path = self.done_dir / f"{entry['id']}.json"
+        tmp = path.with_name(f".{path.name}.{entry['token']}.tmp")
+        write_json_atomic(tmp, entry)
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            return False
+        finally:
+            tmp.unlink()
+        return True
+
+    def status(self):
+        """ジョブの件数を状態ごとに数える機能"""
+        counts = {"jobs": 0, "ok": 0, "failed": 0, "running": 0, "pending": 0}
+        for jid in self.job_ids():
+            counts["jobs"] += 1
+            entry = read_json(self.done_dir / f"{jid}.json")
+            if entry is not None:
+                counts["ok" if entry["status"] == "ok" else "failed"] += 1
+            elif self.claims_dir.joinpath(f"{jid}.json").exists():
+                counts["running"] += 1
+            else:
+                counts["pending"] += 1
+        return counts
+
+
+class LeaseKeeper:
+    """処理中にリースを定期的に延長するスレッド"""
+
+    def __init__(self, queue, jid, token, lease):
+        self.queue = queue
+        self.jid = jid
+        self.token = token
+        self.interval = max(lease / 3, 0.1)
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            if not self.queue.renew(self.jid, self.token):
+                self.lost = True
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Worker:
+    """キューからジョブを取得して変換し、自身の結果フォルダ（シャード）に出力するワーカー"""
+
+    def __init__(self, queue, worker_id, lease=DEFAULT_LEASE):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.lease = lease
+        self.shard_dir = queue.results_dir / worker_id
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        config = queue.config()
+        self.outputs = e2t.select_outputs(config["only"])
+        self.factor_defs = config["factor_defs"]
+        self.term_store = (
+            e2t.TermStore(config["term_db"]) if config["term_db"] else None
+        )
+        self.bases = e2t.BaseWorkbooks()
+
+    def close(self):
+        self.bases.close()
+        if self.term_store is not None:
+            self.term_store.close()
+
+    def convert(self, job, output_dir):
+        """1つのワークブックを変換し、出力ファイルごとの失敗の一覧を返す機能"""
+        errors = {}
+        _, _, _, load = next(e2t.iter_sources([job["source"]], self.bases))
+        try:
+            wb = load()
+        except Exception as e:
+            return {None: f"ファイルを開けません。原因: {e}"}
+        try:
+            for out in self.outputs:
+                try:
+                    e2t.convert_output(
+                        out, wb, output_dir, self.term_store, self.factor_defs
+                    )
+                except Exception as e:
+                    print(f" - {out}の生成に失敗しました。原因: {e}")
+                    errors[out] = str(e)
+        finally:
+            wb.close()
+        return errors
+
+    def process(self, job, token):
+        """ジョブを処理し、結果をシャードに格納して完了させる機能"""
+        jid = job["id"]
+        print(f"[{self.worker_id}] {job['name']}の処理を開始します。")
+        started = time.time()
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{jid}.", dir=self.shard_dir))
+        try:
+            with LeaseKeeper(self.queue, jid, token, self.lease) as keeper:
+                errors = self.convert(job, tmp_dir)
+            if keeper.lost or not self.queue.holds(jid, token):
+                print(
+                    f"[{self.worker_id}] {job['name']}のリースが切れたため、結果を破棄します。"
+                )
+                return
+
+            # 出力フォルダをシャード内の位置に移してから完了させる
+            result_dir = self.shard_dir / jid
+            if result_dir.exists():
+                shutil.rmtree(result_dir)
+            os.rename(tmp_dir, result_dir)
+            entry = {
+                "id": jid,
+                "name": job["name"],
+                "source": job["source"],
+                "status": "failed" if errors else "ok",
+                "errors": {str(k): v for k, v in errors.items()},
+                "outputs": {
+                    f.name: {"size": f.stat().st_size, "sha256": file_digest(f)}
+                    for f in sorted(result_dir.iterdir())
+                },
+                "worker": self.worker_id,
+                "shard": f"{RESULTS_DIR}/{self.worker_id}/{jid}",
+                "token": token["token"],
+                "elapsed": round(time.time() - started, 3),
+            }
+            if not self.queue.complete(entry):
+                print(
+                    f"[{self.worker_id}] {job['name']}は他のワーカーが完了しています。"
+                )
+                shutil.rmtree(result_dir)
+                return
+            with open(self.shard_dir / MANIFEST_FILE, "a", encoding="utf_8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            print(f"[{self.worker_id}] {job['name']}の処理を終了します。")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            self.queue.release(jid, token)
+
+    def run(self, max_jobs=None, wait=True, poll=None):
+        """ジョブがなくなるまで処理する機能（waitの場合は、他のワーカーの処理中のジョブが完了するまで待つ）"""
+        poll = poll if poll is not None else min(self.lease / 4, 10)
+        n_jobs = 0
+        while max_jobs is None or n_jobs < max_jobs:
+            for jid in self.queue.requeue_expired(self.lease):
+                print(
+                    f"[{self.worker_id}] リースが切れたジョブを再投入しました。id={jid}"
+                )
+            job, token = self.queue.next_job(self.worker_id)
+            if job is not None:
+                self.process(job, token)
+                n_jobs += 1
+                continue
+            if not wait or all(map(self.queue.is_done, self.queue.job_ids())):
+                break
+            time.sleep(poll)
+        return n_jobs
+
+
+def read_manifests(queue):
+    """シャードごとのmanifest.jsonlを読み込み、完了ファイルと一致する結果のみを返す機能
+
+    完了ファイルはあるがmanifest.jsonlに記録される前に停止したワーカーの結果は、完了ファイルから補う。
+    """
+    accepted = {}
+    for manifest in sorted(queue.results_dir.glob(f"*/{MANIFEST_FILE}")):
+        with open(manifest, encoding="utf_8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で停止した行
+                    continue
+                done = read_json(queue.done_dir / f"{entry['id']}.json")
+                if done is not None and done["token"] == entry["token"]:
+                    accepted[entry["id"]] = entry
+    for jid in queue.job_ids():
+        if jid not in accepted:
+            done = read_json(queue.done_dir / f"{jid}.json")
+            if done is not None:
+                accepted[jid] = done
+    return accepted
+
+
+def merge(queue, output, partial=False):
+    """シャードの結果を出力フォルダに集め、全体のmanifest.jsonを出力する機能
+
+    未完了のジョブがある場合は、partialを指定しない限りエラーとする。
+    """
+    entries = read_manifests(queue)
+    pending = [
+        read_json(queue.jobs_dir / f"{jid}.json")["name"]
+        for jid in queue.job_ids()
+        if jid not in entries
+    ]
+    if pending and not partial:
+        raise e2t.ExcelError(
+            f"未完了のジョブが{len(pending)}件あります。例: {', '.join(pending[:5])}"
+        )
+
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    results = []
+    for entry in sorted(entries.values(), key=lambda e: e["name"]):
+        src = queue.root / entry["shard"]
+        dst = output / entry["name"]
+        dst.mkdir(parents=True, exist_ok=True)
+        for name, digest in entry["outputs"].items():
+            if file_digest(src / name) != digest["sha256"]:
+                raise e2t.ExcelError(
+                    f"シャードのファイルがmanifestと一致しません。{src / name}"
+                )
+            shutil.copyfile(src / name, dst / name)
+        results.append({k: v for k, v in entry.items() if k != "token"})
+
+    summary = {
+        "jobs": len(entries) + len(pending),
+        "ok": sum(e["status"] == "ok" for e in results),
+        "failed": sum(e["status"] != "ok" for e in results),
+        "pending": sorted(pending),
+        "results": results,
+    }
+    write_json_atomic(output / "manifest.json", summary)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=(
+            "regenerate many dataset templates on several hosts through a work queue "
+            "in a shared folder."
+        )
+    )
+    parser.add_argument("queue", type=str, help="Path to the shared queue folder.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_enqueue = sub.add_parser(
+        "enqueue", help="Add Excel files or folders (searched recursively) as jobs."
+    )
+    p_enqueue.add_argument("paths", type=str, nargs="+")
+    p_enqueue.add_argument(
+        "--only", type=str, help="Comma-separated output files to generate."
+    )
+    p_enqueue.add_argument(
+        "--term-db", type=str, help="Term store used instead of the term sheets."
+    )
+    p_enqueue.add_argument(
+        "--factor-defs", action="store_true", help="Same as excel2template.py."
+    )
+
+    p_work = sub.add_parser("work", help="Claim and convert jobs until none is left.")
+    p_work.add_argument(
+        "--worker-id",
+        type=str,
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="Name of this worker and of its shard folder (default: host-pid).",
+    )
+    p_work.add_argument(
+        "--lease",
+        type=float,
+        default=DEFAULT_LEASE,
+        help="Seconds after which a claim that is not renewed is re-queued.",
+    )
+    p_work.add_argument("--max-jobs", type=int, help="Stop after this many jobs.")
+    p_work.add_argument(
+        "--no-wait",
+        action="store_true",
+        help="Exit when no job can be claimed instead of waiting for running jobs.",
+    )
+
+    sub.add_parser("status", help="Show the number of jobs in each state.")
+
+    p_merge = sub.add_parser(
+        "merge", help="Merge the shard results into one output folder."
+    )
+    p_merge.add_argument("output", type=str)
+    p_merge.add_argument(
+        "--partial", action="store_true", help="Merge even if some jobs are not done."
+    )
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    try:
+        if args.command == "enqueue":
+            # 変換の設定はキューに保存し、全てのワーカーで同じ設定を用いる
+            e2t.select_outputs(args.only)
+            queue.init({
+                "only": args.only,
+                "term_db": str(Path(args.term_db).resolve()) if args.term_db else None,
+                "factor_defs": args.factor_defs,
+            })
+            counts = queue.enqueue(args.paths)
+            print(", ".join(f"{k}={v}" for k, v in counts.items()))
+        elif args.command == "work":
+            if queue.config() is None:
+                raise e2t.ExcelError(f"キューが見つかりません。{queue.root}")
+            worker = Worker(queue, args.worker_id, args.lease)
+            try:
+                n_jobs = worker.run(args.max_jobs, not args.no_wait)
+            finally:
+                worker.close()
+            print(f"[{args.worker_id}] {n_jobs}件を処理しました。")
+        elif args.command == "status":
+            print(", ".join(f"{k}={v}" for k, v in queue.status().items()))
+        else:
+            summary = merge(queue, args.output, args.partial)
+            print(
+                f"ok={summary['ok']}, failed={summary['failed']}, "
+                f"pending={len(summary['pending'])}"
+            )
+            if summary["failed"] or summary["pending"]:
+                sys.exit(1)
+    except e2t.ExcelError as e:
+        print(f" - {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,828 @@
+# -------------------------------------------------
+# template_diagnostics.py
+# This program is for checking hand-edited schema files of dataset templates in RDE while they are edited.
+#
+# Copyright (c) 2025, MDPF(Materials Data Platform), NIMS
+#
+# This software is released under the MIT License.
+# -------------------------------------------------
+
+from pathlib import Path
+from collections import Counter, namedtuple
+from contextlib import redirect_stdout
+from datetime import date
+from json.decoder import JSONDecodeError, scanstring
+import re
+import sys
+import json
+import time
+import bisect
+import argparse
+
+import excel2template as e2t
+
+# 検査の単位を取り出すスキーマの構造
+# 値が文字列の場合、検査の単位の区分（オブジェクトの値・配列の要素を1つずつ検査する）、
+# または"."を含む場合は、値をそのまま取り出す名前とする
+SCHEMA_LAYOUT = {
+    "properties": {
+        "custom": {"properties": "custom", "required": "custom.required"},
+        "catalog": {"properties": "catalog", "required": "catalog.required"},
+        "sample": {
+            "properties": {
+                "generalAttributes": {"items": "generalAttributes"},
+                "specificAttributes": {"items": "specificAttributes"},
+            }
+        },
+    },
+    "$defs": "$defs",
+}
+
+# プロパティとして検査する区分と、examplesを配列に限るかどうか（catalogは値・配列のいずれも可）
+PROPERTY_SECTIONS = {"custom": True, "catalog": False}
+
+# 診断の重大度（LSPのDiagnosticSeverityと同じ値）
+ERROR = 1
+WARNING = 2
+
+# JSON-RPCのエラーコード
+PARSE_ERROR = -32700
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+_WS = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+# 検査の単位（プロパティ、用語の項目、$defsの断片）と、その名前（または要素の番号）・位置
+Unit = namedtuple("Unit", "section name key_pos key_end start end value")
+
+
+def _decode(text, idx):
+    """idxの位置の値をjsonモジュールでまとめて読み込む機能（値と終わりの位置を返す）"""
+    try:
+        return _decoder.raw_decode(text, idx)
+    except StopIteration:
+        raise JSONDecodeError("Expecting value", text, idx) from None
+
+
+def scan_members(text, idx, member):
+    """オブジェクトのキーを1つずつ走査する機能（値はmember(key, key_pos, key_end, idx)で読み込み、終わりの位置を返す）"""
+    if text[idx : idx + 1] != "{":
+        raise JSONDecodeError("Expecting '{'", text, idx)
+    idx = _WS.match(text, idx + 1).end()
+    if text[idx : idx + 1] == "}":
+        return idx + 1
+    while True:
+        if text[idx : idx + 1] != '"':
+            raise JSONDecodeError(
+                "Expecting property name enclosed in double quotes", text, idx
+            )
+        key_pos = idx
+        key, key_end = scanstring(text, idx + 1)
+        idx = _WS.match(text, key_end).end()
+        if text[idx : idx + 1] != ":":
+            raise JSONDecodeError("Expecting ':' delimiter", text, idx)
+        idx = _WS.match(text, idx + 1).end()
+        idx = _WS.match(text, member(key, key_pos, key_end, idx)).end()
+        c = text[idx : idx + 1]
+        if c == "}":
+            return idx + 1
+        if c != ",":
+            raise JSONDecodeError("Expecting ',' delimiter", text, idx)
+        idx = _WS.match(text, idx + 1).end()
+
+
+def scan_elements(text, idx, element):
+    """配列の要素を1つずつ走査する機能（値はelement(no, idx)で読み込み、終わりの位置を返す）"""
+    idx = _WS.match(text, idx + 1).end()
+    if text[idx : idx + 1] == "]":
+        return idx + 1
+    no = 0
+    while True:
+        idx = _WS.match(text, element(no, idx)).end()
+        c = text[idx : idx + 1]
+        if c == "]":
+            return idx + 1
+        if c != ",":
+            raise JSONDecodeError("Expecting ',' delimiter", text, idx)
+        idx = _WS.match(text, idx + 1).end()
+        no += 1
+
+
+def member_positions(text):
+    """オブジェクトの各キーの位置（先頭と終わり）を返す機能（最初に現れたキーの位置とする）"""
+    positions = {}
+
+    def member(key, key_pos, key_end, idx):
+        positions.setdefault(key, (key_pos, key_end))
+        return _decode(text, idx)[1]
+
+    try:
+        scan_members(text, _WS.match(text).end(), member)
+    except JSONDecodeError:
+        pass
+    return positions
+
+
+class SchemaScan:
+    """スキーマの文字列を走査し、検査の単位と位置を取り出すクラス
+
+    SCHEMA_LAYOUTの経路のみ1キーずつ走査し、それ以外の値と検査の単位の中身は
+    jsonモジュールでまとめて読み込む（構文の誤りはJSONDecodeErrorとする）。
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.units = []
+        self.values = {}
+        # 同じオブジェクト内で重複するキー（キーの先頭と終わり、キー）
+        self.duplicates = []
+        # BOMは読み飛ばす（位置は元の文字列のままとする）
+        idx = _WS.match(text, 1 if text.startswith("\ufeff") else 0).end()
+        idx = _WS.match(text, self._object(idx, SCHEMA_LAYOUT)).end()
+        if idx != len(text):
+            raise JSONDecodeError("Extra data", text, idx)
+
+    def _object(self, idx, layout):
+        """SCHEMA_LAYOUTの経路にあるオブジェクトを1キーずつ走査する機能"""
+        if self.text[idx : idx + 1] != "{":
+            # 想定と異なる形の値は、そのまま読み込む（スキーマの構造は検査しない）
+            return _decode(self.text, idx)[1]
+        seen = set()
+
+        def member(key, key_pos, key_end, idx):
+            if key in seen:
+                self.duplicates.append((key_pos, key_end, key))
+            seen.add(key)
+            sub = layout.get(key)
+            if isinstance(sub, dict):
+                return self._object(idx, sub)
+            if sub is None:
+                return _decode(self.text, idx)[1]
+            if "." in sub:
+                value, end = _decode(self.text, idx)
+                self.values[sub] = (key_pos, key_end, value)
+                return end
+            return self._container(idx, sub)
+
+        return scan_members(self.text, idx, member)
+
+    def _container(self, idx, section):
+        """オブジェクトの値、または配列の要素を、検査の単位として1つずつ読み込む機能"""
+        text = self.text
+        c = text[idx : idx + 1]
+        if c not in ("{", "["):
+            return _decode(text, idx)[1]
+        seen = set()
+
+        def member(key, key_pos, key_end, idx):
+            if key in seen:
+                self.duplicates.append((key_pos, key_end, key))
+            seen.add(key)
+            value, end = _decode(text, idx)
+            self.units.append(Unit(section, key, key_pos, key_end, idx, end, value))
+            return end
+
+        def element(no, idx):
+            value, end = _decode(text, idx)
+            self.units.append(Unit(section, no, idx, idx + 1, idx, end, value))
+            return end
+
+        if c == "{":
+            return scan_members(text, idx, member)
+        return scan_elements(text, idx, element)
+
+
+def _json_text(v):
+    return json.dumps(v, ensure_ascii=False)
+
+
+def _duplicate_keys(text):
+    """単位の中で重複するキーを返す機能"""
+    dup = []
+
+    def hook(pairs):
+        counts = Counter(k for k, _ in pairs)
+        dup.extend(k for k, c in counts.items() if c > 1)
+        return dict(pairs)
+
+    json.loads(text, object_pairs_hook=hook)
+    return dup
+
+
+def check_property(prop, defs, examples_array):
+    """custom/catalogの1つ分のプロパティを、excel2template.pyの変換と同じ規則で検査する機能
+
+    型・固定値・値のリスト・範囲・正規表現の規則はexcel2template.pyの関数を用い、
+    ここではJSONの構造（値の型・範囲の上下関係など）の検査のみを加える。
+
+    問題の一覧を（問題のあるキー、重大度、メッセージ）の組で返す（キーがNoneの場合はプロパティ名を指す）。
+    """
+    problems = []
+
+    def add(key, message, severity=ERROR):
+        problems.append((key, severity, message))
+
+    if not isinstance(prop, dict):
+        add(None, "プロパティはオブジェクトとしてください。")
+        return problems
+
+    # $refで参照する$defsの断片を展開する
+    ref = prop.get("$ref")
+    if ref is not None:
+        name = e2t.defs_ref_name(ref)
+        if name is None or name not in defs:
+            add("$ref", f"$refの参照先が$defsに存在しません。$ref={_json_text(ref)}")
+            return problems
+        if not isinstance(defs[name], dict):
+            add("$ref", f"$defsの{name}はオブジェクトとしてください。")
+            return problems
+        prop = {**defs[name], **{k: v for k, v in prop.items() if k != "$ref"}}
+
+    # typeは変換できる型のいずれかである必要あり
+    dtype = prop.get("type")
+    try:
+        e2t.validate_dtype(dtype)
+    except e2t.ExcelError as e:
+        add("type", e)
+        return problems
+
+    # 内容サンプル（invoiceは配列、catalogは値）・初期値・固定値
+    values = []
+    if "examples" in prop:
+        examples = prop["examples"]
+        if isinstance(examples, list):
+            values.extend(("examples", v) for v in examples)
+        elif not examples_array:
+            values.append(("examples", examples))
+        else:
+            add("examples", "examplesは配列としてください。")
+    if "default" in prop:
+        values.append(("default", prop["default"]))
+    const = prop.get("const")
+    for key, v in values + ([("const", const)] if "const" in prop else []):
+        if not e2t.dtype_matches(dtype, v):
+            add(key, f"{key}の値{_json_text(v)}が、type={dtype}と一致しません。")
+    values = [(key, v) for key, v in values if e2t.dtype_matches(dtype, v)]
+
+    # 値のリスト
+    enum = prop.get("enum")
+    if enum is not None:
+        if not isinstance(enum, list) or not enum:
+            add("enum", "enumは値が1つ以上の配列としてください。")
+            enum = None
+        else:
+            mismatched = [v for v in enum if not e2t.dtype_matches(dtype, v)]
+            if mismatched:
+                add(
+                    "enum",
+                    f"enumの値が、type={dtype}と一致しません: {e2t.enum_info(mismatched)}",
+                )
+            counts = Counter(_json_text(v) for v in enum)
+            dup = [k for k, c in counts.items() if c > 1]
+            if dup:
+                add("enum", f"enumに重複する値があります: {', '.join(dup)}", WARNING)
+    if enum and "const" in prop:
+        for message in e2t.property_value_problems(const, {"enum": enum}, "constの値"):
+            add("const", message)
+
+    # 数値の範囲
+    bounds = {}
+    for key in ("maximum", "exclusiveMaximum", "minimum", "exclusiveMinimum"):
+        if key not in prop:
+            continue
+        if not e2t.is_number(prop[key]):
+            add(key, f"{key}の値は数値としてください。")
+        elif dtype not in ("number", "integer"):
+            add(key, f"{key}は、typeがnumber・integerの場合のみ有効です。", WARNING)
+        else:
+            bounds[key] = prop[key]
+    for low in ("minimum", "exclusiveMinimum"):
+        for high in ("maximum", "exclusiveMaximum"):
+            if low in bounds and high in bounds:
+                lo, hi = bounds[low], bounds[high]
+                if lo > hi or (lo == hi and (low, high) != ("minimum", "maximum")):
+                    add(low, f"数値の下限（{low}={lo}）が上限（{high}={hi}）以上です。")
+
+    # 文字数の範囲
+    lengths = {}
+    for key in ("maxLength", "minLength"):
+        if key not in prop:
+            continue
+        v = prop[key]
+        if not (e2t.is_number(v) and float(v).is_integer() and v >= 0):
+            add(key, f"{key}の値は0以上の整数としてください。")
+        elif dtype != "string":
+            add(key, f"{key}は、typeがstringの場合のみ有効です。", WARNING)
+        else:
+            lengths[key] = v
+    if lengths.get("minLength", 0) > lengths.get("maxLength", float("inf")):
+        add(
+            "minLength",
+            f"最小文字数（minLength={lengths['minLength']}）が"
+            f"最大文字数（maxLength={lengths['maxLength']}）を上回っています。",
+        )
+
+    # 正規表現（RDEの画面とPythonの両方で解釈でき、照合に時間がかかり得る形でないこと）
+    pattern = prop.get("pattern")
+    if pattern is not None:
+        if not isinstance(pattern, str):
+            add("pattern", "patternの値は文字列としてください。")
+            pattern = None
+        else:
+            try:
+                e2t.compile_pattern(pattern)
+            except e2t.ExcelError as e:
+                add("pattern", e)
+                pattern = None
+        if pattern is not None and dtype != "string":
+            add("pattern", "patternは、typeがstringの場合のみ有効です。", WARNING)
+            pattern = None
+
+    # 値（内容サンプル・初期値）が、固定値・値のリスト・範囲・正規表現・フォーマットに合うこと
+    # （JSONの構造に問題がある範囲・文字数・正規表現は除いて、変換と同じ規則で調べる）
+    rules = {"type": dtype, **bounds, **lengths}
+    if "const" in prop:
+        rules["const"] = const
+    if enum:
+        rules["enum"] = enum
+    if pattern is not None:
+        rules["pattern"] = pattern
+    for key, v in values:
+        try:
+            for message in e2t.property_value_problems(v, rules, f"{key}の値"):
+                add(key, message)
+        except e2t.ExcelError as e:
+            add("pattern", e)
+        if dtype != "string":
+            continue
+        if prop.get("format") == "date":
+            try:
+                date.fromisoformat(v)
+            except ValueError:
+                add(key, f"{key}の値は、YYYY-MM-DD形式の日付としてください。{key}={v}")
+
+    return problems
+
+
+def _term_const(item, key):
+    """sampleの項目から、termId・classIdの固定値を取り出す機能"""
+    properties = item.get("properties") if isinstance(item, dict) else None
+    if not isinstance(properties, dict) or not isinstance(properties.get(key), dict):
+        return None
+    return properties[key].get("const")
+
+
+def term_key(section, item):
+    """sampleの項目の用語（generalAttributesはtermId、specificAttributesはclassIdとtermIdの組）を返す機能"""
+    if section == "generalAttributes":
+        return _term_const(item, "termId")
+    return _term_const(item, "classId"), _term_const(item, "termId")
+
+
+def check_term_item(section, item, vocabulary):
+    """sampleの1つ分の項目（generalAttributes・specificAttributes）の用語IDを検査する機能"""
+    problems = []
+    if not isinstance(item, dict):
+        return [(None, ERROR, "項目はオブジェクトとしてください。")]
+
+    keys = ("termId",) if section == "generalAttributes" else ("classId", "termId")
+    required = item.get("required")
+    missing = [k for k in keys if not isinstance(required, list) or k not in required]
+    if missing:
+        problems.append((
+            "required",
+            WARNING,
+            f"requiredに{', '.join(missing)}を含めてください。",
+        ))
+    key = term_key(section, item)
+    ids = key if isinstance(key, tuple) else (key,)
+    if not all(isinstance(v, str) for v in ids):
+        problems.append((
+            "properties",
+            ERROR,
+            f"{'・'.join(keys)}のconstに用語IDを文字列で指定してください。",
+        ))
+        return problems
+
+    # 用語シート（用語ストア）が指定されていない場合は、IDの有無は検査しない
+    if vocabulary is None:
+        return problems
+    if section == "generalAttributes":
+        if key not in vocabulary.general:
+            problems.append((
+                "properties",
+                ERROR,
+                f"termId={key}は、{e2t.GENERAL_TERM_SHEET}のterm_idに存在しません。",
+            ))
+    elif key not in vocabulary.specific:
+        class_id, term_id = key
+        if class_id not in vocabulary.classes:
+            message = f"classId={class_id}は、{e2t.SPECIFIC_TERM_SHEET}のsample_class_idに存在しません。"
+        else:
+            message = (
+                f"classId={class_id}とtermId={term_id}の組み合わせは、"
+                f"{e2t.SPECIFIC_TERM_SHEET}に存在しません。"
+            )
+        problems.append(("properties", ERROR, message))
+    return problems
+
+
+class Vocabulary:
+    """用語シート（または用語ストア）の用語IDを、一度だけ読み込んで保持するクラス"""
+
+    def __init__(self, general, specific):
+        # 一般項目のterm_idと、分類別項目のsample_class_idとterm_idの組
+        self.general = frozenset(general)
+        self.specific = frozenset(specific)
+        self.classes = frozenset(c for c, _ in self.specific)
+
+    @classmethod
+    def from_term_store(cls, term_store):
+        """用語ストア（SQLiteファイル）から読み込む機能"""
+        con = term_store.con
+        general = con.execute(f'SELECT term_id FROM "{e2t.GENERAL_TERM_SHEET}"')
+        specific = con.execute(
+            f'SELECT sample_class_id, term_id FROM "{e2t.SPECIFIC_TERM_SHEET}"'
+        )
+        return cls((r[0] for r in general), (tuple(r) for r in specific))
+
+    @classmethod
+    def from_workbook(cls, wb):
+        """用語シートを含むワークブック（Excelファイル、CSV/TSVファイルのフォルダ）から読み込む機能"""
+        sheets = []
+        for sheet_name in (e2t.GENERAL_TERM_SHEET, e2t.SPECIFIC_TERM_SHEET):
+            ws = e2t.get_sheet(wb, sheet_name)
+            if not ws:
+                raise e2t.ExcelError(f"{sheet_name}のシートが見つかりませんでした。")
+            sheets.append(list(e2t.read_simple_sheet(ws)))
+        general, specific = sheets
+        return cls(
+            (d["term_id"] for d in general),
+            ((d["sample_class_id"], d["term_id"]) for d in specific),
+        )
+
+
+class SchemaDocument:
+    """編集中のスキーマファイル1つ分の、検査の単位ごとの前回の結果を保持するクラス
+
+    検査の単位（プロパティ・sampleの項目）の文字列と、参照する$defsの断片の文字列が
+    前回と同じ場合は、前回の結果を位置だけ移して再利用する。
+    """
+
+    def __init__(self, path, vocabulary=None):
+        self.path = path
+        self.vocabulary = vocabulary
+        # (区分, 単位の文字列) -> (参照する$defsの名前と文字列の組, 単位の先頭からの位置と問題)
+        self._cache = {}
+
+    def update(self, text):
+        """文字列全体を受け取り、変更された単位のみを検査して、全体の診断を返す機能"""
+        t = time.perf_counter()
+        try:
+            scan = SchemaScan(text)
+        except JSONDecodeError as e:
+            # 構文の誤りのみ返す（前回の結果は、修正後の検査で再利用する）
+            problems = [
+                (e.pos, e.pos + 1, ERROR, f"JSONとして解釈できません（{e.msg}）。")
+            ]
+            return self._result(text, problems, 0, 0, t)
+
+        def_texts = {
+            u.name: text[u.start : u.end] for u in scan.units if u.section == "$defs"
+        }
+        defs = {u.name: u.value for u in scan.units if u.section == "$defs"}
+        cache = {}
+        problems = []
+        checked = 0
+        units = [u for u in scan.units if u.section != "$defs"]
+        for u in units:
+            unit_text = text[u.start : u.end]
+            key = (u.section, unit_text)
+            entry = cache.get(key) or self._cache.get(key)
+            if entry is None or any(def_texts.get(n) != d for n, d in entry[0]):
+                entry = self._check_unit(u, unit_text, defs, def_texts)
+                checked += 1
+            cache[key] = entry
+            for rel in entry[1]:
+                start, end, severity, message = rel
+                if start is None:
+                    start, end = u.key_pos, u.key_end
+                else:
+                    start, end = u.start + start, u.start + end
+                problems.append((start, end, severity, message))
+        # 今回の文字列にない単位の結果は破棄する
+        self._cache = cache
+
+        problems.extend(self._check_document(scan, units))
+        problems.sort(key=lambda p: p[0])
+        return self._result(text, problems, checked, len(units), t)
+
+    def _check_unit(self, u, unit_text, defs, def_texts):
+        """1つ分の単位を検査し、単位の先頭からの位置とともに問題を返す機能"""
+        refs = ()
+        if u.section in PROPERTY_SECTIONS:
+            problems = check_property(u.value, defs, PROPERTY_SECTIONS[u.section])
+            ref = u.value.get("$ref") if isinstance(u.value, dict) else None
+            name = e2t.defs_ref_name(ref)
+            if name is not None:
+                refs = ((name, def_texts.get(name)),)
+        else:
+            problems = check_term_item(u.section, u.value, self.vocabulary)
+        problems = [
+            (key, severity, str(message)) for key, severity, message in problems
+        ]
+        problems.extend(
+            ("", ERROR, f"キー{k}が重複しています。")
+            for k in _duplicate_keys(unit_text)
+        )
+
+        # 問題のあるキーの位置（$defsの断片のキーなど、単位内にない場合はプロパティ名を指す）
+        positions = member_positions(unit_text) if isinstance(u.value, dict) else {}
+        rel = []
+        for key, severity, message in problems:
+            pos = positions.get(key) or (positions.get("$ref") if refs else None)
+            rel.append((*(pos or (None, None)), severity, message))
+        return refs, rel
+
+    def _check_document(self, scan, units):
+        """単位をまたぐ規則（キーの重複、requiredの名前、用語の重複）を検査する機能（毎回全体を検査する）"""
+        problems = [
+            (pos, end, ERROR, f"キー{key}が重複しています。")
+            for pos, end, key in scan.duplicates
+        ]
+        for section in PROPERTY_SECTIONS:
+            if f"{section}.required" not in scan.values:
+                continue
+            pos, end, required = scan.values[f"{section}.required"]
+            if not isinstance(required, list):
+                problems.append((pos, end, ERROR, "requiredは配列としてください。"))
+                continue
+            names = {u.name for u in units if u.section == section}
+            for name, c in Counter(map(_json_text, required)).items():
+                if c > 1:
+                    problems.append((
+                        pos,
+                        end,
+                        WARNING,
+                        f"requiredの{name}が重複しています。",
+                    ))
+            for name in required:
+                if name not in names:
+                    problems.append((
+                        pos,
+                        end,
+                        ERROR,
+                        f"requiredの{_json_text(name)}は、propertiesに存在しません。",
+                    ))
+
+        seen = {}
+        for u in units:
+            if u.section in PROPERTY_SECTIONS:
+                continue
+            key = term_key(u.section, u.value)
+            if key is None or None in (key if isinstance(key, tuple) else ()):
+                continue
+            if (u.section, key) in seen:
+                problems.append((
+                    u.start,
+                    u.start + 1,
+                    WARNING,
+                    f"同じ用語の項目が重複しています（{seen[u.section, key] + 1}番目の項目と重複）。",
+                ))
+            else:
+                seen[u.section, key] = u.name
+        return problems
+
+    def _result(self, text, problems, checked, total, t):
+        """診断の一覧を、LSPのDiagnosticと同じ形にして返す機能"""
+        line_starts = None
+        diagnostics = []
+        for start, end, severity, message in problems:
+            if line_starts is None:
+                line_starts = [0] + [m.end() for m in re.finditer("\n", text)]
+            diagnostics.append({
+                "range": {
+                    "start": _position(text, line_starts, start),
+                    "end": _position(text, line_starts, end),
+                },
+                "severity": severity,
+                "source": "excel2template",
+                "message": message,
+            })
+        return {
+            "path": self.path,
+            "diagnostics": diagnostics,
+            "checked": checked,
+            "units": total,
+            "elapsed_ms": round((time.perf_counter() - t) * 1000, 3),
+        }
+
+
+def _position(text, line_starts, offset):
+    """文字列の位置を、行と文字（UTF-16の単位、いずれも0始まり）にする機能"""
+    offset = min(offset, len(text))
+    line = bisect.bisect_right(line_starts, offset) - 1
+    prefix = text[line_starts[line] : offset]
+    return {"line": line, "character": len(prefix.encode("utf_16_le")) // 2}
+
+
+class RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+class DiagnosticsServer:
+    """標準入出力のJSON-RPCで、編集中のスキーマファイルの診断を返すサーバー
+
+    メッセージは1行に1件のJSON、またはLSPと同じContent-Lengthのヘッダー付きで受け取り、
+    受け取った形式で応答する。用語IDと、ファイルごとの前回の結果はメモリに保持する。
+    """
+
+    def __init__(self, vocabulary=None):
+        self.vocabulary = vocabulary
+        self.documents = {}
+        self.running = True
+
+    def _document(self, params):
+        if not isinstance(params, dict) or not isinstance(params.get("path"), str):
+            raise RpcError(INVALID_PARAMS, "params.pathを指定してください。")
+        path = params["path"]
+        if path not in self.documents:
+            self.documents[path] = SchemaDocument(path, self.vocabulary)
+        return self.documents[path]
+
+    def _text(self, params):
+        """params.text（ない場合はファイルの内容）を返す機能"""
+        text = params.get("text")
+        if text is None:
+            try:
+                return Path(params["path"]).read_text(encoding="utf_8")
+            except OSError as e:
+                raise RpcError(
+                    INVALID_PARAMS, f"ファイルを読み込めません。原因: {e}"
+                ) from e
+        if not isinstance(text, str):
+            raise RpcError(INVALID_PARAMS, "params.textは文字列としてください。")
+        return text
+
+    def rpc_initialize(self, params):
+        vocabulary = self.vocabulary
+        return {
+            "name": "template_diagnostics",
+            "vocabulary": None
+            if vocabulary is None
+            else {
+                "general": len(vocabulary.general),
+                "specific": len(vocabulary.specific),
+            },
+        }
+
+    def rpc_open(self, params):
+        document = self._document(params)
+        result = document.update(self._text(params))
+        if "version" in params:
+            result["version"] = params["version"]
+        return result
+
+    # 変更時も文字列全体を受け取る（変更された単位は、前回の結果と比べて判定する）
+    rpc_change = rpc_open
+
+    def rpc_close(self, params):
+        if not isinstance(params, dict) or not isinstance(params.get("path"), str):
+            raise RpcError(INVALID_PARAMS, "params.pathを指定してください。")
+        self.documents.pop(params["path"], None)
+
+    def rpc_shutdown(self, params):
+        self.documents.clear()
+
+    def rpc_exit(self, params):
+        self.running = False
+
+    def handle(self, message):
+        """1件のリクエストを処理し、応答（通知の場合はNone）を返す機能"""
+        if not isinstance(message, dict) or not isinstance(message.get("method"), str):
+            return _error(None, RpcError(INVALID_PARAMS, "不正なリクエストです。"))
+        request_id = message.get("id")
+        method = getattr(self, "rpc_" + message["method"], None)
+        try:
+            if method is None:
+                raise RpcError(
+                    METHOD_NOT_FOUND, f"メソッド{message['method']}はありません。"
+                )
+            result = method(message.get("params") or {})
+        except RpcError as e:
+            return None if request_id is None else _error(request_id, e)
+        except Exception as e:
+            error = RpcError(INTERNAL_ERROR, f"検査に失敗しました。原因: {e}")
+            return None if request_id is None else _error(request_id, error)
+        if request_id is None:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    def serve(self, reader, writer):
+        """リクエストを1件ずつ読み込んで応答する機能（exit、または入力の終わりで終了する）"""
+        while self.running:
+            line = reader.readline()
+            if not line:
+                break
+            framed = line.lower().startswith(b"content-length:")
+            if framed:
+                length = int(line.split(b":", 1)[1])
+                # 残りのヘッダーは読み飛ばす
+                while reader.readline().strip():
+                    pass
+                body = reader.read(length)
+            elif not line.strip():
+                continue
+            else:
+                body = line
+            try:
+                response = self.handle(json.loads(body))
+            except ValueError as e:
+                response = _error(
+                    None, RpcError(PARSE_ERROR, f"JSONとして解釈できません（{e}）。")
+                )
+            if response is None:
+                continue
+            data = json.dumps(response, ensure_ascii=False).encode("utf_8")
+            if framed:
+                writer.write(b"Content-Length: %d\r\n\r\n" % len(data) + data)
+            else:
+                writer.write(data + b"\n")
+            writer.flush()
+
+
+def _error(request_id, error):
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {"code": error.code, "message": str(error)},
+    }
+
+
+def print_diagnostics(result):
+    """診断を1行に1件表示する機能"""
+    severity = {ERROR: "エラー", WARNING: "警告"}
+    for d in result["diagnostics"]:
+        start = d["range"]["start"]
+        print(
+            f" - {result['path']}:{start['line'] + 1}:{start['character'] + 1}: "
+            f"[{severity[d['severity']]}] {d['message']}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="check invoice.schema.json / catalog.schema.json with the rules of excel2template.py. "
+        "Without files, serve diagnostics as JSON-RPC over stdio."
+    )
+    parser.add_argument(
+        "files", type=str, nargs="*", help="Schema files to check once and exit."
+    )
+    vocab = parser.add_mutually_exclusive_group()
+    vocab.add_argument(
+        "--term-db", type=str, help="Term store used to check termId/classId."
+    )
+    vocab.add_argument(
+        "--terms",
+        type=str,
+        help="Excel file or CSV/TSV folder with the term sheets used to check termId/classId.",
+    )
+    args = parser.parse_args()
+
+    # 応答以外の表示は標準エラー出力に出す
+    out = sys.stdout.buffer
+    with redirect_stdout(sys.stderr):
+        vocabulary = None
+        try:
+            if args.term_db:
+                term_store = e2t.TermStore(args.term_db)
+                vocabulary = Vocabulary.from_term_store(term_store)
+                term_store.close()
+            elif args.terms:
+                wb = e2t.open_workbook(args.terms)
+                vocabulary = Vocabulary.from_workbook(wb)
+                wb.close()
+        except e2t.ExcelError as e:
+            parser.error(str(e))
+
+        if not args.files:
+            server = DiagnosticsServer(vocabulary)
+            server.serve(sys.stdin.buffer, out)
+            return
+
+    has_error = False
+    for file in args.files:
+        result = SchemaDocument(file, vocabulary).update(
+            Path(file).read_text(encoding="utf_8")
+        )
+        print_diagnostics(result)
+        has_error |= any(d["severity"] == ERROR for d in result["diagnostics"])
+    sys.exit(1 if has_error else 0)
+
+
+if __name__ == "__main__":
+    main()
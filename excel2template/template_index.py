@@ -0,0 +1,433 @@
+# -------------------------------------------------
+# template_index.py
+# This program is for searching parameters defined in many dataset templates in RDE.
+#
+# Copyright (c) 2025, MDPF(Materials Data Platform), NIMS
+#
+# This software is released under the MIT License.
+# -------------------------------------------------
+
+from pathlib import Path
+import json
+import sqlite3
+import tempfile
+import argparse
+import time
+
+import excel2template as e2t
+
+# 索引の対象とする出力ファイル
+INDEXED_FILES = ("metadata-def.json", "invoice.schema.json", "catalog.schema.json")
+
+# パラメータ1件分の列
+PARAM_COLUMNS = (
+    "template",
+    "file",
+    "section",
+    "name",
+    "label_ja",
+    "label_en",
+    "unit",
+    "type",
+    "term_id",
+    "class_id",
+    "original_name",
+)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER,
+    size INTEGER
+);
+CREATE TABLE IF NOT EXISTS params (
+    source TEXT,
+    {", ".join(f"{c} TEXT" for c in PARAM_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS "params.source" ON params (source);
+CREATE INDEX IF NOT EXISTS "params.name" ON params (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS "params.label_ja" ON params (label_ja);
+CREATE INDEX IF NOT EXISTS "params.label_en" ON params (label_en COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS "params.unit" ON params (unit);
+CREATE INDEX IF NOT EXISTS "params.type" ON params (type);
+CREATE INDEX IF NOT EXISTS "params.term_id" ON params (term_id);
+CREATE INDEX IF NOT EXISTS "params.original_name" ON params (original_name COLLATE NOCASE);
+"""
+
+
+# 用語の項目の項目名（ja/en）とする用語シートの列（要件定義シートのlabel/ja・label/enと同じ）
+TERM_LABEL_COLUMNS = {
+    "generalAttributes": ("dict.term.name_ja", "dict.term.name_en"),
+    "specificAttributes": ("bind_class_and_term_ja", "bind_class_and_term_en"),
+}
+
+
+def _param(template, file, section, name, **kwargs):
+    """パラメータ1件分の行を作成する機能"""
+    row = dict.fromkeys(PARAM_COLUMNS)
+    row.update(template=template, file=file, section=section, name=name, **kwargs)
+    return row
+
+
+def _label(prop, key="label"):
+    """label（またはname）のja/enを返す機能"""
+    label = prop.get(key) or {}
+    return {"label_ja": label.get("ja"), "label_en": label.get("en")}
+
+
+def extract_metadata_def(jdata, template, terms=None):
+    """metadata-def.jsonからパラメータを取り出す機能"""
+    for name, prop in jdata.items():
+        yield _param(
+            template,
+            "metadata-def.json",
+            "metadata",
+            name,
+            **_label(prop, "name"),
+            unit=prop.get("unit"),
+            type=prop.get("schema", {}).get("type"),
+            original_name=prop.get("original_name"),
+        )
+
+
+def _extract_properties(properties, jdata, template, file, section):
+    """custom/catalogのpropertiesからパラメータを取り出す機能"""
+    for name, prop in properties.items():
+        prop = e2t.resolve_defs_ref(prop, jdata)
+        yield _param(
+            template,
+            file,
+            section,
+            name,
+            **_label(prop),
+            unit=prop.get("options", {}).get("unit"),
+            type=prop.get("type"),
+        )
+
+
+def _term_names(table, section, term_id, class_id):
+    """用語の項目の名前（key_name）と項目名を、用語テーブルから得る機能（見つからない場合はNone）"""
+    row = table.find_by_ids(term_id, class_id) if table and term_id else None
+    if row is None:
+        return None, {"label_ja": None, "label_en": None}
+    ja, en = TERM_LABEL_COLUMNS[section]
+    return row["key_name"], {"label_ja": row.get(ja), "label_en": row.get(en)}
+
+
+def extract_invoice_schema(jdata, template, terms=None):
+    """invoice.schema.jsonからパラメータを取り出す機能
+
+    termsは一般項目・分類別項目の用語テーブルの組とし、指定する場合は、
+    sampleの用語の項目の名前と項目名を、要件定義シートと同じく用語シートのkey_name・用語名とする。
+    """
+    properties = jdata.get("properties", {})
+    custom = properties.get("custom", {}).get("properties", {})
+    yield from _extract_properties(
+        custom, jdata, template, "invoice.schema.json", "custom"
+    )
+
+    sample = properties.get("sample", {}).get("properties", {})
+    tables = dict(zip(("generalAttributes", "specificAttributes"), terms or ()))
+    for section in ("generalAttributes", "specificAttributes"):
+        for item in sample.get(section, {}).get("items", []):
+            consts = {k: v.get("const") for k, v in item.get("properties", {}).items()}
+            term_id, class_id = consts.get("termId"), consts.get("classId")
+            name, labels = _term_names(tables.get(section), section, term_id, class_id)
+            yield _param(
+                template,
+                "invoice.schema.json",
+                section,
+                name,
+                **labels,
+                term_id=term_id,
+                class_id=class_id,
+            )
+
+
+def extract_catalog_schema(jdata, template, terms=None):
+    """catalog.schema.jsonからパラメータを取り出す機能"""
+    catalog = jdata.get("properties", {}).get("catalog", {}).get("properties", {})
+    yield from _extract_properties(
+        catalog, jdata, template, "catalog.schema.json", "catalog"
+    )
+
+
+EXTRACTORS = {
+    "metadata-def.json": extract_metadata_def,
+    "invoice.schema.json": extract_invoice_schema,
+    "catalog.schema.json": extract_catalog_schema,
+}
+
+
+def extract_json(path, template, terms=None):
+    """出力済みのJSONファイルからパラメータを取り出す機能（termsは用語テーブルの組）"""
+    with open(path, encoding="utf_8") as f:
+        jdata = json.load(f)
+    yield from EXTRACTORS[path.name](jdata, template, terms)
+
+
+def extract_workbook(path, term_store=None):
+    """Excelファイル（またはCSV/TSVファイルのフォルダ）を変換してパラメータを取り出す機能"""
+    template = path.name if path.is_dir() else path.stem
+    wb = e2t.open_workbook(path)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            output_dir = Path(tmp)
+            e2t.convert_workbook(wb, output_dir, INDEXED_FILES, term_store)
+            terms = e2t.get_term_tables(wb, term_store)
+            for name in INDEXED_FILES:
+                if output_dir.joinpath(name).exists():
+                    yield from extract_json(output_dir.joinpath(name), template, terms)
+    finally:
+        wb.close()
+
+
+def find_sources(paths):
+    """指定するパスから、索引の対象とするファイル・フォルダを探す機能"""
+    for path in map(Path, paths):
+        if path.is_file():
+            yield path
+        elif any(path.joinpath(name).exists() for name in INDEXED_FILES) or any(
+            f.name.startswith("要件定義(") for f in path.glob("*.[ct]sv")
+        ):
+            # 出力済みのテンプレートのフォルダ、またはCSV/TSVファイルのフォルダ
+            yield from _template_dir_sources(path)
+        else:
+            workbooks = sorted(path.rglob("*.xlsx"))
+            yield from workbooks
+            # Excelファイルから出力済みのフォルダは、同じテンプレートを重複して索引しない
+            output_dirs = {wb.parent.joinpath(wb.stem) for wb in workbooks}
+            for name in INDEXED_FILES:
+                for f in sorted(path.rglob(name)):
+                    if f.parent not in output_dirs:
+                        yield f
+
+
+def _template_dir_sources(path):
+    """テンプレートのフォルダ内の、索引の対象とするファイル・フォルダを返す機能"""
+    if any(f.name.startswith("要件定義(") for f in path.glob("*.[ct]sv")):
+        yield path
+    else:
+        for name in INDEXED_FILES:
+            if path.joinpath(name).exists():
+                yield path.joinpath(name)
+
+
+def _source_stat(path):
+    """変更の有無を判定するための更新日時とサイズを返す機能"""
+    if path.is_dir():
+        stats = [
+            f.stat() for f in path.iterdir() if f.suffix.lower() in (".csv", ".tsv")
+        ]
+        return max((s.st_mtime_ns for s in stats), default=0), sum(
+            s.st_size for s in stats
+        )
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+class TemplateIndex:
+    """データセットテンプレートのパラメータの索引（SQLiteファイル）"""
+
+    def __init__(self, db_path):
+        self.con = sqlite3.connect(db_path)
+        self.con.row_factory = sqlite3.Row
+        self.con.executescript(SCHEMA)
+        # 部分一致検索に用いる全文検索の索引（利用できない環境ではLIKE検索とする）
+        try:
+            self.con.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS params_fts USING fts5"
+                "(name, label_ja, label_en, original_name, content='params', "
+                "content_rowid='rowid', tokenize='trigram')"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    def close(self):
+        self.con.close()
+
+    def _delete_source(self, source):
+        """1ファイル分のパラメータを削除する機能"""
+        if self.fts:
+            self.con.execute(
+                "INSERT INTO params_fts(params_fts, rowid, name, label_ja, label_en, "
+                "original_name) SELECT 'delete', rowid, name, label_ja, label_en, "
+                "original_name FROM params WHERE source = ?",
+                (source,),
+            )
+        self.con.execute("DELETE FROM params WHERE source = ?", (source,))
+        self.con.execute("DELETE FROM sources WHERE path = ?", (source,))
+
+    def update(self, paths, term_store=None):
+        """変更されたファイルだけを読み込み直して、索引を更新する機能"""
+        counts = {"added": 0, "skipped": 0, "removed": 0, "failed": 0}
+        seen = set()
+        for path in find_sources(paths):
+            source = str(path.resolve())
+            seen.add(source)
+            mtime_ns, size = _source_stat(path)
+            row = self.con.execute(
+                "SELECT mtime_ns, size FROM sources WHERE path = ?", (source,)
+            ).fetchone()
+            if row and (row["mtime_ns"], row["size"]) == (mtime_ns, size):
+                counts["skipped"] += 1
+                continue
+
+            try:
+                if path.name in INDEXED_FILES:
+                    # 出力済みのJSONでは、用語ストアがある場合のみ用語の項目名を得られる
+                    terms = (
+                        e2t.get_term_tables(None, term_store) if term_store else None
+                    )
+                    params = list(extract_json(path, path.parent.name, terms))
+                else:
+                    params = list(extract_workbook(path, term_store))
+            except Exception as e:
+                print(f" - {path}の読み込みに失敗しました。原因: {e}")
+                counts["failed"] += 1
+                continue
+
+            with self.con:
+                self._delete_source(source)
+                self.con.execute(
+                    "INSERT INTO sources VALUES (?, ?, ?)", (source, mtime_ns, size)
+                )
+                for p in params:
+                    cur = self.con.execute(
+                        f"INSERT INTO params VALUES (?, {', '.join('?' * len(PARAM_COLUMNS))})",
+                        (source, *(p[c] for c in PARAM_COLUMNS)),
+                    )
+                    if self.fts:
+                        self.con.execute(
+                            "INSERT INTO params_fts(rowid, name, label_ja, label_en, "
+                            "original_name) VALUES (?, ?, ?, ?, ?)",
+                            (
+                                cur.lastrowid,
+                                p["name"],
+                                p["label_ja"],
+                                p["label_en"],
+                                p["original_name"],
+                            ),
+                        )
+            counts["added"] += 1
+
+        # 指定したフォルダ内で削除されたファイルの分を索引から除く
+        roots = [str(Path(p).resolve()) for p in paths]
+        with self.con:
+            for (source,) in self.con.execute("SELECT path FROM sources").fetchall():
+                if source not in seen and any(
+                    Path(source).is_relative_to(r) for r in roots
+                ):
+                    self._delete_source(source)
+                    counts["removed"] += 1
+        return counts
+
+    def query(
+        self,
+        name=None,
+        search=None,
+        unit=None,
+        dtype=None,
+        term_id=None,
+        section=None,
+        limit=100,
+    ):
+        """条件に一致するパラメータを返す機能"""
+        where = []
+        args = []
+        if name:
+            where.append("p.name = ? COLLATE NOCASE")
+            args.append(name)
+        if search:
+            if self.fts and len(search) >= 3:
+                where.append(
+                    "p.rowid IN (SELECT rowid FROM params_fts WHERE params_fts MATCH ?)"
+                )
+                args.append('"' + search.replace('"', '""') + '"')
+            else:
+                where.append(
+                    "(p.name LIKE ? OR p.label_ja LIKE ? OR p.label_en LIKE ? "
+                    "OR p.original_name LIKE ?)"
+                )
+                args += [f"%{search}%"] * 4
+        for col, value in (
+            ("unit", unit),
+            ("type", dtype),
+            ("term_id", term_id),
+            ("section", section),
+        ):
+            if value:
+                where.append(f"p.{col} = ?")
+                args.append(value)
+
+        sql = f"SELECT {', '.join(PARAM_COLUMNS)}, source FROM params p"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY template, file, section, name LIMIT ?"
+        return [dict(r) for r in self.con.execute(sql, (*args, limit))]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="build and search an index of parameters over many dataset templates."
+    )
+    parser.add_argument("index", type=str, help="Path to the index file (SQLite).")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_update = sub.add_parser(
+        "update",
+        help="Add or refresh templates (generated JSON, Excel files or folders).",
+    )
+    p_update.add_argument("paths", type=str, nargs="+")
+    p_update.add_argument(
+        "--term-db",
+        type=str,
+        help="Term store used when converting Excel files and for naming sample terms "
+        "in JSON files.",
+    )
+
+    p_query = sub.add_parser("query", help="Search parameters.")
+    p_query.add_argument(
+        "--name", type=str, help="parameter name (exact, case-insensitive)"
+    )
+    p_query.add_argument(
+        "--search", type=str, help="substring of name, labels or original_name"
+    )
+    p_query.add_argument("--unit", type=str)
+    p_query.add_argument("--type", type=str, dest="dtype")
+    p_query.add_argument("--term-id", type=str)
+    p_query.add_argument("--section", type=str)
+    p_query.add_argument("--limit", type=int, default=100)
+    p_query.add_argument("--json", action="store_true", help="output as JSON lines")
+    args = parser.parse_args()
+
+    index = TemplateIndex(args.index)
+    if args.command == "update":
+        term_store = e2t.TermStore(args.term_db) if args.term_db else None
+        counts = index.update(args.paths, term_store)
+        print(", ".join(f"{k}={v}" for k, v in counts.items()))
+    else:
+        t = time.perf_counter()
+        rows = index.query(
+            args.name,
+            args.search,
+            args.unit,
+            args.dtype,
+            args.term_id,
+            args.section,
+            args.limit,
+        )
+        elapsed = (time.perf_counter() - t) * 1000
+        for r in rows:
+            if args.json:
+                print(json.dumps(r, ensure_ascii=False))
+            else:
+                print("\t".join("" if v is None else str(v) for v in r.values()))
+        if not args.json:
+            print(f"{len(rows)}件 ({elapsed:.1f} ms)")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
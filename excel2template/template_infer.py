@@ -0,0 +1,470 @@
+# -------------------------------------------------
+# template_infer.py
+# This program is for inferring requirement sheets from existing invoice.json / catalog.json instances in RDE.
+#
+# Copyright (c) 2025, MDPF(Materials Data Platform), NIMS
+#
+# This software is released under the MIT License.
+# -------------------------------------------------
+
+from pathlib import Path
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+import os
+import io
+import csv
+import json
+import re
+import argparse
+
+from openpyxl import Workbook
+
+# 推論の対象とするインスタンスファイルと、プロパティを格納する部分
+INSTANCE_SECTIONS = {"invoice.json": "custom", "catalog.json": "catalog"}
+
+# 出力するシート名
+SHEET_NAMES = {
+    "invoice.json": "要件定義(invoice.schema.json)",
+    "catalog.json": "要件定義(catalog.schema.json)",
+}
+
+# 要件定義シートのヘッダー（catalogはcategory_name・term・taxonomyの列を持たない）
+INVOICE_HEADER = [
+    "category_name",
+    "output",
+    "parameter_name",
+    "term",
+    "label/ja",
+    "label/en",
+    "taxonomy",
+    "required",
+    "type",
+    "format",
+    "description",
+    "examples",
+    "default",
+    "const",
+    "enum",
+    "options/widget",
+    "options/rows",
+    "options/unit",
+    "options/placeholder/ja",
+    "options/placeholder/en",
+    "maximum",
+    "exclusiveMaximum",
+    "minimum",
+    "exclusiveMinimum",
+    "maxLength",
+    "minLength",
+    "pattern",
+]
+CATALOG_HEADER = [
+    c for c in INVOICE_HEADER if c not in ("category_name", "term", "taxonomy")
+]
+
+# ヘッダーの説明（読み込み時は「ヘッダー」の行として読み飛ばされる）
+HEADER_LABELS = {
+    "category_name": "カテゴリー名",
+    "output": "出力制御",
+    "parameter_name": "パラメータ名",
+    "term": "用語名",
+    "label/ja": "項目名(日本語)",
+    "label/en": "項目名(英語)",
+    "taxonomy": "タクソノミー",
+    "required": "必須項目",
+    "type": "データ型",
+    "format": "フォーマット",
+    "description": "説明",
+    "examples": "内容サンプル",
+    "default": "初期値",
+    "const": "固定値",
+    "enum": "値のリスト",
+    "options/widget": "テキストエリア",
+    "options/rows": "行数",
+    "options/unit": "単位",
+    "options/placeholder/ja": "プレイスホルダ(日本語)",
+    "options/placeholder/en": "プレイスホルダ(英語)",
+    "maximum": "数値上限(以下)",
+    "exclusiveMaximum": "数値上限(未満)",
+    "minimum": "数値下限(以上)",
+    "exclusiveMinimum": "数値下限(より上)",
+    "maxLength": "最大文字数",
+    "minLength": "最小文字数",
+    "pattern": "正規表現",
+}
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+DATE_TIME_PATTERN = re.compile(
+    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})?"
+)
+
+
+class PropertyStats:
+    """1つのプロパティについて、インスタンスから観測した値の要約を保持するクラス
+
+    保持する内容は値の件数によらず一定（enumの候補はenum_cap件まで）であり、
+    複数のプロセスで集計した結果をmergeで合わせられる。
+    """
+
+    def __init__(self, enum_cap):
+        self.enum_cap = enum_cap
+        self.first = None
+        self.example_at = None
+        self.count = 0
+        self.types = set()
+        self.values = set()
+        self.overflow = False
+        self.nmin = self.nmax = None
+        self.smin = self.smax = None
+        self.dates = self.date_times = 0
+        self.example = None
+
+    def add(self, value, order):
+        """値を1件追加する機能（orderはインスタンス中での出現順、値がnullの場合は出現順のみ記録する）"""
+        if self.first is None or order < self.first:
+            self.first = order
+        if value is None:
+            return
+        if self.example_at is None or order < self.example_at:
+            self.example_at = order
+            self.example = value
+        self.count += 1
+        if isinstance(value, bool):
+            self.types.add("boolean")
+        elif isinstance(value, int):
+            self.types.add("integer")
+        elif isinstance(value, float):
+            self.types.add("number")
+        elif isinstance(value, str):
+            self.types.add("string")
+        else:
+            # 配列やオブジェクトは文字列として扱う
+            self.types.add("string")
+            value = json.dumps(value, ensure_ascii=False)
+
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.nmin = value if self.nmin is None else min(self.nmin, value)
+            self.nmax = value if self.nmax is None else max(self.nmax, value)
+        if isinstance(value, str):
+            self.smin = len(value) if self.smin is None else min(self.smin, len(value))
+            self.smax = len(value) if self.smax is None else max(self.smax, len(value))
+            if DATE_PATTERN.fullmatch(value):
+                self.dates += 1
+            elif DATE_TIME_PATTERN.fullmatch(value):
+                self.date_times += 1
+
+        if not self.overflow:
+            self.values.add(value)
+            if len(self.values) > self.enum_cap:
+                self.overflow = True
+                self.values = set()
+
+    def merge(self, other):
+        """他のプロセスで集計した結果を合わせる機能"""
+        if other.first is not None and (self.first is None or other.first < self.first):
+            self.first = other.first
+        if other.example_at is not None and (
+            self.example_at is None or other.example_at < self.example_at
+        ):
+            self.example_at = other.example_at
+            self.example = other.example
+        self.count += other.count
+        self.types |= other.types
+        if self.overflow or other.overflow:
+            self.overflow = True
+            self.values = set()
+        else:
+            self.values |= other.values
+            if len(self.values) > self.enum_cap:
+                self.overflow = True
+                self.values = set()
+        for name, func in (("nmin", min), ("nmax", max), ("smin", min), ("smax", max)):
+            a, b = getattr(self, name), getattr(other, name)
+            setattr(self, name, b if a is None else a if b is None else func(a, b))
+        self.dates += other.dates
+        self.date_times += other.date_times
+
+    @property
+    def dtype(self):
+        """観測した値から推論した型"""
+        if self.types == {"boolean"}:
+            return "boolean"
+        if self.types == {"integer"}:
+            return "integer"
+        if self.types <= {"integer", "number"}:
+            return "number"
+        return "string"
+
+    @property
+    def format(self):
+        """観測した値から推論したフォーマット（全ての値が日付の形式の場合のみ）"""
+        if self.dtype != "string" or not self.count:
+            return None
+        if self.dates == self.count:
+            return "date"
+        if self.date_times == self.count:
+            return "date-time"
+        return None
+
+    @property
+    def enum(self):
+        """観測した値から推論した値のリスト
+
+        値の種類がenum_cap件以下で、各値が平均2回以上現れる場合のみ値のリストとみなす。
+        """
+        if self.overflow or self.dtype not in ("string", "integer") or self.format:
+            return None
+        if len(self.values) < 2 or self.count < 2 * len(self.values):
+            return None
+        return sorted(self.values)
+
+
+class InstanceStats:
+    """インスタンスファイル群について、プロパティごとの要約を保持するクラス"""
+
+    def __init__(self, enum_cap):
+        self.enum_cap = enum_cap
+        self.n_docs = 0
+        self.schema_ids = set()
+        self.props = {}
+
+    def add_document(self, jdata, section, doc_index):
+        """インスタンス1件分のプロパティを追加する機能"""
+        self.n_docs += 1
+        if isinstance(jdata.get("$schema"), str):
+            self.schema_ids.add(jdata["$schema"])
+        props = jdata.get(section) or {}
+        for pos, (name, value) in enumerate(props.items()):
+            if name not in self.props:
+                self.props[name] = PropertyStats(self.enum_cap)
+            self.props[name].add(value, (doc_index, pos))
+
+    def merge(self, other):
+        """他のプロセスで集計した結果を合わせる機能"""
+        self.n_docs += other.n_docs
+        self.schema_ids |= other.schema_ids
+        for name, stats in other.props.items():
+            if name in self.props:
+                self.props[name].merge(stats)
+            else:
+                self.props[name] = stats
+
+    def ordered_props(self):
+        """プロパティを、インスタンス中で最初に現れた順に返す機能"""
+        return sorted(self.props.items(), key=lambda kv: kv[1].first)
+
+
+def iter_instance_files(paths, filename):
+    """フォルダを再帰的に走査して、インスタンスファイルを1件ずつ返す機能"""
+    for path in map(Path, paths):
+        if path.is_file():
+            if path.name == filename:
+                yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            if filename in files:
+                yield Path(root, filename)
+
+
+def _chunks(iterable, size):
+    """反復可能オブジェクトを、size件ごとのリストに分割する機能"""
+    it = iter(iterable)
+    start = 0
+    while chunk := list(islice(it, size)):
+        yield start, chunk
+        start += len(chunk)
+
+
+def _infer_chunk(args):
+    """インスタンスファイルのまとまりを集計する機能（ワーカープロセスで実行する）"""
+    filename, start, paths, enum_cap = args
+    stats = InstanceStats(enum_cap)
+    errors = []
+    for i, path in enumerate(paths):
+        try:
+            with open(path, encoding="utf_8") as f:
+                jdata = json.load(f)
+        except (OSError, ValueError) as e:
+            errors.append(f"{path}: {e}")
+            continue
+        stats.add_document(jdata, INSTANCE_SECTIONS[filename], start + i)
+    return stats, errors
+
+
+def infer_stats(paths, filename, enum_cap=20, jobs=None, chunk_size=500):
+    """インスタンスファイル群を複数のプロセスで集計し、プロパティごとの要約を返す機能
+
+    ファイルはchunk_size件ごとにワーカーへ渡し、集計結果のみを受け取って合わせるため、
+    メモリ使用量はファイル数によらずほぼ一定となる。
+    ワーカーに渡すまとまりはプロセス数の2倍までとし、集計が終わるごとに次のまとまりを渡す。
+    """
+    stats = InstanceStats(enum_cap)
+    errors = []
+    jobs = jobs or os.cpu_count() or 1
+    pending = deque()
+
+    def collect():
+        chunk_stats, chunk_errors = pending.popleft().get()
+        stats.merge(chunk_stats)
+        errors.extend(chunk_errors)
+
+    with Pool(jobs) as pool:
+        for start, chunk in _chunks(iter_instance_files(paths, filename), chunk_size):
+            if len(pending) >= jobs * 2:
+                collect()
+            pending.append(
+                pool.apply_async(_infer_chunk, ((filename, start, chunk, enum_cap),))
+            )
+        while pending:
+            collect()
+    return stats, errors
+
+
+def _number_text(v):
+    """数値を、整数の場合は小数点なしの文字列にする機能"""
+    return str(int(v)) if float(v).is_integer() else str(v)
+
+
+def _enum_text(values):
+    """値のリストを、enum列の形式（カンマ区切り、カンマを含む値は"で囲む）にする機能"""
+    f = io.StringIO()
+    csv.writer(f, lineterminator="").writerow(values)
+    return f.getvalue()
+
+
+def property_row(name, p, n_docs):
+    """プロパティの要約から、要件定義シートの1行分を作成する機能"""
+    row = {"output": "ON", "parameter_name": name, "label/ja": name, "label/en": name}
+    dtype = p.dtype
+    row["type"] = dtype
+    row["required"] = bool(n_docs) and p.count == n_docs
+    if p.format:
+        row["format"] = p.format
+    if p.example is not None:
+        # 真偽値・数値はそのまま書き込み、配列・オブジェクトはJSONの文字列にする
+        row["examples"] = (
+            p.example
+            if isinstance(p.example, (str, bool, int, float))
+            else json.dumps(p.example, ensure_ascii=False)
+        )
+    if p.enum:
+        row["enum"] = _enum_text([str(v) for v in p.enum])
+    if dtype in ("integer", "number") and p.nmin is not None:
+        row["minimum"] = _number_text(p.nmin)
+        row["maximum"] = _number_text(p.nmax)
+    if dtype == "string" and not p.format and p.smin is not None:
+        row["minLength"] = p.smin
+        row["maxLength"] = p.smax
+    return row
+
+
+def sheet_rows(filename, stats):
+    """要約から、要件定義シート（read_invoice_catalog_sheetで読み込める形式）の全行を作成する機能"""
+    header = INVOICE_HEADER if filename == "invoice.json" else CATALOG_HEADER
+    schema_id = sorted(stats.schema_ids)[0] if stats.schema_ids else ""
+
+    # ヘッダー部までの共通部分
+    yield ["$schema", "https://json-schema.org/draft/2020-12/schema"]
+    yield ["$id", schema_id]
+    yield ["description", ""]
+    if filename == "catalog.json":
+        yield ["title/ja", ""]
+        yield ["title/en", ""]
+    yield []
+    yield ["header"] + header
+    yield ["ヘッダー"] + [HEADER_LABELS[c] for c in header]
+
+    # データ部（先頭の行のみカテゴリーを記述する）
+    for i, (name, p) in enumerate(stats.ordered_props()):
+        row = property_row(name, p, stats.n_docs)
+        if filename == "invoice.json":
+            category = "custom"
+            if i == 0:
+                row["category_name"] = "固有情報"
+        else:
+            category = "catalog"
+        yield [category if i == 0 else None] + [row.get(c) for c in header]
+
+
+def write_sheets(sheets, output):
+    """要件定義シートを出力する機能（.xlsxの場合はExcelファイル、それ以外はCSVファイルのフォルダ）"""
+    output = Path(output)
+    if output.suffix.lower() == ".xlsx":
+        # 行数はプロパティの数に限られるため、シートの大きさ（dimension）を記録する通常のモードで書き込む
+        wb = Workbook()
+        wb.remove(wb.active)
+        for sheet_name, rows in sheets:
+            ws = wb.create_sheet(sheet_name)
+            for row in rows:
+                ws.append(row)
+        wb.save(output)
+    else:
+        output.mkdir(parents=True, exist_ok=True)
+        for sheet_name, rows in sheets:
+            with open(
+                output.joinpath(sheet_name + ".csv"),
+                "w",
+                newline="",
+                encoding="utf_8_sig",
+            ) as f:
+                csv.writer(f).writerows(
+                    ["" if v is None else v for v in row] for row in rows
+                )
+    print(f" - {output.name}を出力しました。")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="infer requirement sheets from directories of invoice.json / catalog.json instances."
+    )
+    parser.add_argument(
+        "paths", type=str, nargs="+", help="Folders (searched recursively) or files."
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        required=True,
+        help="Output Excel file (.xlsx) or folder of CSV files named after the sheets.",
+    )
+    parser.add_argument(
+        "--enum-cap",
+        type=int,
+        default=20,
+        help="Maximum number of distinct values treated as an enum.",
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, help="Number of worker processes."
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=500,
+        help="Number of files passed to a worker at a time.",
+    )
+    args = parser.parse_args()
+
+    sheets = []
+    for filename in INSTANCE_SECTIONS:
+        stats, errors = infer_stats(
+            args.paths, filename, args.enum_cap, args.jobs, args.chunk_size
+        )
+        for error in errors:
+            print(f" - 読み込めないファイルを除外しました。{error}")
+        if not stats.n_docs:
+            continue
+        print(
+            f" - {filename}: {stats.n_docs}件から{len(stats.props)}項目を推論しました。"
+        )
+        sheets.append((SHEET_NAMES[filename], list(sheet_rows(filename, stats))))
+
+    if not sheets:
+        print(" - invoice.json・catalog.jsonが見つかりません。")
+        return
+    write_sheets(sheets, args.output)
+
+
+if __name__ == "__main__":
+    main()